@@ -3,6 +3,8 @@ This package provides tools for analysing particular eigth edition
 warhammer forty thousand model loadouts.
 """
 from fractions import Fraction
+from itertools import count
+import weakref
 
 import amounts
 
@@ -11,6 +13,222 @@ D6 = amounts.SingleAmount(1, 6)
 D3 = amounts.SingleAmount(1, 3)
 ABILITY_ADD_MODIFICATION_NAME = 'add'
 
+# Every change to an item, ability or stat line gives it a new version,
+# later than any before, so the latest version of an item and all of its
+# parts is new whenever any of them changes.
+_versions = count(1)
+_latest_version = 0
+# This is set to a new version by invalidate_caches, which invalidates
+# every cached modified stat line and damage output.
+_cache_generation = 0
+
+
+def _get_new_version():
+    global _latest_version
+    _latest_version = next(_versions)
+    return _latest_version
+
+
+def invalidate_caches():
+    """
+    Invalidate all cached modified stat lines and damage outputs.
+    Assigning to an attribute of an item or ability, or to a stat of a
+    model or weapon, invalidates just the cached results that depend on
+    it without calling this, but it must still be called explicitly
+    after modifying an ability list, wargear list or stat_line_changes
+    dictionary in place.
+    """
+    global _cache_generation
+    _cache_generation = _get_new_version()
+
+
+class UnknownStatError(KeyError): pass
+
+
+# This is the value of the stats of a stat line that have not been given
+# one.
+_UNSET = object()
+
+
+def _get_versions(items):
+    return tuple([item._get_version() for item in items])
+
+
+def _cache_weakly(cache, key, items, versions, value):
+    """
+    Cache value at key in cache, where value depends on items, whose
+    versions were versions when it was worked out. The entry is removed
+    once any of items is garbage collected, so that the cache does not
+    keep them alive, or grow with items that are gone.
+    """
+    def remove(reference):
+        cache.pop(key, None)
+
+    # The last item is the latest version when the entry was last found
+    # to be up to date.
+    cache[key] = [
+        [weakref.ref(item, remove) for item in items],
+        versions,
+        value,
+        _latest_version
+    ]
+
+
+def _get_cached(cache, key, items):
+    """
+    Get the value cached at key in cache by _cache_weakly, raising a
+    KeyError if there is none, or items have changed since. Nothing can
+    have changed if no new version has been made since the entry was
+    last checked, so the versions of items are only worked out again if
+    one has.
+    """
+    entry = cache[key]
+    if entry[3] != _latest_version:
+        if entry[1] != _get_versions(items):
+            raise KeyError(key)
+        entry[3] = _latest_version
+    return entry[2]
+
+
+class StatLine:
+    """
+    The StatLine class is the base class of fixed schema stat lines,
+    which keep the value of each stat named in STAT_NAMES in a slot of
+    its own, rather than in a dictionary, so that they are small. Each
+    subclass must list its STAT_NAMES in its __slots__. They can be used
+    like dictionaries from stat names to values, and stats can also be
+    accessed by their index in STAT_NAMES. Stats need not all be given
+    values, but getting a stat that is not in STAT_NAMES, or has not
+    been given a value, or setting one that is not in STAT_NAMES, raises
+    an UnknownStatError. Copies are plain dictionaries, which is what
+    modified stat lines are. Changing a stat line in place changes the
+    version of the items it is part of.
+    """
+    __slots__ = ('_version',)
+    STAT_NAMES = ()
+
+    def __init_subclass__(cls, **keyword_arguments):
+        super().__init_subclass__(**keyword_arguments)
+        if set(cls.STAT_NAMES) - set(cls.__dict__.get('__slots__', ())):
+            raise TypeError(f'{cls.__name__} must have a slot for each stat')
+        # Each stat can be looked up by either its name or its index.
+        cls._NAMES = {name: name for name in cls.STAT_NAMES}
+        cls._NAMES.update(dict(enumerate(cls.STAT_NAMES)))
+
+    def __init__(self, stats={}):
+        """
+        Create a stat line with the values in stats, a dictionary (or
+        stat line) from stat names to values.
+        """
+        for name in self.STAT_NAMES:
+            setattr(self, name, _UNSET)
+        for name, value in stats.items():
+            setattr(self, self._get_name(name), value)
+        self._version = _get_new_version()
+
+    @classmethod
+    def get_index(cls, name):
+        """
+        Get the index of the stat called name.
+        """
+        try:
+            return cls.STAT_NAMES.index(name)
+        except ValueError:
+            raise UnknownStatError(
+                f'{cls.__name__} has no stat called {name!r}'
+            )
+
+    @classmethod
+    def _get_name(cls, name):
+        try:
+            return cls._NAMES[name]
+        except (KeyError, TypeError):
+            raise UnknownStatError(
+                f'{cls.__name__} has no stat called {name!r}'
+            )
+
+    def __getitem__(self, name):
+        try:
+            value = getattr(self, self._NAMES[name])
+        except (KeyError, TypeError):
+            raise UnknownStatError(
+                f'{type(self).__name__} has no stat called {name!r}'
+            )
+        if value is _UNSET:
+            raise UnknownStatError(f'stat {name!r} has not been given a value')
+        return value
+
+    def __setitem__(self, name, value):
+        setattr(self, self._get_name(name), value)
+        self._version = _get_new_version()
+
+    def __delitem__(self, name):
+        stat_name = self._get_name(name)
+        if getattr(self, stat_name) is _UNSET:
+            raise UnknownStatError(f'stat {name!r} has not been given a value')
+        setattr(self, stat_name, _UNSET)
+        self._version = _get_new_version()
+
+    def __contains__(self, name):
+        try:
+            return getattr(self, self._NAMES[name]) is not _UNSET
+        except (KeyError, TypeError):
+            return False
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except UnknownStatError:
+            return default
+
+    def keys(self):
+        return list(self.copy())
+
+    def values(self):
+        return list(self.copy().values())
+
+    def items(self):
+        return list(self.copy().items())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.copy())
+
+    def update(self, *arguments, **stats):
+        for name, value in dict(*arguments, **stats).items():
+            self[name] = value
+
+    def copy(self):
+        """
+        Get a dictionary from the names of the stats that have been given
+        values to their values.
+        """
+        stats = {}
+        for name in self.STAT_NAMES:
+            value = getattr(self, name)
+            if value is not _UNSET:
+                stats[name] = value
+        return stats
+
+    def __eq__(self, other):
+        if isinstance(other, StatLine):
+            return type(self) is type(other) and self.copy() == other.copy()
+        if isinstance(other, dict):
+            return self.copy() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __reduce__(self):
+        # Copies and stat lines from other processes get versions of their
+        # own when they are created.
+        return type(self), (self.copy(),)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.copy()!r})'
+
 
 class Ability:
     """
@@ -49,7 +267,7 @@ class Ability:
         if modification_type not in [
                 modification['name'] for modification in Ability.MODIFICATIONS
         ]:
-            raise InvalidModificationTypeError(
+            raise Ability.InvalidModificationTypeError(
                 'modification_type must be one of "multiply", "add" or "set"'
             )
 
@@ -59,6 +277,19 @@ class Ability:
         self.reroll_hits_at_or_below = reroll_hits_at_or_below
         self.reroll_wounds_at_or_below = reroll_wounds_at_or_below
 
+    def __setattr__(self, name, value):
+        super().__setattr__(name, value)
+        # Private attributes are only used for tracking changes, and so
+        # do not change anything.
+        if not name.startswith('_'):
+            super().__setattr__('_version', _get_new_version())
+
+    def __setstate__(self, state):
+        # Versions are only comparable within a process, so copies and
+        # abilities from other processes get new ones.
+        self.__dict__.update(state)
+        self._version = _get_new_version()
+
 
 class Item:
     """
@@ -68,19 +299,98 @@ class Item:
     """
     class InvalidAbilityError(Exception): pass
 
+    # The StatLine subclass that stat lines are converted to, if any.
+    STAT_LINE_TYPE = None
+
     def __init__(self, stat_line, points=0, wargear=[], abilities=[], name=''):
         """
         Create a model object, with the stats in stat_line, and points
         cost in points. The required contents of the statline differs
-        depending on the type of item, but it should be indexible.
-        Abilities must be an array of ability, or ability like objects.
+        depending on the type of item, but it should be indexible, and
+        it is converted to the STAT_LINE_TYPE of the item if it has
+        one. Abilities must be an array of ability, or ability like
+        objects.
         """
+        # The caches are created when first used, as most items, such as
+        # targets, are never cached against.
+        self._caches = None
+        self._caches_version = 0
+        self._caches_checked_version = 0
+        self._version = 0
         self.stat_line = stat_line
         self.points = points
         self.abilities = abilities
         self.wargear = wargear
         self.name = name
 
+    def __setattr__(self, name, value):
+        # Private attributes are only used for caching and tracking
+        # changes, and so do not change anything.
+        if not name.startswith('_'):
+            if name == 'stat_line' and self.STAT_LINE_TYPE is not None and \
+                    not isinstance(value, self.STAT_LINE_TYPE):
+                value = self.STAT_LINE_TYPE(value)
+            super().__setattr__('_version', _get_new_version())
+        super().__setattr__(name, value)
+
+    def _get_version(self):
+        """
+        Get the latest version of the item, its stat line, abilities and
+        wargear, which is new whenever any of them changes.
+        """
+        version = self._version
+        stat_line_version = getattr(self.stat_line, '_version', 0)
+        if stat_line_version > version:
+            version = stat_line_version
+        for ability in self.abilities:
+            ability_version = getattr(ability, '_version', 0)
+            if ability_version > version:
+                version = ability_version
+        for item in self.wargear:
+            item_version = item._get_version()
+            if item_version > version:
+                version = item_version
+        return version
+
+    def __getstate__(self):
+        # Caches are not copied or sent to other processes, as they can be
+        # much bigger than the item itself.
+        state = self.__dict__.copy()
+        state['_caches'] = None
+        state['_caches_version'] = 0
+        state['_caches_checked_version'] = 0
+        return state
+
+    def __setstate__(self, state):
+        # Versions are only comparable within a process, so copies and
+        # items from other processes get new ones.
+        self.__dict__.update(state)
+        self._version = _get_new_version()
+
+    def _get_cache(self, cache_name):
+        """
+        Get the dictionary the item uses as the cache called
+        cache_name, emptying all of its caches first if the item has
+        changed, or invalidate_caches has been called, since they were
+        last used. Entries that depend on other items must be cached
+        with _cache_weakly, and got with _get_cached.
+        """
+        # Nothing can have changed if no new version has been made since
+        # the caches were last checked.
+        if self._caches_checked_version != _latest_version:
+            version = self._get_version()
+            if _cache_generation > version:
+                version = _cache_generation
+            if self._caches_version != version:
+                self._caches = {}
+                self._caches_version = version
+            self._caches_checked_version = _latest_version
+        try:
+            return self._caches[cache_name]
+        except KeyError:
+            cache = self._caches[cache_name] = {}
+            return cache
+
 
 class Model(Item):
     """
@@ -109,8 +419,39 @@ class Model(Item):
         """
         Get a tulpe of the stat line of the model and of it's weapon
         (if given) after all the abilities of the wargear and the
-        weapon have been applied to them.
+        weapon have been applied to them. These are cached per weapon
+        until the model or weapon changes (or invalidate_caches is
+        called), and so the returned stat lines must not be modified.
         """
+        cache = self._get_cache('modified_stat_lines')
+        items = [] if weapon is None else [weapon]
+        try:
+            return _get_cached(cache, id(weapon), items)
+        except KeyError:
+            versions = _get_versions(items)
+            modified_stat_lines = self._compile_modified_stat_lines(weapon)
+            _cache_weakly(
+                cache,
+                id(weapon),
+                items,
+                versions,
+                modified_stat_lines
+            )
+            return modified_stat_lines
+
+    def _compile_modified_stat_lines(
+            self,
+            weapon,
+            self_stat_line=None,
+            weapon_stat_line=None
+        ):
+        # self_stat_line and weapon_stat_line are used in place of the stat
+        # lines of the model and weapon if they are given, so that the
+        # effects of changing a stat can be found without changing either.
+        if self_stat_line is None:
+            self_stat_line = self.stat_line
+        if weapon_stat_line is None and weapon is not None:
+            weapon_stat_line = weapon.stat_line
 
         # See, I could do it with list comprehensions if I wanted.
         # wargear_abilities = [
@@ -120,28 +461,35 @@ class Model(Item):
         wargear_abilities = self.get_wargear_abilities()
         weapon_abilities = weapon.abilities if weapon else []
 
-        modified_self_stat_line = self.stat_line.copy()
+        modified_self_stat_line = self_stat_line.copy()
         modified_self_stat_line[Model.TO_WOUND_ROLL_MODIFIER_STAT_NAME] = 0
         if weapon is None:
             modified_weapon_stat_line = {}
         else:
-            modified_weapon_stat_line = weapon.stat_line.copy()
+            modified_weapon_stat_line = weapon_stat_line.copy()
 
         # Modifiers happen in the order multiply, add, and set, and are
         # then followed by modifiers due to the weapon, as per the
-        # designers commentary.
+        # designers commentary. The abilities are grouped by their
+        # modification type in a single pass, rather than once per type.
 
         for current_abilities in (
                 self.abilities + wargear_abilities,
                 weapon_abilities
         ):
+            abilities_by_modification = {
+                modification['name']: []
+                for modification in Ability.MODIFICATIONS
+            }
+            for ability in current_abilities:
+                if weapon is None and not ability.affects_model:
+                    continue
+                abilities_by_modification[ability.modification_type].append(
+                    ability
+                )
+
             for modification in Ability.MODIFICATIONS:
-                for ability in [
-                    ability for ability in current_abilities
-                    if ability.modification_type == modification['name']
-                ]:
-                    if weapon is None and not ability.affects_model:
-                        continue
+                for ability in abilities_by_modification[modification['name']]:
                     stat_line = modified_self_stat_line if \
                         ability.affects_model else modified_weapon_stat_line
 
@@ -149,7 +497,7 @@ class Model(Item):
                         try:
                             stat_line[key] = modification['result'](
                                 stat_line[key],
-                                ability.stat_line_changes[key]
+                                modifier
                             )
                         except KeyError:
                             raise Item.InvalidAbilityError(
@@ -160,6 +508,18 @@ class Model(Item):
 
     @staticmethod
     def get_to_wound_roll(strength, toughness):
+        """
+        Get the roll needed to wound a model with the given toughness
+        using the given strength. Integer values up to
+        MAX_TABULATED_STAT are looked up in a precomputed table.
+        """
+        try:
+            return TO_WOUND_ROLLS[strength, toughness]
+        except KeyError:
+            return Model._calculate_to_wound_roll(strength, toughness)
+
+    @staticmethod
+    def _calculate_to_wound_roll(strength, toughness):
         if toughness == 0:
             return 2
 
@@ -177,16 +537,42 @@ class Model(Item):
 
         return wound_at_or_below
 
-    def get_average_damage_output(self, target, weapon):
+    def get_max_rerolls(self, weapon):
         """
-        Calculate the average damage output of a particular model with it's
-        given wargear, with a particular weapon.
+        Get a tuple of the largest values at or below which hit and
+        wound rolls may be rerolled, from all the abilities of the
+        model, its wargear and the weapon. Max will error if the
+        iterable it is given is empty, so, if that is the case, we
+        default to zero.
         """
+        all_abilities = (
+            self.abilities
+            + self.get_wargear_abilities()
+            + weapon.abilities
+        )
+        if not all_abilities:
+            return 0, 0
 
-        modified_self_stat_line, modified_weapon_stat_line = \
-            self.get_modified_stat_lines(weapon)
-        modified_target_stat_line, _ = target.get_modified_stat_lines()
+        return (
+            max(
+                [ability.reroll_hits_at_or_below for ability in all_abilities]
+            ),
+            max(
+                [
+                    ability.reroll_wounds_at_or_below
+                    for ability in all_abilities
+                ]
+            )
+        )
 
+    def get_hit_roll(self, weapon, modified_self_stat_line):
+        """
+        Get a tuple of the roll needed for a single attack with the
+        given weapon to hit, and the value at or below which failed hit
+        rolls are rerolled. modified_self_stat_line is the stat line of
+        the model after the abilities for that weapon have been
+        applied.
+        """
         if weapon.stat_line[Weapon.IS_MELEE_STAT_NAME]:
             unmodified_hit_stat = self.stat_line[Model.WEAPON_SKILL_STAT_NAME]
             modified_hit_stat = modified_self_stat_line[
@@ -205,28 +591,40 @@ class Model(Item):
         # below the original hit stat. If the needed to hit roll is improved
         # by modifications, that is okay to, as the get_probability_at_least
         # Amount method will only 'reroll' values below the
-        # value_to_be_at_least that it is given. Also, max will error if
-        # the iterable it is given is empty, so, if that is the case, we
-        # we default to zero.
+        # value_to_be_at_least that it is given.
 
-        all_abilities = (
-            self.abilities
-            + self.get_wargear_abilities()
-            + weapon.abilities
-        )
+        max_reroll_hits, _ = self.get_max_rerolls(weapon)
+        reroll_hits_at_or_below = min(max_reroll_hits, unmodified_hit_stat - 1)
 
-        reroll_hits_at_or_below = min(
-            max(
-                [ability.reroll_hits_at_or_below for ability in all_abilities]
-            ),
-            unmodified_hit_stat - 1
-        ) if all_abilities else 0
+        return modified_hit_stat, reroll_hits_at_or_below
 
-        hit_chance = D6.get_probability_at_least(
+    def get_hit_chance(self, weapon, modified_self_stat_line, backend=None):
+        """
+        Get the chance of a single attack with the given weapon hitting,
+        where modified_self_stat_line is the stat line of the model
+        after the abilities for that weapon have been applied. backend
+        is the numeric backend to use, as per the amounts module.
+        """
+        modified_hit_stat, reroll_hits_at_or_below = self.get_hit_roll(
+            weapon,
+            modified_self_stat_line
+        )
+        return D6.get_probability_at_least(
             modified_hit_stat,
-            reroll_hits_at_or_below
+            reroll_hits_at_or_below,
+            backend
         )
 
+    def get_wound_roll(self, target, weapon, modified_self_stat_line):
+        """
+        Get a tuple of the roll needed for a hit with the given weapon
+        to wound target, and the value at or below which failed wound
+        rolls are rerolled. modified_self_stat_line is the stat line of
+        the model after the abilities for that weapon have been
+        applied.
+        """
+        modified_target_stat_line, _ = target.get_modified_stat_lines()
+
         unmodified_wound_at_or_below = Model.get_to_wound_roll(
             modified_self_stat_line[Model.STRENGTH_STAT_NAME],
             modified_target_stat_line[Model.TOUGHNESS_STAT_NAME]
@@ -239,58 +637,311 @@ class Model(Item):
             ]
         )
 
+        _, max_reroll_wounds = self.get_max_rerolls(weapon)
         reroll_wounds_at_or_below = min(
-            max(
-                [
-                    ability.reroll_wounds_at_or_below
-                    for ability in all_abilities
-                ]
-            ),
+            max_reroll_wounds,
             unmodified_wound_at_or_below - 1
-        ) if all_abilities else 0
+        )
 
+        return modified_wound_at_or_below, reroll_wounds_at_or_below
+
+    @staticmethod
+    def get_save_roll(target, weapon):
+        """
+        Get the roll target needs to save a wound from weapon.
+        """
+        # The AP value is subtracted as it is always negative or zero, and they
+        # need to make the saves harder, i.e. higher.
+        return (
+            target.stat_line[Model.ARMOUR_SAVE_STAT_NAME]
+            - weapon.stat_line[Weapon.ARMOUR_PIERCING_STAT_NAME]
+        )
+
+    def get_roll_chances(
+            self,
+            target,
+            weapon,
+            modified_self_stat_line,
+            backend=None
+        ):
+        """
+        Get a tuple of the chance of a single attack with the weapon
+        hitting, the chance of a hit wounding, and the fraction of
+        wounds that go unsaved, against target. modified_self_stat_line
+        is the stat line of the model after the abilities for that
+        weapon have been applied. backend is the numeric backend to
+        use, as per the amounts module.
+        """
+        hit_chance = self.get_hit_chance(
+            weapon,
+            modified_self_stat_line,
+            backend
+        )
+
+        modified_wound_at_or_below, reroll_wounds_at_or_below = \
+            self.get_wound_roll(target, weapon, modified_self_stat_line)
         wound_chance = D6.get_probability_at_least(
             modified_wound_at_or_below,
-            reroll_wounds_at_or_below
+            reroll_wounds_at_or_below,
+            backend
+        )
+
+        fraction_unsaved = 1 - D6.get_probability_at_least(
+            Model.get_save_roll(target, weapon),
+            backend=backend
+        )
+
+        return hit_chance, wound_chance, fraction_unsaved
+
+    def get_average_damage_output(self, target, weapon, backend=None):
+        """
+        Calculate the average damage output of a particular model with it's
+        given wargear, with a particular weapon. backend is the numeric
+        backend to use, as per the amounts module. The float backend is
+        faster than the exact one, but is subject to rounding. Outputs
+        are cached per target, weapon and backend, so that weapons which
+        appear in many weapon combinations are only evaluated once,
+        until the model, target or weapon changes. The cache does not
+        keep targets or weapons alive.
+        """
+        backend = amounts.resolve_backend(backend)
+        if backend == amounts.CHECK_BACKEND:
+            return amounts.check_backends(
+                lambda backend: self.get_average_damage_output(
+                    target,
+                    weapon,
+                    backend
+                )
+            )
+
+        return self._get_cached_output(
+            'average_damage_outputs',
+            target,
+            weapon,
+            backend,
+            self._calculate_average_damage_output
+        )
+
+    def _get_cached_output(
+            self,
+            cache_name,
+            target,
+            weapon,
+            backend,
+            calculate
+        ):
+        """
+        Get the output of calculate for target, weapon and backend from
+        the cache called cache_name, calculating and caching it if it
+        is not cached.
+        """
+        cache = self._get_cache(cache_name)
+        key = id(target), id(weapon), backend
+        try:
+            return _get_cached(cache, key, (target, weapon))
+        except KeyError:
+            versions = _get_versions((target, weapon))
+            output = calculate(target, weapon, backend)
+            _cache_weakly(cache, key, (target, weapon), versions, output)
+            return output
+
+    def _calculate_average_damage_output(self, target, weapon, backend):
+        modified_self_stat_line, modified_weapon_stat_line = \
+            self.get_modified_stat_lines(weapon)
+        hit_chance, wound_chance, fraction_unsaved = self.get_roll_chances(
+            target,
+            weapon,
+            modified_self_stat_line,
+            backend
         )
 
         # abs shouldn't change the value of positive integers, but will get the
         # average value if they are amounts.
         attacks = abs(modified_self_stat_line[Model.ATTACKS_STAT_NAME])
         damage = abs(modified_weapon_stat_line[Weapon.DAMAGE_STAT_NAME])
+        if backend == amounts.FLOAT_BACKEND:
+            attacks = float(attacks)
+            damage = float(damage)
 
-        # The AP value is subtracted as it is always negative or zero, and they
-        # need to make the saves harder, i.e. higher.
-        save_roll = (
-            target.stat_line[Model.ARMOUR_SAVE_STAT_NAME]
-            - weapon.stat_line[Weapon.ARMOUR_PIERCING_STAT_NAME]
+        if damage > target.stat_line[Model.WOUNDS_STAT_NAME]:
+            damage = target.stat_line[Model.WOUNDS_STAT_NAME]
+        return attacks * hit_chance * wound_chance * damage * fraction_unsaved
+
+    def get_damage_output_moments(self, target, weapon, backend=None):
+        """
+        Get a tuple of the average damage output of the model with
+        weapon against target, exactly as per get_average_damage_output,
+        and its variance. Both are worked out from the means and
+        variances of the attacks and damage, and the roll chances, in a
+        single pass, without the full damage distribution. Where the
+        average damage is capped at the wounds of the target, the
+        damage is taken to always be the wounds of the target, as it is
+        for the average. Moments are cached like outputs.
+        """
+        backend = amounts.resolve_backend(backend)
+        if backend == amounts.CHECK_BACKEND:
+            return tuple(
+                amounts.check_backends(
+                    lambda backend: self.get_damage_output_moments(
+                        target,
+                        weapon,
+                        backend
+                    )[index]
+                )
+                for index in range(2)
+            )
+
+        return self._get_cached_output(
+            'damage_output_moments',
+            target,
+            weapon,
+            backend,
+            self._calculate_damage_output_moments
+        )
+
+    def _calculate_damage_output_moments(self, target, weapon, backend):
+        modified_self_stat_line, modified_weapon_stat_line = \
+            self.get_modified_stat_lines(weapon)
+        hit_chance, wound_chance, fraction_unsaved = self.get_roll_chances(
+            target,
+            weapon,
+            modified_self_stat_line,
+            backend
         )
-        fraction_unsaved = 1 - D6.get_probability_at_least(save_roll)
+
+        attacks_amount = modified_self_stat_line[Model.ATTACKS_STAT_NAME]
+        damage_amount = modified_weapon_stat_line[Weapon.DAMAGE_STAT_NAME]
+        attacks = amounts.get_average_value(attacks_amount, backend)
+        attacks_variance = amounts.get_variance(attacks_amount, backend)
+        damage = amounts.get_average_value(damage_amount, backend)
+        damage_variance = amounts.get_variance(damage_amount, backend)
 
         if damage > target.stat_line[Model.WOUNDS_STAT_NAME]:
             damage = target.stat_line[Model.WOUNDS_STAT_NAME]
-        return attacks * hit_chance * wound_chance * damage * fraction_unsaved
+            damage_variance = 0
+        # The mean is multiplied out in the same order as in
+        # _calculate_average_damage_output, so floats agree exactly.
+        average_output = (
+            attacks * hit_chance * wound_chance * damage * fraction_unsaved
+        )
 
-    def get_average_damage_efficiency(self, target, weapon_combination):
-        points_cost = (
+        # Each attack does the damage with the damaging chance, and
+        # nothing otherwise, and the number of attacks is independent of
+        # what each of them does, so the variance of the total is that
+        # of a compound sum.
+        damaging_chance = hit_chance * wound_chance * fraction_unsaved
+        attack_average = damaging_chance * damage
+        attack_variance = (
+            damaging_chance * (damage_variance + damage * damage)
+            - attack_average * attack_average
+        )
+        variance = (
+            attacks * attack_variance
+            + attacks_variance * attack_average * attack_average
+        )
+        return average_output, variance
+
+    def get_damage_distribution(self, target, weapon):
+        """
+        Get the probability mass function of the unsaved damage done by
+        the model to target with weapon, as a dictionary from damage
+        values to probabilities. The damage from each unsaved wound is
+        capped at the wounds of the target, so, unlike the average
+        damage output, which caps the average damage, the mean of this
+        distribution does not overstate random damage against targets
+        with few wounds.
+        """
+        modified_self_stat_line, modified_weapon_stat_line = \
+            self.get_modified_stat_lines(weapon)
+        hit_chance, wound_chance, fraction_unsaved = self.get_roll_chances(
+            target,
+            weapon,
+            modified_self_stat_line
+        )
+        damaging_chance = hit_chance * wound_chance * fraction_unsaved
+        target_wounds = target.stat_line[Model.WOUNDS_STAT_NAME]
+
+        # The damage done by a single attack is zero if it fails to get
+        # through, and otherwise the (capped) damage of the weapon.
+        attack_distribution = {0: 1 - damaging_chance}
+        for damage, probability in amounts.get_distribution(
+                modified_weapon_stat_line[Weapon.DAMAGE_STAT_NAME]
+        ).items():
+            damage = min(damage, target_wounds)
+            attack_distribution[damage] = (
+                attack_distribution.get(damage, 0)
+                + damaging_chance * probability
+            )
+
+        # The number of attacks may itself be random, so the
+        # distributions for each possible number of attacks are mixed.
+        damage_distribution = {}
+        for attacks, attacks_probability in amounts.get_distribution(
+                modified_self_stat_line[Model.ATTACKS_STAT_NAME]
+        ).items():
+            for damage, probability in amounts.get_sum_distribution(
+                    attack_distribution,
+                    int(attacks)
+            ).items():
+                damage_distribution[damage] = (
+                    damage_distribution.get(damage, 0)
+                    + attacks_probability * probability
+                )
+
+        return damage_distribution
+
+    def get_points_cost(self, weapon_combination):
+        """
+        Get the total points cost of the model, its wargear, and the
+        weapons in weapon_combination.
+        """
+        return (
             self.points
             + sum([weapon.points for weapon in weapon_combination])
             + sum([item.points for item in self.wargear])
         )
+
+    def get_average_damage_efficiency(
+            self,
+            target,
+            weapon_combination,
+            backend=None
+        ):
+        backend = amounts.resolve_backend(backend)
+        if backend == amounts.CHECK_BACKEND:
+            return amounts.check_backends(
+                lambda backend: self.get_average_damage_efficiency(
+                    target,
+                    weapon_combination,
+                    backend
+                )
+            )
+
+        points_cost = self.get_points_cost(weapon_combination)
         average_output = sum(
             [
-                self.get_average_damage_output(target, weapon)
+                self.get_average_damage_output(target, weapon, backend)
                 for weapon in weapon_combination
             ]
         )
         try:
             return average_output / points_cost
         except ZeroDivisionError:
-            raise InvalidModelForEfficiencyError(
+            raise Model.InvalidModelForEfficiencyError(
                 'zero points cost cannot have an efficiency'
             )
 
 
+# The to wound roll of every pair of integer strength and toughness values
+# up to MAX_TABULATED_STAT, so they need not be worked out every time.
+MAX_TABULATED_STAT = 20
+TO_WOUND_ROLLS = {
+    (strength, toughness): Model._calculate_to_wound_roll(strength, toughness)
+    for strength in range(MAX_TABULATED_STAT + 1)
+    for toughness in range(MAX_TABULATED_STAT + 1)
+}
+
+
 class Weapon(Item):
     """
     The weapon class represents the warhammer forty thousand rules'
@@ -305,3 +956,30 @@ class Weapon(Item):
     IS_MELEE_STAT_NAME = 'is_melee'
     DAMAGE_STAT_NAME = 'D'
     ARMOUR_PIERCING_STAT_NAME = 'AP'
+
+
+class ModelStatLine(StatLine):
+    STAT_NAMES = (
+        Model.BALLISTIC_SKILL_STAT_NAME,
+        Model.WEAPON_SKILL_STAT_NAME,
+        Model.STRENGTH_STAT_NAME,
+        Model.TOUGHNESS_STAT_NAME,
+        Model.WOUNDS_STAT_NAME,
+        Model.ATTACKS_STAT_NAME,
+        Model.ARMOUR_SAVE_STAT_NAME,
+        Model.TO_WOUND_ROLL_MODIFIER_STAT_NAME,
+    )
+    __slots__ = STAT_NAMES
+
+
+class WeaponStatLine(StatLine):
+    STAT_NAMES = (
+        Weapon.DAMAGE_STAT_NAME,
+        Weapon.ARMOUR_PIERCING_STAT_NAME,
+        Weapon.IS_MELEE_STAT_NAME,
+    )
+    __slots__ = STAT_NAMES
+
+
+Model.STAT_LINE_TYPE = ModelStatLine
+Weapon.STAT_LINE_TYPE = WeaponStatLine
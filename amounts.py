@@ -1,11 +1,177 @@
 """
 This module provides representations of possibly random quantities,
 such as die rolls and fixed values, with methods to get their
-average value.
+average value and their full probability distribution. It also
+provides the selection of the numeric backend used for probabilities:
+exact Fractions, plain floats, or a check mode that works out both and
+keeps track of how far they diverge.
 """
 
 
+from bisect import bisect_left
+from contextlib import contextmanager
 from fractions import Fraction
+from functools import lru_cache
+
+
+EXACT_BACKEND = 'exact'
+FLOAT_BACKEND = 'float'
+CHECK_BACKEND = 'check'
+BACKENDS = [EXACT_BACKEND, FLOAT_BACKEND, CHECK_BACKEND]
+
+_default_backend = EXACT_BACKEND
+_max_divergence = 0.0
+
+
+class InvalidBackendError(Exception): pass
+
+
+def resolve_backend(backend=None):
+    """
+    Get backend, or the default backend if backend is None, checking
+    that it is one of BACKENDS.
+    """
+    if backend is None:
+        return _default_backend
+    if backend not in BACKENDS:
+        raise InvalidBackendError(
+            'backend must be one of "exact", "float" or "check"'
+        )
+    return backend
+
+
+def get_default_backend():
+    return _default_backend
+
+
+def set_default_backend(backend):
+    """
+    Set the backend used by calculations that are not given one.
+    """
+    global _default_backend
+    _default_backend = resolve_backend(backend)
+
+
+@contextmanager
+def using_backend(backend):
+    """
+    A context manager that sets the default backend to backend within
+    it, and restores the previous one afterwards.
+    """
+    previous_backend = _default_backend
+    set_default_backend(backend)
+    try:
+        yield
+    finally:
+        set_default_backend(previous_backend)
+
+
+def check_backends(calculate):
+    """
+    Call calculate with the exact and the float backends, record the
+    absolute difference of the results, and return the exact result.
+    This is how calculations implement the check backend.
+    """
+    exact_result = calculate(EXACT_BACKEND)
+    float_result = calculate(FLOAT_BACKEND)
+    record_divergence(abs(float(exact_result) - float_result))
+    return exact_result
+
+
+def record_divergence(divergence):
+    """
+    Record a difference between the exact and float results, such as
+    the largest one seen by calculations in another process.
+    """
+    global _max_divergence
+    _max_divergence = max(_max_divergence, divergence)
+
+
+def get_max_divergence():
+    """
+    Get the largest difference between the exact and float results
+    seen by calculations done with the check backend.
+    """
+    return _max_divergence
+
+
+def reset_max_divergence():
+    global _max_divergence
+    _max_divergence = 0.0
+
+
+@lru_cache(maxsize=None)
+def _get_uniform_distribution(start, stop):
+    spread = int(stop - start) + 1
+    return {start + offset: Fraction(1, spread) for offset in range(spread)}
+
+
+def get_distribution(amount):
+    """
+    Get the probability mass function of amount, as a dictionary from
+    each value it can take to the probability of it taking that value.
+    amount may be an Amount or a plain number, in which case it takes
+    that value with certainty. The returned dictionaries may be shared,
+    and so must not be modified.
+    """
+    if isinstance(amount, SingleAmount):
+        return amount.get_distribution()
+    return {amount: Fraction(1)}
+
+
+def convolve(distribution, other_distribution):
+    """
+    Get the distribution of the sum of two independent amounts, given
+    their distributions.
+    """
+    result = {}
+    for value, probability in distribution.items():
+        for other_value, other_probability in other_distribution.items():
+            result[value + other_value] = (
+                result.get(value + other_value, 0)
+                + probability * other_probability
+            )
+    return result
+
+
+def get_sum_distribution(distribution, count):
+    """
+    Get the distribution of the sum of count independent amounts, each
+    with the given distribution. This uses repeated squaring, so only
+    takes a logarithmic number of convolutions in count.
+    """
+    result = {0: Fraction(1)}
+    while count > 0:
+        if count % 2 == 1:
+            result = convolve(result, distribution)
+        count //= 2
+        if count > 0:
+            distribution = convolve(distribution, distribution)
+    return result
+
+
+@lru_cache(maxsize=None)
+def _get_probability_at_least_table(start, stop, backend):
+    """
+    Get a dictionary from each pair of integer value_to_be_at_least and
+    rerolling_from in the range of the amount from start to stop, to
+    the probability of a roll being at least that value. Amounts that
+    do not start and stop on integers get an empty table.
+    """
+    amount = SingleAmount(start, stop)
+    table = {}
+    if start != int(start) or stop != int(stop):
+        return table
+    for value_to_be_at_least in range(int(start), int(stop) + 2):
+        for rerolling_from in range(int(start) - 1, int(stop) + 2):
+            probability = amount._calculate_probability_at_least(
+                value_to_be_at_least,
+                rerolling_from
+            )
+            table[value_to_be_at_least, rerolling_from] = (
+                probability if backend == EXACT_BACKEND else float(probability)
+            )
+    return table
 
 
 class SingleAmount:
@@ -24,17 +190,48 @@ class SingleAmount:
         value at start.
         """
         if stop is not None and stop < start:
-            raise InvalidStopError(
+            raise SingleAmount.InvalidStopError(
                 'if stop is set, it must not be smaller that start'
             )
 
         self.start = Fraction(start)
         self.stop = Fraction(stop if stop is not None else start)
 
-    def get_average_value(self):
-        return self.start + ((self.stop - self.start) / 2)
+    def get_average_value(self, backend=None):
+        average_value = self.start + ((self.stop - self.start) / 2)
+        if resolve_backend(backend) == FLOAT_BACKEND:
+            return float(average_value)
+        return average_value
 
-    def get_probability_at_least(self, value_to_be_at_least, rerolling_from=0):
+    def get_distribution(self):
+        """
+        Get the probability mass function of the amount, as a
+        dictionary from values to probabilities. These are cached per
+        range, so the returned dictionary must not be modified.
+        """
+        return _get_uniform_distribution(self.start, self.stop)
+
+    def _get_dice_amount(self):
+        """
+        Get the DiceAmount equal to the amount, which is kept with the
+        start and stop it was made from, and remade if they change.
+        """
+        try:
+            start, stop, dice_amount = self._dice_amount
+            if start is self.start and stop is self.stop:
+                return dice_amount
+        except AttributeError:
+            pass
+        dice_amount = _get_die_amount(self.start, self.stop)
+        self._dice_amount = (self.start, self.stop, dice_amount)
+        return dice_amount
+
+    def get_probability_at_least(
+            self,
+            value_to_be_at_least,
+            rerolling_from=0,
+            backend=None
+        ):
         """
         Get the probability that a 'roll' will be above at least
         value_to_be_at_least, allowing for 'rerolls'. This currently
@@ -43,8 +240,52 @@ class SingleAmount:
         below rerolling_from are 'rerolled'. Non integer-like values
         may yeild strange results. If rerolling_from is greater than or
         equal to value_to_be_at_least, it will be set to one less than
-        value_to_be_at_least.
+        value_to_be_at_least. The result is a Fraction with the exact
+        backend, and a float with the float backend. Integer arguments
+        within the range of the amount are looked up in a precomputed
+        table.
         """
+        backend = resolve_backend(backend)
+        if backend == CHECK_BACKEND:
+            return check_backends(
+                lambda backend: self.get_probability_at_least(
+                    value_to_be_at_least,
+                    rerolling_from,
+                    backend
+                )
+            )
+
+        table = _get_probability_at_least_table(
+            self.start,
+            self.stop,
+            backend
+        )
+        try:
+            return table[value_to_be_at_least, rerolling_from]
+        except KeyError:
+            return self._get_untabulated_probability_at_least(
+                value_to_be_at_least,
+                rerolling_from,
+                backend
+            )
+
+    def _get_untabulated_probability_at_least(
+            self,
+            value_to_be_at_least,
+            rerolling_from,
+            backend
+        ):
+        probability = self._calculate_probability_at_least(
+            value_to_be_at_least,
+            rerolling_from
+        )
+        return probability if backend == EXACT_BACKEND else float(probability)
+
+    def _calculate_probability_at_least(
+            self,
+            value_to_be_at_least,
+            rerolling_from
+        ):
         if not self.start <= value_to_be_at_least:
             raise SingleAmount.PointNotInAmountRange(
                 'both value_to_be_at_least must be at least the start value'
@@ -74,19 +315,13 @@ class SingleAmount:
         return fraction_above * (1 + fraction_to_reroll)
 
     def __add__(self, other):
-        new_general_amount = GeneralAmount()
-        new_general_amount.add_amount(self)
-        new_general_amount.add_amount(other)
-        return new_general_amount
+        return DiceAmount.from_amount(self) + other
 
     def __radd__(self, other):
         return self + other
 
     def __mul__(self, other):
-        new_general_amount = GeneralAmount()
-        for _ in range(other):
-            new_general_amount.add_amount(self)
-        return new_general_amount
+        return DiceAmount.from_amount(self) * other
 
     def __rmul__(self, other):
         return self * other
@@ -98,16 +333,349 @@ class SingleAmount:
 class GeneralAmount(SingleAmount):
     """
     The GeneralAmount class represents a possibly random quantity. It
-    can be a combination of SingleAmounts (i.e. 2D6). This is what is
-    returned by operations on SingleAmounts.
+    can be a combination of SingleAmounts (i.e. 2D6). Operations on
+    amounts now return DiceAmounts, which are much cheaper, but this is
+    kept for amounts built up one at a time.
     """
     def __init__(self):
         self._contained_amounts = []
 
+    @property
+    def start(self):
+        return DiceAmount.from_amount(self).start
+
+    @property
+    def stop(self):
+        return DiceAmount.from_amount(self).stop
+
     def add_amount(self, amount):
         self._contained_amounts.append(amount)
 
-    def get_average_value(self):
+    def get_average_value(self, backend=None):
         return sum(
-            [amount.get_average_value() for amount in self._contained_amounts]
+            [
+                get_average_value(amount, backend)
+                for amount in self._contained_amounts
+            ]
         )
+
+    def get_distribution(self):
+        """
+        Get the probability mass function of the sum of the contained
+        amounts, by convolving their distributions.
+        """
+        result = {0: Fraction(1)}
+        for amount in self._contained_amounts:
+            result = convolve(result, get_distribution(amount))
+        return result
+
+    def get_probability_at_least(
+            self,
+            value_to_be_at_least,
+            rerolling_from=0,
+            backend=None
+        ):
+        """
+        Get the probability that a 'roll' of the sum of the contained
+        amounts will be at least value_to_be_at_least, allowing for
+        'rerolls', as per SingleAmount.get_probability_at_least.
+        """
+        return DiceAmount.from_amount(self).get_probability_at_least(
+            value_to_be_at_least,
+            rerolling_from,
+            backend
+        )
+
+
+def get_average_value(amount, backend=None):
+    """
+    Get the average value of amount, which may be an Amount or a plain
+    number.
+    """
+    if isinstance(amount, SingleAmount):
+        return amount.get_average_value(backend)
+    if resolve_backend(backend) == FLOAT_BACKEND:
+        return float(amount)
+    return amount
+
+
+def get_variance(amount, backend=None):
+    """
+    Get the variance of amount, which may be an Amount or a plain
+    number, which has none.
+    """
+    if isinstance(amount, SingleAmount):
+        return DiceAmount.from_amount(amount).get_variance(backend)
+    if resolve_backend(backend) == FLOAT_BACKEND:
+        return 0.0
+    return Fraction(0)
+
+
+@lru_cache(maxsize=None)
+def _get_dice_distribution(dice, constant):
+    distribution = {constant: Fraction(1)}
+    for (start, stop), count in dice:
+        distribution = convolve(
+            distribution,
+            get_sum_distribution(_get_uniform_distribution(start, stop), count)
+        )
+    return distribution
+
+
+@lru_cache(maxsize=None)
+def _get_dice_tail_probabilities(dice, constant):
+    """
+    Get a sorted list of the values a dice amount can take, and a list
+    of the probabilities of it being at least each of them.
+    """
+    distribution = _get_dice_distribution(dice, constant)
+    values = sorted(distribution.keys())
+    tail_probabilities = []
+    tail_probability = Fraction(0)
+    for value in reversed(values):
+        tail_probability += distribution[value]
+        tail_probabilities.append(tail_probability)
+    return values, tail_probabilities[::-1]
+
+
+def _get_integer_if_whole(value):
+    return int(value) if value == int(value) else value
+
+
+@lru_cache(maxsize=None)
+def _get_die_amount(start, stop):
+    """
+    Get the DiceAmount of a single die from start to stop. Whole bounds
+    are kept as ints, so that sums and products of dice are int
+    arithmetic, rather than much slower Fraction arithmetic.
+    """
+    start = _get_integer_if_whole(start)
+    stop = _get_integer_if_whole(stop)
+    if start == stop:
+        return DiceAmount._create((), start, start, stop)
+    return DiceAmount._create((((start, stop), 1),), 0, start, stop)
+
+
+class DiceAmount(SingleAmount):
+    """
+    The DiceAmount class represents the sum of some number of dice and
+    a constant, such as 3D6+2. It only stores how many of each die
+    there are, so its average, variance, minimum and maximum take time
+    in the number of different dice, rather than the number of dice.
+    Its distribution and probabilities are worked out once per shape,
+    and shared between all amounts of that shape. Like a SingleAmount,
+    its start and stop are the least and most it can be.
+    """
+    class InvalidMultiplierError(Exception): pass
+
+    def __init__(self, dice={}, constant=0):
+        """
+        Create a dice amount, from dice, a dictionary from (start,
+        stop) pairs, the ranges of dice, to how many of that die there
+        are, and a constant to add to them.
+        """
+        counts = {}
+        for (start, stop), count in dice.items():
+            if stop < start:
+                raise SingleAmount.InvalidStopError(
+                    'dice must not stop before they start'
+                )
+            if count != int(count) or count < 0:
+                raise DiceAmount.InvalidMultiplierError(
+                    'there must be a whole, non-negative number of each die'
+                )
+            if start == stop:
+                # A die with one side is just a constant.
+                constant += start * int(count)
+            elif count:
+                counts[start, stop] = counts.get((start, stop), 0) + int(count)
+        self._set(tuple(sorted(counts.items())), constant)
+
+    def _set(self, dice, constant):
+        self.dice = dice
+        self.constant = constant
+        self.start = constant + sum(
+            [count * start for (start, _), count in dice]
+        )
+        self.stop = constant + sum([count * stop for (_, stop), count in dice])
+
+    @staticmethod
+    def _create(dice, constant, start, stop):
+        """
+        Create a dice amount from attributes that are already known to
+        be valid, without checking or recomputing any of them, which is
+        much cheaper than __init__ when building amounts up.
+        """
+        dice_amount = object.__new__(DiceAmount)
+        dice_amount.dice = dice
+        dice_amount.constant = constant
+        dice_amount.start = start
+        dice_amount.stop = stop
+        return dice_amount
+
+    @staticmethod
+    def from_amount(amount):
+        """
+        Get a DiceAmount equal to amount, which may be a SingleAmount,
+        a GeneralAmount, a DiceAmount or a plain number.
+        """
+        if isinstance(amount, DiceAmount):
+            return amount
+        if isinstance(amount, GeneralAmount):
+            dice_amount = DiceAmount._create((), 0, 0, 0)
+            for contained_amount in amount._contained_amounts:
+                dice_amount = dice_amount + contained_amount
+            return dice_amount
+        if isinstance(amount, SingleAmount):
+            return amount._get_dice_amount()
+        return DiceAmount._create((), amount, amount, amount)
+
+    def _convert(self, value, backend):
+        return float(value) if resolve_backend(backend) == FLOAT_BACKEND \
+            else value
+
+    def get_average_value(self, backend=None):
+        return self._convert(
+            self.constant + sum(
+                [
+                    Fraction(count * (start + stop), 2)
+                    for (start, stop), count in self.dice
+                ]
+            ),
+            backend
+        )
+
+    def get_variance(self, backend=None):
+        """
+        Get the variance of the amount. Each die is uniform over its
+        stop - start + 1 values, and so has a variance of one twelfth of
+        that squared, less one.
+        """
+        return self._convert(
+            sum(
+                [
+                    count * Fraction((stop - start + 1) ** 2 - 1, 12)
+                    for (start, stop), count in self.dice
+                ]
+            ),
+            backend
+        )
+
+    def get_minimum(self):
+        return self.start
+
+    def get_maximum(self):
+        return self.stop
+
+    def get_distribution(self):
+        """
+        Get the probability mass function of the amount, as a
+        dictionary from values to probabilities. These are cached per
+        shape, so the returned dictionary must not be modified.
+        """
+        return _get_dice_distribution(self.dice, self.constant)
+
+    def _get_probability_at_least(self, value):
+        values, tail_probabilities = _get_dice_tail_probabilities(
+            self.dice,
+            self.constant
+        )
+        index = bisect_left(values, value)
+        if index == len(values):
+            return Fraction(0)
+        return tail_probabilities[index]
+
+    def get_probability_at_least(
+            self,
+            value_to_be_at_least,
+            rerolling_from=0,
+            backend=None
+        ):
+        """
+        Get the probability that a 'roll' will be at least
+        value_to_be_at_least, where rolls at or below rerolling_from
+        are rerolled once, as per SingleAmount.get_probability_at_least.
+        Unlike for a SingleAmount, either value may be below the minimum
+        of the amount, in which case nothing is rerolled, or it is
+        certain to be at least value_to_be_at_least.
+        """
+        backend = resolve_backend(backend)
+        if backend == CHECK_BACKEND:
+            return check_backends(
+                lambda backend: self.get_probability_at_least(
+                    value_to_be_at_least,
+                    rerolling_from,
+                    backend
+                )
+            )
+
+        if rerolling_from >= value_to_be_at_least:
+            rerolling_from = value_to_be_at_least - 1
+
+        probability_at_least = self._get_probability_at_least(
+            value_to_be_at_least
+        )
+        probability_to_reroll = 1 - self._get_probability_at_least(
+            rerolling_from + 1
+        )
+        return self._convert(
+            probability_at_least * (1 + probability_to_reroll),
+            backend
+        )
+
+    def __add__(self, other):
+        other = DiceAmount.from_amount(other)
+        if not other.dice:
+            dice = self.dice
+        elif not self.dice:
+            dice = other.dice
+        else:
+            counts = dict(self.dice)
+            for die, count in other.dice:
+                counts[die] = counts.get(die, 0) + count
+            dice = tuple(sorted(counts.items()))
+        return DiceAmount._create(
+            dice,
+            self.constant + other.constant,
+            self.start + other.start,
+            self.stop + other.stop
+        )
+
+    def __mul__(self, other):
+        if isinstance(other, SingleAmount):
+            raise DiceAmount.InvalidMultiplierError(
+                'amounts can only be multiplied by numbers'
+            )
+        if not self.dice:
+            return DiceAmount._create(
+                (),
+                self.constant * other,
+                self.start * other,
+                self.stop * other
+            )
+        if other != int(other):
+            raise DiceAmount.InvalidMultiplierError(
+                'dice can only be multiplied by whole numbers'
+            )
+        if other < 0:
+            raise DiceAmount.InvalidMultiplierError(
+                'dice can not be multiplied by negative numbers'
+            )
+        other = int(other)
+        return DiceAmount._create(
+            tuple([(die, count * other) for die, count in self.dice])
+            if other else (),
+            self.constant * other,
+            self.start * other,
+            self.stop * other
+        )
+
+    def __repr__(self):
+        terms = [
+            (f'{count}' if count > 1 else '')
+            + (f'D{stop}' if start == 1 else f'[{start}-{stop}]')
+            for (start, stop), count in self.dice
+        ]
+        if self.constant or not terms:
+            terms.append(str(self.constant))
+        return ' + '.join(terms)
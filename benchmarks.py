@@ -0,0 +1,356 @@
+"""
+This module provides a benchmark suite for the amounts module, the
+Model damage pipeline and whole sweeps, which compares its timings
+against a baseline stored in benchmark_baseline.json.
+
+Run it with:
+
+    python benchmarks.py [--save-baseline] [--threshold RATIO] [NAME ...]
+
+to run every benchmark (or just those named), report how each compares
+with the baseline, and exit with a non-zero status if any is more than
+threshold times slower. --save-baseline stores the new timings as the
+baseline instead.
+
+Timings are the median of many repeats, and the baseline also records
+how much the repeats of each benchmark spread, so that a benchmark only
+counts as a regression if it is slower by more than both the threshold
+and its own noise. Benchmarks that take only microseconds are noisier
+than the rest, so they are given a wider threshold.
+"""
+import argparse
+import json
+import os
+from statistics import quantiles
+import sys
+import timeit
+
+import numpy as np
+
+import amounts
+from __init__ import Model, D3, D6, invalidate_caches
+from roster import load_roster
+import sweep
+import vectorised
+
+
+BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'benchmark_baseline.json'
+)
+ROSTER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'rosters',
+    'space_marines.json'
+)
+DEFAULT_THRESHOLD = 1.25
+# Benchmarks faster than FAST_SECONDS_PER_CALL use FAST_THRESHOLD
+# instead, if it is wider.
+FAST_SECONDS_PER_CALL = 1e-4
+FAST_THRESHOLD = 1.6
+# A benchmark is only a regression if it is more than this many times
+# its relative spread slower than the baseline.
+SPREAD_MULTIPLIER = 3
+REPEATS = 15
+
+# A list of (name, setup) pairs, where setup returns the function to be
+# timed.
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """
+    A decorator that registers a setup function as the benchmark called
+    name.
+    """
+    def register(setup):
+        BENCHMARKS.append((name, setup))
+        return setup
+    return register
+
+
+def get_targets(max_wounds, max_toughness):
+    """
+    Get a dictionary of target models by (wounds, toughness, save), like
+    the one in analysis.py, up to the given wounds and toughness.
+    """
+    return {
+        (wounds, toughness, save): Model(
+            {'W': wounds, 'T': toughness, 'Sv': save}
+        )
+        for wounds in range(1, max_wounds + 1)
+        for toughness in range(1, max_toughness + 1)
+        for save in range(2, 7)
+    }
+
+
+def _get_loadout(unit_key, weapon_name):
+    model, weapon_combinations = load_roster(
+        ROSTER_PATH,
+        [unit_key]
+    ).units[unit_key]
+    for weapon_combination in weapon_combinations:
+        if weapon_combination[0].name == weapon_name:
+            return model, weapon_combination
+
+
+@benchmark('get_probability_at_least')
+def setup_get_probability_at_least():
+    return lambda: D6.get_probability_at_least(3, 1)
+
+
+@benchmark('get_probability_at_least_float')
+def setup_get_probability_at_least_float():
+    return lambda: D6.get_probability_at_least(3, 1, amounts.FLOAT_BACKEND)
+
+
+def _get_general_amount():
+    """
+    Get 3D6 + D3 as a GeneralAmount, as arithmetic on amounts made them
+    before there were DiceAmounts.
+    """
+    dice = amounts.GeneralAmount()
+    for _ in range(3):
+        dice.add_amount(D6)
+    amount = amounts.GeneralAmount()
+    amount.add_amount(dice)
+    amount.add_amount(D3)
+    return amount
+
+
+@benchmark('general_amount_arithmetic')
+def setup_general_amount_arithmetic():
+    return lambda: _get_general_amount().get_average_value()
+
+
+@benchmark('general_amount_distribution')
+def setup_general_amount_distribution():
+    return _get_general_amount().get_distribution
+
+
+@benchmark('dice_amount_arithmetic')
+def setup_dice_amount_arithmetic():
+    return lambda: ((D6 * 3) + D3).get_average_value()
+
+
+@benchmark('dice_amount_distribution')
+def setup_dice_amount_distribution():
+    amount = (D6 * 3) + D3
+    return amount.get_distribution
+
+
+@benchmark('get_modified_stat_lines')
+def setup_get_modified_stat_lines():
+    model, (weapon,) = _get_loadout('space_marine_veteran', 'power_fist')
+    return lambda: model.get_modified_stat_lines(weapon)
+
+
+@benchmark('get_modified_stat_lines_uncached')
+def setup_get_modified_stat_lines_uncached():
+    model, (weapon,) = _get_loadout('space_marine_veteran', 'power_fist')
+    return lambda: model._compile_modified_stat_lines(weapon)
+
+
+@benchmark('get_average_damage_output_uncached')
+def setup_get_average_damage_output_uncached():
+    model, (weapon,) = _get_loadout('heavy_weapon_devastator', 'lascannon')
+    target = Model({'W': 3, 'T': 7, 'Sv': 3})
+    return lambda: model._calculate_average_damage_output(
+        target,
+        weapon,
+        amounts.EXACT_BACKEND
+    )
+
+
+@benchmark('get_average_damage_output_uncached_float')
+def setup_get_average_damage_output_uncached_float():
+    model, (weapon,) = _get_loadout('heavy_weapon_devastator', 'lascannon')
+    target = Model({'W': 3, 'T': 7, 'Sv': 3})
+    return lambda: model._calculate_average_damage_output(
+        target,
+        weapon,
+        amounts.FLOAT_BACKEND
+    )
+
+
+@benchmark('get_damage_output_moments_uncached')
+def setup_get_damage_output_moments_uncached():
+    model, (weapon,) = _get_loadout('heavy_weapon_devastator', 'lascannon')
+    target = Model({'W': 3, 'T': 7, 'Sv': 3})
+    return lambda: model._calculate_damage_output_moments(
+        target,
+        weapon,
+        amounts.EXACT_BACKEND
+    )
+
+
+@benchmark('get_damage_output_moments_uncached_float')
+def setup_get_damage_output_moments_uncached_float():
+    model, (weapon,) = _get_loadout('heavy_weapon_devastator', 'lascannon')
+    target = Model({'W': 3, 'T': 7, 'Sv': 3})
+    return lambda: model._calculate_damage_output_moments(
+        target,
+        weapon,
+        amounts.FLOAT_BACKEND
+    )
+
+
+def _setup_sweep(max_wounds, max_toughness):
+    targets = get_targets(max_wounds, max_toughness)
+    options = load_roster(ROSTER_PATH).get_options()
+
+    def run_sweep():
+        # Every run starts without any cached outputs.
+        invalidate_caches()
+        for _ in sweep.get_results(targets, options):
+            pass
+    return run_sweep
+
+
+def _setup_vectorised_sweep(max_wounds, max_toughness):
+    wounds, toughnesses, saves = np.meshgrid(
+        np.arange(1, max_wounds + 1),
+        np.arange(1, max_toughness + 1),
+        np.arange(2, 7),
+        indexing='ij'
+    )
+    options = load_roster(ROSTER_PATH).get_options()
+
+    def run_sweep():
+        invalidate_caches()
+        for model, weapon_combinations in options:
+            for weapon_combination in weapon_combinations:
+                vectorised.get_average_damage_efficiencies(
+                    model,
+                    weapon_combination,
+                    wounds,
+                    toughnesses,
+                    saves
+                )
+    return run_sweep
+
+
+for max_wounds, max_toughness in ((6, 10), (12, 20)):
+    benchmark(f'sweep_{max_wounds * max_toughness * 5}_targets')(
+        lambda max_wounds=max_wounds, max_toughness=max_toughness:
+            _setup_sweep(max_wounds, max_toughness)
+    )
+for max_wounds, max_toughness in ((6, 10), (24, 40), (60, 160)):
+    benchmark(f'vectorised_sweep_{max_wounds * max_toughness * 5}_targets')(
+        lambda max_wounds=max_wounds, max_toughness=max_toughness:
+            _setup_vectorised_sweep(max_wounds, max_toughness)
+    )
+
+
+def run_benchmark(setup):
+    """
+    Get a tuple of the median time, in seconds per call, of the function
+    returned by setup, over REPEATS repeats of enough calls to take a
+    while, and the spread of the repeats, as their interquartile range
+    relative to the median.
+    """
+    timer = timeit.Timer(setup())
+    number, _ = timer.autorange()
+    lower, median, upper = quantiles(
+        [
+            seconds / number
+            for seconds in timer.repeat(repeat=REPEATS, number=number)
+        ],
+        n=4
+    )
+    return median, (upper - lower) / median
+
+
+def get_threshold(threshold, seconds_per_call, spread):
+    """
+    Get how many times slower than the baseline a benchmark taking
+    seconds_per_call, whose repeats spread by spread, must be to be a
+    regression, given the threshold for benchmarks without any noise.
+    """
+    if seconds_per_call < FAST_SECONDS_PER_CALL:
+        threshold = max(threshold, FAST_THRESHOLD)
+    return max(threshold, 1 + SPREAD_MULTIPLIER * spread)
+
+
+def load_baseline(path=BASELINE_PATH):
+    """
+    Get a tuple of dictionaries of the baseline timings and spreads of
+    every benchmark, by name. Baselines saved without spreads have none.
+    """
+    try:
+        with open(path) as baseline_file:
+            baseline = json.load(baseline_file)
+    except FileNotFoundError:
+        return {}, {}
+    return baseline['seconds_per_call'], baseline.get('spreads', {})
+
+
+def save_baseline(timings, spreads, path=BASELINE_PATH):
+    with open(path, 'w') as baseline_file:
+        json.dump(
+            {'seconds_per_call': timings, 'spreads': spreads},
+            baseline_file,
+            indent=4,
+            sort_keys=True
+        )
+        baseline_file.write('\n')
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the analysis package against a baseline.'
+    )
+    parser.add_argument('names', nargs='*', help='benchmarks to run')
+    parser.add_argument(
+        '--save-baseline',
+        action='store_true',
+        help='store the timings as the new baseline'
+    )
+    parser.add_argument(
+        '--threshold',
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help=(
+            'how many times slower than the baseline is a regression, for '
+            'benchmarks without noise'
+        )
+    )
+    arguments = parser.parse_args(arguments)
+
+    baseline, baseline_spreads = load_baseline()
+    timings = {}
+    spreads = {}
+    regressions = []
+    for name, setup in BENCHMARKS:
+        if arguments.names and name not in arguments.names:
+            continue
+        timings[name], spreads[name] = run_benchmark(setup)
+        if name in baseline:
+            ratio = timings[name] / baseline[name]
+            threshold = get_threshold(
+                arguments.threshold,
+                baseline[name],
+                max(spreads[name], baseline_spreads.get(name, 0))
+            )
+            status = 'REGRESSION' if ratio > threshold else 'ok'
+            if status == 'REGRESSION':
+                regressions.append(name)
+            comparison = (
+                f'{ratio:6.2f}x baseline (at most {threshold:.2f}x)  {status}'
+            )
+        else:
+            comparison = 'no baseline'
+        print(f'{name:45} {timings[name] * 1e6:12.2f} us  {comparison}')
+
+    if arguments.save_baseline:
+        save_baseline(
+            {**baseline, **timings},
+            {**baseline_spreads, **spreads}
+        )
+        print(f'saved baseline to {BASELINE_PATH}')
+        return 0
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,373 @@
+"""
+This module provides a command line interface for querying the best
+loadouts against a range of targets. Only the units asked for are
+loaded from the roster, and only the loadouts and targets that match
+the query are evaluated, so small queries answer quickly. For example,
+the best melee loadouts against two wound, toughness four, 3+ save
+targets are found with:
+
+    python cli.py --melee --wounds 2 --toughness 4 --save 3
+
+Run python cli.py --help for all of the options.
+"""
+import argparse
+import csv
+from fnmatch import fnmatch
+from functools import partial
+import io
+import json
+import os
+import sys
+
+import amounts
+from __init__ import Model, Weapon
+import kills
+import pruning
+import ranges
+from reducers import TopResultsReducer
+from result_cache import ResultCache
+import risk
+from roster import InvalidRosterError, UnknownUnitError, load_roster
+import sweep
+
+
+DEFAULT_ROSTER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'rosters',
+    'space_marines.json'
+)
+FORMATS = ['text', 'csv', 'json']
+DEFAULT_TOLERANCE = 1e-9
+
+
+def parse_range(text):
+    """
+    Parse a range of stat values as per ranges.parse_range, for argparse.
+    """
+    try:
+        return ranges.parse_range(text)
+    except ranges.InvalidRangeError as error:
+        raise argparse.ArgumentTypeError(str(error))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Find the most points efficient loadouts against a '
+        'range of targets.'
+    )
+    parser.add_argument(
+        '--roster',
+        default=DEFAULT_ROSTER_PATH,
+        help='the roster file to load units from'
+    )
+    parser.add_argument(
+        '--unit',
+        action='append',
+        dest='units',
+        metavar='KEY',
+        help='only consider the unit with this key (may be repeated)'
+    )
+    parser.add_argument(
+        '--weapon',
+        action='append',
+        dest='weapons',
+        metavar='PATTERN',
+        help='only consider loadouts with a weapon whose name matches this '
+        'shell style pattern (may be repeated)'
+    )
+    kind = parser.add_mutually_exclusive_group()
+    kind.add_argument(
+        '--melee',
+        action='store_true',
+        help='only consider loadouts of melee weapons'
+    )
+    kind.add_argument(
+        '--ranged',
+        action='store_true',
+        help='only consider loadouts of ranged weapons'
+    )
+    parser.add_argument(
+        '-w',
+        '--wounds',
+        type=parse_range,
+        default=parse_range('1-6'),
+        help='the wounds of the targets (default: 1-6)'
+    )
+    parser.add_argument(
+        '-t',
+        '--toughness',
+        type=parse_range,
+        default=parse_range('1-10'),
+        help='the toughness of the targets (default: 1-10)'
+    )
+    parser.add_argument(
+        '-s',
+        '--save',
+        type=parse_range,
+        default=parse_range('2-6'),
+        help='the armour save of the targets (default: 2-6)'
+    )
+    parser.add_argument(
+        '--unit-size',
+        type=int,
+        help='rank loadouts by the expected number of models slain per '
+        'point in units of this many targets, rather than by damage'
+    )
+    parser.add_argument(
+        '--risk-aversion',
+        type=float,
+        metavar='FACTOR',
+        help='rank loadouts by their average damage less this many standard '
+        'deviations of it per point, rather than by their average'
+    )
+    parser.add_argument(
+        '--prune',
+        action='store_true',
+        help='skip loadouts that cannot be in the top for a target, and '
+        'report them to standard error'
+    )
+    parser.add_argument(
+        '--top',
+        type=int,
+        default=1,
+        help='how many loadouts to report per target (default: 1)'
+    )
+    parser.add_argument(
+        '--format',
+        choices=FORMATS,
+        default='text',
+        help='the output format (default: text)'
+    )
+    parser.add_argument(
+        '--output',
+        help='the file to write to (default: standard output)'
+    )
+    parser.add_argument(
+        '--backend',
+        choices=amounts.BACKENDS,
+        help='the numeric backend to use (default: exact)'
+    )
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        help='with --backend check, exit with a non-zero status if the '
+        'exact and float results differ by more than this (default: '
+        f'{DEFAULT_TOLERANCE})'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=1,
+        help='how many processes to evaluate targets in (default: 1)'
+    )
+    parser.add_argument(
+        '--cache',
+        metavar='PATH',
+        help='a result cache file to read and store results in'
+    )
+    parser.add_argument(
+        '--list',
+        action='store_true',
+        help='list the units and weapons in the roster, and exit'
+    )
+    return parser
+
+
+def _matches(weapon_combination, arguments):
+    if arguments.weapons and not any(
+            [
+                fnmatch(weapon.name, pattern)
+                for weapon in weapon_combination
+                for pattern in arguments.weapons
+            ]
+    ):
+        return False
+    if arguments.melee or arguments.ranged:
+        return all(
+            [
+                weapon.stat_line[Weapon.IS_MELEE_STAT_NAME] == arguments.melee
+                for weapon in weapon_combination
+            ]
+        )
+    return True
+
+
+def get_options(roster, arguments):
+    """
+    Get the options of roster, with only the weapon combinations that
+    match the filters in arguments, leaving out units with none.
+    """
+    options = []
+    for model, weapon_combinations in roster.get_options():
+        weapon_combinations = [
+            weapon_combination
+            for weapon_combination in weapon_combinations
+            if _matches(weapon_combination, arguments)
+        ]
+        if weapon_combinations:
+            options.append((model, weapon_combinations))
+    return options
+
+
+def get_targets(arguments):
+    return {
+        (wounds, toughness, save): Model(
+            {'W': wounds, 'T': toughness, 'Sv': save}
+        )
+        for wounds in arguments.wounds
+        for toughness in arguments.toughness
+        for save in arguments.save
+    }
+
+
+def format_results(reducer, output_format):
+    """
+    Get the best results kept by reducer, in output_format.
+    """
+    if output_format == 'text':
+        return reducer.format_top()
+
+    rows = [
+        {
+            'wounds': wounds,
+            'toughness': toughness,
+            'save': save,
+            'rank': rank,
+            'name': name,
+            'efficiency': result
+        }
+        for wounds, toughness, save in reducer.get_targets()
+        for rank, (name, result) in enumerate(
+            reducer.get_top(wounds, toughness, save),
+            1
+        )
+    ]
+    if output_format == 'json':
+        return json.dumps(rows, indent=4) + '\n'
+
+    output = io.StringIO()
+    writer = csv.DictWriter(
+        output,
+        ['wounds', 'toughness', 'save', 'rank', 'name', 'efficiency'],
+        lineterminator='\n'
+    )
+    writer.writeheader()
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+def format_listing(roster):
+    lines = []
+    for key, (model, weapon_combinations) in roster.units.items():
+        lines.append(f'{key} ({model.name}, {model.points} points)\n')
+        for weapon_combination in weapon_combinations:
+            weapon_names = [weapon.name for weapon in weapon_combination]
+            lines.append(f'    {", ".join(weapon_names)}\n')
+    return ''.join(lines)
+
+
+def main(arguments=None):
+    parser = get_parser()
+    arguments = parser.parse_args(arguments)
+    if arguments.top < 1:
+        parser.error('--top must be at least 1')
+    if arguments.workers < 1:
+        parser.error('--workers must be at least 1')
+    if arguments.unit_size is not None and arguments.unit_size < 1:
+        parser.error('--unit-size must be at least 1')
+    if arguments.unit_size is not None and arguments.risk_aversion is not None:
+        parser.error('--unit-size and --risk-aversion cannot be combined')
+    # Pruning relies on the bounds of the average damage efficiency.
+    if arguments.prune and arguments.unit_size is not None:
+        parser.error('--prune cannot be combined with --unit-size')
+    if arguments.prune and arguments.risk_aversion is not None:
+        parser.error('--prune cannot be combined with --risk-aversion')
+    if arguments.prune and arguments.workers > 1:
+        parser.error('--workers cannot be combined with --prune')
+    if arguments.tolerance is not None and (
+            arguments.backend != amounts.CHECK_BACKEND
+    ):
+        parser.error('--tolerance requires --backend check')
+    # Cached results are not worked out again, so would not be checked.
+    if arguments.cache and arguments.backend == amounts.CHECK_BACKEND:
+        parser.error('--cache cannot be combined with --backend check')
+
+    try:
+        roster = load_roster(arguments.roster, arguments.units)
+    except (OSError, InvalidRosterError, UnknownUnitError) as error:
+        parser.error(str(error))
+
+    if arguments.list:
+        output = format_listing(roster)
+    else:
+        options = get_options(roster, arguments)
+        if not options:
+            parser.error('no loadouts match the filters')
+        targets = get_targets(arguments)
+
+        if arguments.unit_size is not None:
+            evaluate = partial(
+                kills.get_average_kill_efficiency,
+                unit_size=arguments.unit_size
+            )
+        elif arguments.risk_aversion is not None:
+            evaluate = partial(
+                risk.get_risk_adjusted_efficiency,
+                risk_aversion=arguments.risk_aversion
+            )
+        else:
+            evaluate = sweep.get_average_damage_efficiency
+
+        amounts.reset_max_divergence()
+        cache = ResultCache(arguments.cache) if arguments.cache else None
+        try:
+            if arguments.prune:
+                pruning_result = pruning.prune(targets, options, arguments.top)
+                sys.stderr.write(pruning_result.format_report())
+                results = pruning_result.get_results(arguments.backend, cache)
+            elif arguments.workers == 1:
+                results = sweep.get_results(
+                    targets,
+                    options,
+                    arguments.backend,
+                    cache,
+                    evaluate
+                )
+            else:
+                results = sweep.get_results_in_parallel(
+                    targets,
+                    options,
+                    arguments.workers,
+                    backend=arguments.backend,
+                    cache=cache,
+                    evaluate=evaluate
+                )
+            reducer = TopResultsReducer(arguments.top)
+            reducer.add_all(results)
+        finally:
+            if cache is not None:
+                cache.close()
+        output = format_results(reducer, arguments.format)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as output_file:
+            output_file.write(output)
+    else:
+        sys.stdout.write(output)
+
+    if arguments.backend == amounts.CHECK_BACKEND and not arguments.list:
+        divergence = amounts.get_max_divergence()
+        tolerance = arguments.tolerance
+        if tolerance is None:
+            tolerance = DEFAULT_TOLERANCE
+        sys.stderr.write(
+            'largest difference between exact and float results: '
+            f'{divergence:.3g} (tolerance {tolerance:.3g})\n'
+        )
+        if divergence > tolerance:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
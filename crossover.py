@@ -0,0 +1,297 @@
+"""
+This module provides solvers for where the efficiency ranking of two
+loadouts flips, in the points cost of one of them, or in one of its
+stats, without sweeping over either.
+
+The average damage efficiency of a loadout is its average damage
+output, which does not depend on its points cost, divided by its points
+cost, so two loadouts are equally efficient when the points cost of the
+first is its output times the cost of the second over the output of the
+second. Each stat of a loadout only moves the factors of its output
+that are looked up in the to hit, to wound and save tables, or its
+attacks or damage, so the output is worked out from those for each
+value of a stat, without copying the loadout or invalidating any of its
+caches. The efficiency is usually monotonic in each stat, but this is
+checked along the values rather than assumed.
+"""
+import amounts
+from __init__ import D6, Model, Weapon
+
+
+class NonMonotonicStatError(Exception): pass
+
+
+def get_average_damage_output(model, weapon_combination, target, backend=None):
+    """
+    Get the total average damage output of model with the weapons in
+    weapon_combination against target.
+    """
+    return sum(
+        [
+            model.get_average_damage_output(target, weapon, backend)
+            for weapon in weapon_combination
+        ]
+    )
+
+
+def get_points_break_even(
+        model,
+        weapon_combination,
+        other_model,
+        other_weapon_combination,
+        target,
+        backend=None
+    ):
+    """
+    Get the total points cost model with weapon_combination would need
+    to be exactly as efficient against target as other_model with
+    other_weapon_combination is. It is more efficient at any lower
+    cost, and less at any higher one. Return None if the other loadout
+    does no damage, and so is beaten at any cost.
+    """
+    output = get_average_damage_output(
+        model,
+        weapon_combination,
+        target,
+        backend
+    )
+    other_output = get_average_damage_output(
+        other_model,
+        other_weapon_combination,
+        target,
+        backend
+    )
+    if other_output == 0:
+        return None
+    return (
+        output
+        * other_model.get_points_cost(other_weapon_combination)
+        / other_output
+    )
+
+
+def get_points_break_evens(
+        model,
+        weapon_combination,
+        other_model,
+        other_weapon_combination,
+        targets,
+        backend=None
+    ):
+    """
+    Get a dictionary from the keys of targets (a dictionary of target
+    models, such as from (wounds, toughness, save) tuples) to the
+    points break even of model with weapon_combination against the
+    other loadout, as per get_points_break_even.
+    """
+    return {
+        key: get_points_break_even(
+            model,
+            weapon_combination,
+            other_model,
+            other_weapon_combination,
+            target,
+            backend
+        )
+        for key, target in targets.items()
+    }
+
+
+def format_points_break_evens(
+        model,
+        weapon_combination,
+        other_model,
+        other_weapon_combination,
+        targets,
+        backend=None
+    ):
+    """
+    Get a report of the points break even of model with
+    weapon_combination against the other loadout, for each target in
+    targets (a dictionary from (wounds, toughness, save) tuples to
+    target models), with its current points cost, one per line.
+    """
+    points_cost = model.get_points_cost(weapon_combination)
+    break_evens = get_points_break_evens(
+        model,
+        weapon_combination,
+        other_model,
+        other_weapon_combination,
+        targets,
+        backend
+    )
+    lines = []
+    # The targets are in the same order as in the reports of reducers.
+    for wounds, toughness, save in sorted(
+            targets.keys(),
+            key=lambda target: (target[0], target[1], -target[2])
+    ):
+        break_even = break_evens[(wounds, toughness, save)]
+        if break_even is None:
+            description = 'any cost'
+        else:
+            description = f'{float(break_even)} points'
+        lines.append(
+            f'W: {wounds}, T: {toughness}, Sv: {save} - {description} '
+            f'(currently {float(points_cost)})\n'
+        )
+    return ''.join(lines)
+
+
+def _get_average_damage_output(
+        model,
+        weapon,
+        target,
+        self_stat_line,
+        weapon_stat_line,
+        backend
+    ):
+    """
+    Get the average damage output of model with weapon against target,
+    as per Model.get_average_damage_output, but as if they had the
+    given stat lines.
+    """
+    if backend == amounts.CHECK_BACKEND:
+        return amounts.check_backends(
+            lambda backend: _get_average_damage_output(
+                model,
+                weapon,
+                target,
+                self_stat_line,
+                weapon_stat_line,
+                backend
+            )
+        )
+
+    modified_self_stat_line, modified_weapon_stat_line = \
+        model._compile_modified_stat_lines(
+            weapon,
+            self_stat_line,
+            weapon_stat_line
+        )
+    max_reroll_hits, max_reroll_wounds = model.get_max_rerolls(weapon)
+
+    if weapon_stat_line[Weapon.IS_MELEE_STAT_NAME]:
+        hit_stat_name = Model.WEAPON_SKILL_STAT_NAME
+    else:
+        hit_stat_name = Model.BALLISTIC_SKILL_STAT_NAME
+    hit_chance = D6.get_probability_at_least(
+        modified_self_stat_line[hit_stat_name],
+        min(max_reroll_hits, self_stat_line[hit_stat_name] - 1),
+        backend
+    )
+
+    modified_target_stat_line, _ = target.get_modified_stat_lines()
+    wound_at_or_below = Model.get_to_wound_roll(
+        modified_self_stat_line[Model.STRENGTH_STAT_NAME],
+        modified_target_stat_line[Model.TOUGHNESS_STAT_NAME]
+    )
+    wound_chance = D6.get_probability_at_least(
+        wound_at_or_below
+        - modified_self_stat_line[Model.TO_WOUND_ROLL_MODIFIER_STAT_NAME],
+        min(max_reroll_wounds, wound_at_or_below - 1),
+        backend
+    )
+
+    fraction_unsaved = 1 - D6.get_probability_at_least(
+        target.stat_line[Model.ARMOUR_SAVE_STAT_NAME]
+        - weapon_stat_line[Weapon.ARMOUR_PIERCING_STAT_NAME],
+        backend=backend
+    )
+
+    attacks = abs(modified_self_stat_line[Model.ATTACKS_STAT_NAME])
+    damage = abs(modified_weapon_stat_line[Weapon.DAMAGE_STAT_NAME])
+    if backend == amounts.FLOAT_BACKEND:
+        attacks = float(attacks)
+        damage = float(damage)
+    if damage > target.stat_line[Model.WOUNDS_STAT_NAME]:
+        damage = target.stat_line[Model.WOUNDS_STAT_NAME]
+    return attacks * hit_chance * wound_chance * damage * fraction_unsaved
+
+
+def get_stat_threshold(
+        model,
+        weapon_combination,
+        other_model,
+        other_weapon_combination,
+        target,
+        stat_name,
+        values,
+        weapon_index=None,
+        backend=None
+    ):
+    """
+    Find where model with weapon_combination becomes, or stops being,
+    at least as efficient against target as other_model with
+    other_weapon_combination, as the stat called stat_name takes each
+    of values in order. The stat is of the model, or of the weapon at
+    weapon_index in weapon_combination if it is given.
+
+    Return a tuple of the first of values at which whether the loadout
+    is at least as efficient differs from at the first value, and
+    whether it is from there on, or None if it never differs. Raise a
+    NonMonotonicStatError if it differs and then changes back, so that
+    there is no single threshold.
+    """
+    backend = amounts.resolve_backend(backend)
+    values = list(values)
+    if not values:
+        return None
+    # This raises an UnknownStatError if there is no such stat.
+    if weapon_index is None:
+        model.stat_line.get_index(stat_name)
+    else:
+        weapon_combination[weapon_index].stat_line.get_index(stat_name)
+    other_efficiency = other_model.get_average_damage_efficiency(
+        target,
+        other_weapon_combination,
+        backend
+    )
+    points_cost = model.get_points_cost(weapon_combination)
+    if points_cost == 0:
+        raise Model.InvalidModelForEfficiencyError(
+            'zero points cost cannot have an efficiency'
+        )
+    # The outputs of the weapons the stat does not change are the same for
+    # every value, and are None for those it does.
+    outputs = [
+        None
+        if weapon_index is None or index == weapon_index
+        else model.get_average_damage_output(target, weapon, backend)
+        for index, weapon in enumerate(weapon_combination)
+    ]
+
+    outcomes = []
+    for value in values:
+        self_stat_line = model.stat_line.copy()
+        if weapon_index is None:
+            self_stat_line[stat_name] = value
+        average_output = 0
+        for weapon, output in zip(weapon_combination, outputs):
+            if output is None:
+                weapon_stat_line = weapon.stat_line.copy()
+                if weapon_index is not None:
+                    weapon_stat_line[stat_name] = value
+                output = _get_average_damage_output(
+                    model,
+                    weapon,
+                    target,
+                    self_stat_line,
+                    weapon_stat_line,
+                    backend
+                )
+            average_output += output
+        outcomes.append(average_output / points_cost >= other_efficiency)
+
+    changes = [
+        index
+        for index in range(1, len(values))
+        if outcomes[index] != outcomes[index - 1]
+    ]
+    if not changes:
+        return None
+    if len(changes) > 1:
+        raise NonMonotonicStatError(
+            f'the efficiency is not monotonic in {stat_name} over the values'
+        )
+    return values[changes[0]], outcomes[changes[0]]
@@ -0,0 +1,348 @@
+"""
+This module provides opt-in instrumentation of the hot functions of the
+damage pipeline, which counts and times their calls and records the
+hit rates of the caches in front of them.
+
+Instrumentation is switched on either with the instrumented context
+manager, or for a whole run by setting the ANALYSIS_INSTRUMENTATION
+environment variable before this module is imported. If the variable is
+1 the report is printed to standard error when the run exits, if it is
+empty, 0, false or no it is off, as if it were not set, and otherwise it
+is taken to be a path to write the report to as JSON.
+
+Nothing is wrapped until instrumentation is enabled, and the original
+functions are put back when it is disabled, so it costs nothing when it
+is off. Only calls in this process are recorded, so sweeps should be
+run with sweep.get_results, rather than in parallel, to be reported in
+full.
+"""
+from contextlib import contextmanager
+import atexit
+import functools
+import json
+import os
+import sys
+import time
+
+import amounts
+from __init__ import Model
+import kills
+
+
+ENVIRONMENT_VARIABLE = 'ANALYSIS_INSTRUMENTATION'
+# The values of the environment variable (in any case) that leave
+# instrumentation off.
+OFF_VALUES = {'', '0', 'false', 'no'}
+
+# Tuples of the class and name of each instrumented function, and the
+# name of the function it calls only when its cache misses (or None if
+# it has no cache). Calls made with the check backend call the function
+# again for each of the other backends, and are counted each time.
+INSTRUMENTED_FUNCTIONS = [
+    (Model, 'get_modified_stat_lines', '_compile_modified_stat_lines'),
+    (Model, 'get_to_wound_roll', '_calculate_to_wound_roll'),
+    # Only lookups that fall through the table count as misses, as
+    # _calculate_probability_at_least is also used to fill the table.
+    (
+        amounts.SingleAmount,
+        'get_probability_at_least',
+        '_get_untabulated_probability_at_least'
+    ),
+    (
+        Model,
+        'get_average_damage_output',
+        '_calculate_average_damage_output'
+    ),
+    (Model, 'get_average_damage_efficiency', None)
+]
+
+# Caches made with functools.lru_cache, by the name they are reported
+# under.
+LRU_CACHES = {
+    'amounts._get_probability_at_least_table':
+        amounts._get_probability_at_least_table,
+    'amounts._get_uniform_distribution': amounts._get_uniform_distribution,
+    'amounts._get_dice_distribution': amounts._get_dice_distribution,
+    'amounts._get_dice_tail_probabilities':
+        amounts._get_dice_tail_probabilities,
+    'amounts._get_die_amount': amounts._get_die_amount,
+    'kills._get_wounded_states': kills._get_wounded_states,
+    'kills._attack_with_weapon': kills._attack_with_weapon
+}
+
+
+class InstrumentationAlreadyEnabledError(Exception): pass
+
+
+class FunctionStatistics:
+    """
+    The calls, misses and total time (in seconds, including the time
+    spent in any instrumented functions it calls) of one function.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.misses = 0
+        self.seconds = 0.0
+        # Only the outermost of recursive calls is timed, so that time
+        # is not counted twice.
+        self._depth = 0
+
+
+_enabled = False
+# The original attributes replaced by wrappers, as (owner, name,
+# attribute) tuples.
+_originals = []
+_function_statistics = {}
+_lru_cache_starts = {}
+_cache_statistics = {}
+
+
+def _get_qualified_name(owner, name):
+    return f'{owner.__name__}.{name}'
+
+
+def _wrap_function(function, statistics):
+    @functools.wraps(function)
+    def wrapper(*arguments, **keyword_arguments):
+        statistics.calls += 1
+        statistics._depth += 1
+        start = time.perf_counter()
+        try:
+            return function(*arguments, **keyword_arguments)
+        finally:
+            statistics._depth -= 1
+            if statistics._depth == 0:
+                statistics.seconds += time.perf_counter() - start
+    return wrapper
+
+
+def _wrap_miss_function(function, statistics):
+    @functools.wraps(function)
+    def wrapper(*arguments, **keyword_arguments):
+        statistics.misses += 1
+        return function(*arguments, **keyword_arguments)
+    return wrapper
+
+
+def _replace_attribute(owner, name, wrap):
+    # The attribute is read from __dict__ so that static methods are
+    # found as such, rather than as the functions they wrap.
+    attribute = owner.__dict__[name]
+    _originals.append((owner, name, attribute))
+    if isinstance(attribute, staticmethod):
+        setattr(owner, name, staticmethod(wrap(attribute.__func__)))
+    else:
+        setattr(owner, name, wrap(attribute))
+
+
+def is_enabled():
+    return _enabled
+
+
+def enable():
+    """
+    Wrap the instrumented functions, and start recording their calls
+    from zero.
+    """
+    global _enabled
+    if _enabled:
+        raise InstrumentationAlreadyEnabledError(
+            'instrumentation is already enabled'
+        )
+    reset()
+    for owner, name, miss_name in INSTRUMENTED_FUNCTIONS:
+        statistics = _function_statistics[_get_qualified_name(owner, name)]
+        _replace_attribute(
+            owner,
+            name,
+            lambda function: _wrap_function(function, statistics)
+        )
+        if miss_name is not None:
+            _replace_attribute(
+                owner,
+                miss_name,
+                lambda function: _wrap_miss_function(function, statistics)
+            )
+    _enabled = True
+
+
+def disable():
+    """
+    Put the original functions back. The statistics recorded so far are
+    kept until instrumentation is next enabled, or reset is called.
+    """
+    global _enabled
+    while _originals:
+        owner, name, attribute = _originals.pop()
+        setattr(owner, name, attribute)
+    _enabled = False
+
+
+def reset():
+    """
+    Forget all the statistics recorded so far.
+    """
+    _function_statistics.clear()
+    for owner, name, _ in INSTRUMENTED_FUNCTIONS:
+        _function_statistics[_get_qualified_name(owner, name)] = (
+            FunctionStatistics()
+        )
+    _lru_cache_starts.clear()
+    for name, cached_function in LRU_CACHES.items():
+        _lru_cache_starts[name] = cached_function.cache_info()
+    _cache_statistics.clear()
+
+
+@contextmanager
+def instrumented():
+    """
+    A context manager which enables instrumentation within it, and
+    disables it afterwards.
+    """
+    enable()
+    try:
+        yield
+    finally:
+        disable()
+
+
+def record_cache(name, hits, misses):
+    """
+    Record the hits and misses of a cache that is not otherwise
+    instrumented, such as a result_cache.ResultCache, to be included in
+    the report under name.
+    """
+    _cache_statistics[name] = (hits, misses)
+
+
+def _get_hit_rate(hits, misses):
+    lookups = hits + misses
+    return hits / lookups if lookups else None
+
+
+def get_report():
+    """
+    Get a dictionary with a 'functions' dictionary, from the qualified
+    name of each instrumented function to its calls, seconds, and
+    seconds per call, along with its cache hits, misses and hit rate if
+    it has a cache, and a 'caches' dictionary, from the name of each
+    other cache to its hits, misses and hit rate.
+    """
+    functions = {}
+    for (owner, name, miss_name) in INSTRUMENTED_FUNCTIONS:
+        qualified_name = _get_qualified_name(owner, name)
+        statistics = _function_statistics.get(qualified_name)
+        if statistics is None:
+            continue
+        report = {
+            'calls': statistics.calls,
+            'seconds': statistics.seconds,
+            'seconds_per_call': (
+                statistics.seconds / statistics.calls
+                if statistics.calls else None
+            )
+        }
+        if miss_name is not None:
+            hits = statistics.calls - statistics.misses
+            report.update(
+                {
+                    'hits': hits,
+                    'misses': statistics.misses,
+                    'hit_rate': _get_hit_rate(hits, statistics.misses)
+                }
+            )
+        functions[qualified_name] = report
+
+    caches = {}
+    for name, cached_function in LRU_CACHES.items():
+        start = _lru_cache_starts.get(name)
+        if start is None:
+            continue
+        end = cached_function.cache_info()
+        hits = end.hits - start.hits
+        misses = end.misses - start.misses
+        caches[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': _get_hit_rate(hits, misses)
+        }
+    for name, (hits, misses) in _cache_statistics.items():
+        caches[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': _get_hit_rate(hits, misses)
+        }
+
+    return {'functions': functions, 'caches': caches}
+
+
+def _format_hit_rate(hit_rate):
+    return '-' if hit_rate is None else f'{hit_rate:.1%}'
+
+
+def format_report(report=None):
+    """
+    Get the report (by default, the current one) as a table.
+    """
+    if report is None:
+        report = get_report()
+    lines = [
+        f'{"function":50} {"calls":>10} {"seconds":>10} '
+        f'{"us/call":>10} {"hit rate":>9}'
+    ]
+    for name, function_report in report['functions'].items():
+        seconds_per_call = function_report['seconds_per_call']
+        lines.append(
+            f'{name:50} {function_report["calls"]:10} '
+            f'{function_report["seconds"]:10.3f} '
+            + (
+                f'{seconds_per_call * 1e6:10.2f} '
+                if seconds_per_call is not None else f'{"-":>10} '
+            )
+            + f'{_format_hit_rate(function_report.get("hit_rate")):>9}'
+        )
+    lines.append('')
+    lines.append(f'{"cache":50} {"hits":>10} {"misses":>10} {"hit rate":>9}')
+    for name, cache_report in report['caches'].items():
+        lines.append(
+            f'{name:50} {cache_report["hits"]:10} '
+            f'{cache_report["misses"]:10} '
+            f'{_format_hit_rate(cache_report["hit_rate"]):>9}'
+        )
+    return '\n'.join(lines) + '\n'
+
+
+def write_report(path, report=None):
+    """
+    Write the report (by default, the current one) to path as JSON.
+    """
+    if report is None:
+        report = get_report()
+    with open(path, 'w') as report_file:
+        json.dump(report, report_file, indent=4)
+        report_file.write('\n')
+
+
+def get_destination(value):
+    """
+    Get where the report should go for value of the environment
+    variable, which is '1' for standard error, or a path, or None if
+    instrumentation is off.
+    """
+    if value is None or value.strip().lower() in OFF_VALUES:
+        return None
+    return value
+
+
+def _report_at_exit(destination):
+    if destination == '1':
+        sys.stderr.write(format_report())
+    else:
+        write_report(destination)
+
+
+_destination = get_destination(os.environ.get(ENVIRONMENT_VARIABLE))
+if _destination is not None:
+    enable()
+    atexit.register(_report_at_exit, _destination)
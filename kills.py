@@ -0,0 +1,314 @@
+"""
+This module provides an engine for the exact distribution of the number
+of models slain by a model's weapons in a unit of identical target
+models. Unlike the average damage output, it allows for random damage
+that overkills a model, and for damage that does not carry over from one
+model to the next.
+
+The state of the target unit is the number of models slain and the
+damage taken by the model currently being attacked, and each unsaved
+wound is a Markov transition between these states. A weapon's attacks
+are worked out in two parts: the distribution of the number of
+unsaved wounds they do, built up one attack at a time, and the states
+after each number of unsaved wounds, pushed through one wound at a
+time. Only the first depends on the toughness and save of the target,
+so the second is memoised and shared by every target with the same
+wounds. Neither needs any matrix products, which are slow with the
+exact backend's Fractions.
+"""
+from functools import lru_cache, partial
+
+import amounts
+from __init__ import Model, Weapon
+from sweep import get_results as get_sweep_results
+from vectorised import NonIntegerAmountError
+
+
+class InvalidUnitSizeError(Exception): pass
+
+
+def _get_distribution_key(amount):
+    items = []
+    for value, probability in amounts.get_distribution(amount).items():
+        if value < 0 or value != int(value):
+            raise NonIntegerAmountError(
+                'distributions can only be found for non-negative integers'
+            )
+        items.append((int(value), probability))
+    return tuple(sorted(items))
+
+
+def _convert(probability, backend):
+    return float(probability) if backend == amounts.FLOAT_BACKEND \
+        else probability
+
+
+def _wound(state, target_wounds, damage_distribution):
+    """
+    Get the state, as a tuple of probabilities, after a single unsaved
+    wound from state. The state of slain models with taken damage on
+    the next is slain * target_wounds + taken, and the last state is all
+    models slain. Only the states each damage roll leads to are visited,
+    so this costs the number of states times the number of damage rolls.
+    """
+    all_slain = len(state) - 1
+    next_state = [0] * len(state)
+    next_state[all_slain] = state[all_slain]
+    for index in range(all_slain):
+        probability = state[index]
+        if not probability:
+            continue
+        slain, taken = divmod(index, target_wounds)
+        for damage, damage_probability in damage_distribution:
+            if taken + damage >= target_wounds:
+                # Any excess damage is lost, rather than carrying over to
+                # the next model.
+                next_index = (slain + 1) * target_wounds
+            else:
+                next_index = index + damage
+            next_state[next_index] += probability * damage_probability
+    return tuple(next_state)
+
+
+@lru_cache(maxsize=4096)
+def _get_wounded_states(
+        state,
+        target_wounds,
+        damage_distribution,
+        max_wounds,
+        backend
+    ):
+    """
+    Get a list of the states after each number of unsaved wounds, from
+    zero to max_wounds, from state. These do not depend on the chance
+    of an attack doing an unsaved wound, so are shared by every target
+    with the same wounds. backend is only part of the key, since equal
+    floats and Fractions would otherwise be mistaken for each other.
+    """
+    wounded_states = [state]
+    for _ in range(max_wounds):
+        wounded_states.append(
+            _wound(wounded_states[-1], target_wounds, damage_distribution)
+        )
+    return wounded_states
+
+
+def _get_unsaved_wound_probabilities(
+        damaging_chance,
+        attacks_distribution,
+        backend
+    ):
+    """
+    Get a list of the probabilities of each number of unsaved wounds,
+    from zero to the most attacks, where each attack does an unsaved
+    wound with probability damaging_chance. The distribution after each
+    number of attacks is built up one attack at a time, and mixed by
+    the probability of making that many.
+    """
+    attacks_probabilities = dict(attacks_distribution)
+    max_attacks = max(attacks_probabilities)
+    probabilities = [0] * (max_attacks + 1)
+    after_attacks = [_convert(1, backend)]
+    for attacks in range(max_attacks + 1):
+        if attacks in attacks_probabilities:
+            attacks_probability = _convert(
+                attacks_probabilities[attacks],
+                backend
+            )
+            for wounds, probability in enumerate(after_attacks):
+                probabilities[wounds] += attacks_probability * probability
+        # One more attack either misses, leaving the number of unsaved
+        # wounds as it was, or does one more.
+        after_attacks = [
+            (1 - damaging_chance) * missed + damaging_chance * wounded
+            for missed, wounded in zip(
+                after_attacks + [0],
+                [0] + after_attacks
+            )
+        ]
+    return probabilities
+
+
+@lru_cache(maxsize=4096)
+def _attack_with_weapon(
+        state,
+        target_wounds,
+        damaging_chance,
+        damage_distribution,
+        attacks_distribution,
+        backend
+    ):
+    """
+    Get the state after all of the attacks of a weapon from state,
+    where each attack does an unsaved wound with probability
+    damaging_chance, by mixing the states after each number of unsaved
+    wounds by its probability.
+    """
+    unsaved_wound_probabilities = _get_unsaved_wound_probabilities(
+        damaging_chance,
+        attacks_distribution,
+        backend
+    )
+    wounded_states = _get_wounded_states(
+        state,
+        target_wounds,
+        tuple(
+            [
+                (damage, _convert(probability, backend))
+                for damage, probability in damage_distribution
+            ]
+        ),
+        len(unsaved_wound_probabilities) - 1,
+        backend
+    )
+    next_state = [0] * len(state)
+    for probability, wounded_state in zip(
+            unsaved_wound_probabilities,
+            wounded_states
+    ):
+        if not probability:
+            continue
+        for index, state_probability in enumerate(wounded_state):
+            next_state[index] += probability * state_probability
+    return tuple(next_state)
+
+
+def get_kill_distribution(
+        model,
+        target,
+        weapon_combination,
+        unit_size=1,
+        backend=None
+    ):
+    """
+    Get the probability mass function of the number of models slain by
+    model with the weapons in weapon_combination (used in order) in a
+    unit of unit_size models like target, as a dictionary from each
+    number of models, from zero to unit_size, to its probability.
+    backend is the numeric backend to use, as per the amounts module,
+    where the check backend gives the exact distribution. Attacks and
+    damage that can be negative or fractional raise a
+    NonIntegerAmountError.
+    """
+    if unit_size < 1:
+        raise InvalidUnitSizeError('unit_size must be at least one')
+    backend = amounts.resolve_backend(backend)
+    if backend == amounts.CHECK_BACKEND:
+        backend = amounts.EXACT_BACKEND
+    target_wounds = int(target.stat_line[Model.WOUNDS_STAT_NAME])
+
+    state = (_convert(1, backend),) + (0,) * (unit_size * target_wounds)
+    for weapon in weapon_combination:
+        modified_self_stat_line, modified_weapon_stat_line = \
+            model.get_modified_stat_lines(weapon)
+        hit_chance, wound_chance, fraction_unsaved = model.get_roll_chances(
+            target,
+            weapon,
+            modified_self_stat_line,
+            backend
+        )
+        state = _attack_with_weapon(
+            state,
+            target_wounds,
+            hit_chance * wound_chance * fraction_unsaved,
+            _get_distribution_key(
+                modified_weapon_stat_line[Weapon.DAMAGE_STAT_NAME]
+            ),
+            _get_distribution_key(
+                modified_self_stat_line[Model.ATTACKS_STAT_NAME]
+            ),
+            backend
+        )
+
+    kill_distribution = {
+        slain: sum(
+            state[slain * target_wounds:(slain + 1) * target_wounds]
+        )
+        for slain in range(unit_size)
+    }
+    kill_distribution[unit_size] = state[-1]
+    if backend == amounts.FLOAT_BACKEND:
+        kill_distribution = {
+            slain: float(probability)
+            for slain, probability in kill_distribution.items()
+        }
+    return kill_distribution
+
+
+def get_average_kills(
+        model,
+        target,
+        weapon_combination,
+        unit_size=1,
+        backend=None
+    ):
+    """
+    Get the expected number of models slain by model with the weapons
+    in weapon_combination in a unit of unit_size models like target.
+    """
+    backend = amounts.resolve_backend(backend)
+    if backend == amounts.CHECK_BACKEND:
+        return amounts.check_backends(
+            lambda backend: get_average_kills(
+                model,
+                target,
+                weapon_combination,
+                unit_size,
+                backend
+            )
+        )
+    return sum(
+        [
+            slain * probability
+            for slain, probability in get_kill_distribution(
+                model,
+                target,
+                weapon_combination,
+                unit_size,
+                backend
+            ).items()
+        ]
+    )
+
+
+def get_average_kill_efficiency(
+        model,
+        target,
+        weapon_combination,
+        unit_size=1,
+        backend=None
+    ):
+    """
+    Get the expected number of models slain per point, as per
+    get_average_kills.
+    """
+    points_cost = model.get_points_cost(weapon_combination)
+    average_kills = get_average_kills(
+        model,
+        target,
+        weapon_combination,
+        unit_size,
+        backend
+    )
+    try:
+        return average_kills / points_cost
+    except ZeroDivisionError:
+        raise Model.InvalidModelForEfficiencyError(
+            'zero points cost cannot have an efficiency'
+        )
+
+
+def get_results(targets, options, unit_size=1, backend=None, cache=None):
+    """
+    Generate the results of sweep.get_results, where efficiency is the
+    expected number of models slain per point in a unit of unit_size
+    models like the target. backend and cache are as for
+    sweep.get_results.
+    """
+    return get_sweep_results(
+        targets,
+        options,
+        backend,
+        cache,
+        partial(get_average_kill_efficiency, unit_size=unit_size)
+    )
@@ -0,0 +1,162 @@
+"""
+This module provides matchup matrices, of the average damage output and
+efficiency of every attacking loadout in one list against every
+defending model in another, such as the units of two rosters.
+
+Each distinct model and weapon pair among the attackers is evaluated
+once against every defender at once, using the vectorised module, and
+the loadouts are then combined from these per weapon vectors with a
+single matrix product.
+"""
+import numpy as np
+
+from __init__ import Model
+from sweep import get_loadout_name
+import vectorised
+
+
+def get_loadouts(options):
+    """
+    Get a list of (model, weapon_combination) pairs of every loadout in
+    options, a list of (model, weapon_combinations) pairs, such as from
+    Roster.get_options.
+    """
+    return [
+        (model, weapon_combination)
+        for model, weapon_combinations in options
+        for weapon_combination in weapon_combinations
+    ]
+
+
+def get_defender_stats(defenders):
+    """
+    Get a tuple of arrays of the wounds, toughness and save of each of
+    the models in defenders, using the same stats (modified by their
+    abilities or not) as the scalar calculation.
+    """
+    wounds = []
+    toughnesses = []
+    saves = []
+    for defender in defenders:
+        modified_defender_stat_line, _ = defender.get_modified_stat_lines()
+        wounds.append(defender.stat_line[Model.WOUNDS_STAT_NAME])
+        toughnesses.append(
+            modified_defender_stat_line[Model.TOUGHNESS_STAT_NAME]
+        )
+        saves.append(defender.stat_line[Model.ARMOUR_SAVE_STAT_NAME])
+    return (
+        np.array(wounds, dtype=float),
+        np.array(toughnesses, dtype=float),
+        np.array(saves, dtype=float)
+    )
+
+
+class MatchupMatrix:
+    """
+    The MatchupMatrix class holds the average damage outputs and
+    efficiencies of a list of attacking loadouts against a list of
+    defending models, as arrays with a row for each attacker and a
+    column for each defender.
+    """
+
+    def __init__(self, attackers, defenders):
+        """
+        Work out the matrices for attackers, a list of (model,
+        weapon_combination) pairs, against defenders, a list of models.
+        The calculations use floats, as per the vectorised module.
+        """
+        self.attackers = attackers
+        self.defenders = defenders
+        self.attacker_names = [
+            get_loadout_name(model, weapon_combination)
+            for model, weapon_combination in attackers
+        ]
+        self.defender_names = [defender.name for defender in defenders]
+
+        wounds, toughnesses, saves = get_defender_stats(defenders)
+
+        # Each distinct model and weapon pair gets a row of outputs, and
+        # weapon_counts[attacker, row] is how many times the attacker
+        # uses it.
+        rows = {}
+        weapon_outputs = []
+        for model, weapon_combination in attackers:
+            for weapon in weapon_combination:
+                key = (id(model), id(weapon))
+                if key not in rows:
+                    rows[key] = len(weapon_outputs)
+                    weapon_outputs.append(
+                        vectorised.get_average_damage_outputs(
+                            model,
+                            weapon,
+                            wounds,
+                            toughnesses,
+                            saves
+                        )
+                    )
+        weapon_counts = np.zeros((len(attackers), len(weapon_outputs)))
+        for attacker_index, (model, weapon_combination) in enumerate(
+                attackers
+        ):
+            for weapon in weapon_combination:
+                weapon_counts[attacker_index, rows[id(model), id(weapon)]] += 1
+
+        if weapon_outputs:
+            self.damages = weapon_counts @ np.array(weapon_outputs)
+        else:
+            self.damages = np.zeros((len(attackers), len(defenders)))
+
+        self.points_costs = np.array(
+            [
+                model.get_points_cost(weapon_combination)
+                for model, weapon_combination in attackers
+            ],
+            dtype=float
+        )
+        if np.any(self.points_costs == 0):
+            raise Model.InvalidModelForEfficiencyError(
+                'zero points cost cannot have an efficiency'
+            )
+        self.efficiencies = self.damages / self.points_costs[:, np.newaxis]
+
+    def get_best_attackers(self):
+        """
+        Get a list of the (name, efficiency) pair of the most efficient
+        attacker against each defender. Of equal attackers, the first is
+        chosen.
+        """
+        best_indices = np.argmax(self.efficiencies, axis=0)
+        return [
+            (
+                self.attacker_names[attacker_index],
+                float(self.efficiencies[attacker_index, defender_index])
+            )
+            for defender_index, attacker_index in enumerate(best_indices)
+        ]
+
+    def format_best_attackers(self):
+        """
+        Get a report of the most efficient attacker against each
+        defender, one per line.
+        """
+        return ''.join(
+            [
+                f'{defender_name} - {name} {efficiency}\n'
+                for defender_name, (name, efficiency) in zip(
+                    self.defender_names,
+                    self.get_best_attackers()
+                )
+            ]
+        )
+
+
+def get_matchups(attacking_options, defending_options):
+    """
+    Get the MatchupMatrix of every loadout in attacking_options against
+    the model of every unit in defending_options, both lists of (model,
+    weapon_combinations) pairs, such as from Roster.get_options.
+    """
+    return MatchupMatrix(
+        get_loadouts(attacking_options),
+        [model for model, _ in defending_options]
+    )
@@ -0,0 +1,195 @@
+"""
+This module provides an optimiser that chooses how many of each
+loadout to take in an army, to maximise its expected damage against a
+weighted mix of targets within a points budget.
+"""
+from fractions import Fraction
+import math
+
+import numpy as np
+
+import amounts
+from sweep import get_loadout_name
+
+
+# Points costs are taken to be exact to a fraction of a point with at most
+# this denominator, so that float costs such as 0.1 are not taken to be
+# the nearest binary fraction, which would need a tiny resolution.
+MAX_POINTS_DENOMINATOR = 1000
+# The most steps of points the budget may be split into, which bounds
+# the memory the optimiser needs.
+MAX_BUDGET_STEPS = 1000000
+
+
+class InvalidPointsResolutionError(Exception): pass
+
+
+def _get_exact_points(points):
+    return Fraction(points).limit_denominator(MAX_POINTS_DENOMINATOR)
+
+
+def get_points_resolution(points_costs):
+    """
+    Get the largest resolution that every one of points_costs is a
+    whole multiple of, so that none of them needs to be rounded.
+    """
+    costs = [_get_exact_points(cost) for cost in points_costs if cost > 0]
+    if not costs:
+        return Fraction(1)
+    denominator = math.lcm(*[cost.denominator for cost in costs])
+    return Fraction(
+        math.gcd(*[int(cost * denominator) for cost in costs]),
+        denominator
+    )
+
+
+def get_loadout_values(options, weighted_targets, backend=None):
+    """
+    Get a list of (model, weapon_combination, points_cost, value)
+    tuples, one for every loadout in options, where value is the
+    weighted sum of the average damage output of the loadout against
+    the targets in weighted_targets, a list of (target, weight) pairs.
+    backend is the numeric backend to use, as per the amounts module.
+    """
+    loadout_values = []
+    for model, weapon_combinations in options:
+        for weapon_combination in weapon_combinations:
+            value = sum(
+                [
+                    weight * model.get_average_damage_output(
+                        target,
+                        weapon,
+                        backend
+                    )
+                    for target, weight in weighted_targets
+                    for weapon in weapon_combination
+                ]
+            )
+            loadout_values.append(
+                (
+                    model,
+                    weapon_combination,
+                    model.get_points_cost(weapon_combination),
+                    float(value)
+                )
+            )
+    return loadout_values
+
+
+def optimise_army(
+        options,
+        points_budget,
+        weighted_targets,
+        max_counts={},
+        points_resolution=None,
+        backend=amounts.FLOAT_BACKEND
+    ):
+    """
+    Choose how many of each loadout in options to take, to maximise
+    the expected damage against weighted_targets (a list of (target,
+    weight) pairs) without going over points_budget. max_counts may
+    limit the number of a loadout, by its name (as per
+    sweep.get_loadout_name), and otherwise any number may be taken.
+
+    This is solved as a bounded knapsack problem with dynamic
+    programming over points, in steps of points_resolution. Each
+    loadout is split into items of 1, 2, 4, ... copies, so that the
+    work grows with the logarithm of the counts, rather than
+    enumerating armies. By default, the resolution is the largest that
+    every cost is a multiple of, as per get_points_resolution, so the
+    army found is the best possible. A coarser resolution may be given
+    to need less work, in which case costs are rounded up to it, so the
+    army found never goes over the budget, but may not be the best.
+
+    Return a tuple of a list of (model, weapon_combination, count)
+    tuples for the loadouts taken, the total points cost, and the total
+    expected damage.
+    """
+    loadout_values = get_loadout_values(options, weighted_targets, backend)
+    if points_resolution is None:
+        points_resolution = get_points_resolution(
+            [points_cost for _, _, points_cost, _ in loadout_values]
+        )
+    points_resolution = _get_exact_points(points_resolution)
+    if points_resolution <= 0:
+        raise InvalidPointsResolutionError(
+            'points_resolution must be positive'
+        )
+    budget_steps = math.floor(
+        _get_exact_points(points_budget) / points_resolution
+    )
+    if budget_steps > MAX_BUDGET_STEPS:
+        raise InvalidPointsResolutionError(
+            f'a points_resolution of {points_resolution} splits the budget '
+            f'into more than {MAX_BUDGET_STEPS} steps, so a coarser one '
+            'must be given'
+        )
+
+    # Each item is the index of a loadout, and how many copies of it the
+    # item stands for.
+    items = []
+    for index, (model, weapon_combination, points_cost, value) in enumerate(
+            loadout_values
+    ):
+        if value <= 0:
+            continue
+        cost_steps = max(
+            1,
+            math.ceil(_get_exact_points(points_cost) / points_resolution)
+        )
+        max_count = min(
+            max_counts.get(
+                get_loadout_name(model, weapon_combination),
+                budget_steps
+            ),
+            budget_steps // cost_steps
+        )
+        copies = 1
+        while max_count > 0:
+            item_copies = min(copies, max_count)
+            items.append((index, item_copies, cost_steps * item_copies))
+            max_count -= item_copies
+            copies *= 2
+
+    # best_values[steps] is the best value for at most steps of points, and
+    # taken[item, steps] records whether that item was taken to get it.
+    best_values = np.zeros(budget_steps + 1)
+    taken = np.zeros((len(items), budget_steps + 1), dtype=bool)
+    for item_index, (index, copies, cost_steps) in enumerate(items):
+        item_value = loadout_values[index][3] * copies
+        values_with_item = np.full(budget_steps + 1, -np.inf)
+        values_with_item[cost_steps:] = (
+            best_values[:budget_steps + 1 - cost_steps] + item_value
+        )
+        taken[item_index] = values_with_item > best_values
+        best_values = np.maximum(best_values, values_with_item)
+
+    counts = [0] * len(loadout_values)
+    steps = budget_steps
+    for item_index in range(len(items) - 1, -1, -1):
+        if taken[item_index, steps]:
+            index, copies, cost_steps = items[item_index]
+            counts[index] += copies
+            steps -= cost_steps
+
+    army = [
+        (model, weapon_combination, count)
+        for (model, weapon_combination, _, _), count in zip(
+            loadout_values,
+            counts
+        )
+        if count > 0
+    ]
+    total_points = sum(
+        [
+            model.get_points_cost(weapon_combination) * count
+            for model, weapon_combination, count in army
+        ]
+    )
+    total_value = sum(
+        [
+            loadout_values[index][3] * count
+            for index, count in enumerate(counts)
+        ]
+    )
+    return army, total_points, total_value
@@ -0,0 +1,317 @@
+"""
+This module provides a pre-pass over a grid of targets, which finds the
+loadouts that cannot be in the top k for any target, using cheap bounds
+on their efficiency over regions of the grid, so that only the
+plausible contenders need to be evaluated in full.
+
+The efficiency of a loadout against a target with no abilities never
+decreases with the wounds or save of the target, and never increases
+with its toughness. So, over a box of targets, its efficiency is at most
+its efficiency against the most wounds, lowest toughness and worst save
+in the box, and at least that against the fewest wounds, highest
+toughness and best save. A loadout whose best case in a box is below
+the worst case of k others cannot be in the top k anywhere in it. Boxes
+where this does not settle things are split in half, down to single
+targets, and the bounds are worked out for every box at the same depth
+at once, using the vectorised module.
+"""
+from itertools import product
+
+import numpy as np
+
+from sweep import get_loadout_name, get_results as get_sweep_results
+import vectorised
+
+
+# Bounds are calculated with floats, so a loadout is only pruned if its
+# best case is below the threshold by more than this fraction of it.
+RELATIVE_TOLERANCE = 1e-9
+
+
+class InvalidTopCountError(Exception): pass
+
+
+def _format_range(values, indices):
+    low, high = indices
+    if low == high:
+        return f'{values[low]}'
+    return f'{values[low]}-{values[high]}'
+
+
+def _get_corners(axes, region):
+    """
+    Get a pair of the (wounds, toughness, save) of the best and worst
+    case targets in region.
+    """
+    (wounds, toughness, save) = region
+    return (
+        (axes[0][wounds[1]], axes[1][toughness[0]], axes[2][save[1]]),
+        (axes[0][wounds[0]], axes[1][toughness[1]], axes[2][save[0]])
+    )
+
+
+def _get_options(loadouts, loadout_indices):
+    """
+    Get the loadouts at loadout_indices, in order, as a list of (model,
+    weapon_combinations) pairs.
+    """
+    options = []
+    for index in loadout_indices:
+        model, weapon_combination, _ = loadouts[index]
+        if options and options[-1][0] is model:
+            options[-1][1].append(weapon_combination)
+        else:
+            options.append((model, [weapon_combination]))
+    return options
+
+
+class PruningResult:
+    """
+    The PruningResult class holds the outcome of prune. Its attributes
+    are:
+
+        loadouts: a list of the (model, weapon_combination, name) of
+            every loadout in the options, in order.
+        contenders: a list of (targets, loadout_indices) pairs, one for
+            each region of the grid, where targets is a dictionary of
+            the targets in the region, and loadout_indices are the
+            indices of the loadouts that could be in the top k for them.
+        reasons: a dictionary from the index of each loadout that was
+            pruned from any region to a list of (region, best_case,
+            threshold, names) tuples, where region describes the
+            targets, best_case is the most the loadout could get in it,
+            threshold is the least the top k could get there, and names
+            are the loadouts with the k best worst cases.
+    """
+
+    def __init__(self, k, loadouts, contenders, reasons):
+        self.k = k
+        self.loadouts = loadouts
+        self.contenders = contenders
+        self.reasons = reasons
+
+    def get_contender_indices(self):
+        """
+        Get a sorted list of the indices of the loadouts that are
+        contenders for at least one target.
+        """
+        return sorted(
+            {
+                index
+                for _, loadout_indices in self.contenders
+                for index in loadout_indices
+            }
+        )
+
+    def get_pruned_indices(self):
+        """
+        Get a sorted list of the indices of the loadouts that cannot be
+        in the top k for any target.
+        """
+        contender_indices = set(self.get_contender_indices())
+        return [
+            index
+            for index in range(len(self.loadouts))
+            if index not in contender_indices
+        ]
+
+    def get_options(self):
+        """
+        Get the options with only the loadouts that are contenders for
+        at least one target, in the same form and order as the options
+        given to prune.
+        """
+        return _get_options(self.loadouts, self.get_contender_indices())
+
+    def get_results(self, backend=None, cache=None):
+        """
+        Generate the results of sweep.get_results for each target and
+        the loadouts that could be in the top k for it, grouped by the
+        regions the targets were split into. Any reducer keeping the top
+        k or fewer gets the same results as from a full sweep. backend
+        and cache are as for sweep.get_results.
+        """
+        for targets, loadout_indices in self.contenders:
+            yield from get_sweep_results(
+                targets,
+                _get_options(self.loadouts, loadout_indices),
+                backend,
+                cache
+            )
+
+    def format_report(self):
+        """
+        Get a report of which loadouts were pruned everywhere, and why,
+        followed by a count of how many evaluations remain.
+        """
+        lines = []
+        for index in self.get_pruned_indices():
+            _, _, name = self.loadouts[index]
+            reasons = self.reasons[index]
+            lines.append(
+                f'{name} cannot be in the top {self.k} for any target, as '
+                f'in each of {len(reasons)} regions its best case is below '
+                f'the worst case of the top {self.k}:\n'
+            )
+            for region, best_case, threshold, names in reasons:
+                lines.append(
+                    f'    {region} - {best_case} < {threshold} '
+                    f'({", ".join(names)})\n'
+                )
+        evaluations = sum(
+            [
+                len(targets) * len(loadout_indices)
+                for targets, loadout_indices in self.contenders
+            ]
+        )
+        targets = sum([len(targets) for targets, _ in self.contenders])
+        lines.append(
+            f'{len(self.get_pruned_indices())} of {len(self.loadouts)} '
+            f'loadouts pruned, leaving {evaluations} of '
+            f'{targets * len(self.loadouts)} evaluations\n'
+        )
+        return ''.join(lines)
+
+
+def prune(targets, options, k=1):
+    """
+    Find the loadouts in options (a list of (model, weapon_combinations)
+    pairs) that could be in the top k for each of targets (a dictionary
+    from (wounds, toughness, save) tuples to target models with no
+    abilities), and return a PruningResult.
+    """
+    if k < 1:
+        raise InvalidTopCountError('k must be at least one')
+    loadouts = [
+        (
+            model,
+            weapon_combination,
+            get_loadout_name(model, weapon_combination)
+        )
+        for model, weapon_combinations in options
+        for weapon_combination in weapon_combinations
+    ]
+    axes = [
+        sorted({key[axis] for key in targets.keys()})
+        for axis in range(3)
+    ]
+    target_indices = {
+        (
+            axes[0].index(wounds),
+            axes[1].index(toughness),
+            axes[2].index(save)
+        ): (wounds, toughness, save)
+        for wounds, toughness, save in targets.keys()
+    }
+
+    contenders = []
+    reasons = {}
+    if not targets:
+        return PruningResult(k, loadouts, contenders, reasons)
+
+    # Each region is a tuple of (low, high) index ranges along the
+    # wounds, toughness and save axes, along with the indices of the
+    # loadouts still in contention in it.
+    regions = [
+        (
+            tuple((0, len(values) - 1) for values in axes),
+            list(range(len(loadouts)))
+        )
+    ]
+    while regions:
+        # The best and worst cases of every loadout in every region at
+        # this depth are worked out together.
+        corners = np.array(
+            [_get_corners(axes, region) for region, _ in regions],
+            dtype=float
+        )
+        bounds = np.array(
+            [
+                vectorised.get_average_damage_efficiencies(
+                    model,
+                    weapon_combination,
+                    corners[:, :, 0],
+                    corners[:, :, 1],
+                    corners[:, :, 2]
+                )
+                for model, weapon_combination, _ in loadouts
+            ]
+        )
+
+        next_regions = []
+        for region_index, (region, loadout_indices) in enumerate(regions):
+            region_targets = {
+                target_indices[indices]: targets[target_indices[indices]]
+                for indices in product(
+                    *[range(low, high + 1) for low, high in region]
+                )
+                if indices in target_indices
+            }
+            if not region_targets:
+                continue
+
+            best_cases = bounds[loadout_indices, region_index, 0]
+            worst_cases = bounds[loadout_indices, region_index, 1]
+            survivors = loadout_indices
+            if len(loadout_indices) > k:
+                # Of equal worst cases, the loadout that comes first is
+                # named.
+                top = sorted(
+                    range(len(loadout_indices)),
+                    key=lambda position: -worst_cases[position]
+                )[:k]
+                threshold = worst_cases[top[-1]]
+                cutoff = threshold - abs(threshold) * RELATIVE_TOLERANCE
+                survivors = []
+                description = ', '.join(
+                    [
+                        f'{name}: {_format_range(values, indices)}'
+                        for name, values, indices in zip(
+                            ['W', 'T', 'Sv'],
+                            axes,
+                            region
+                        )
+                    ]
+                )
+                for position, index in enumerate(loadout_indices):
+                    if best_cases[position] < cutoff:
+                        reasons.setdefault(index, []).append(
+                            (
+                                description,
+                                float(best_cases[position]),
+                                float(threshold),
+                                [
+                                    loadouts[loadout_indices[top_position]][2]
+                                    for top_position in top
+                                ]
+                            )
+                        )
+                    else:
+                        survivors.append(index)
+
+            if len(survivors) <= k or len(region_targets) == 1:
+                contenders.append((region_targets, survivors))
+                continue
+            # The region is split in half along its longest axis.
+            axis = max(
+                range(3),
+                key=lambda axis: region[axis][1] - region[axis][0]
+            )
+            low, high = region[axis]
+            middle = (low + high) // 2
+            for half in ((low, middle), (middle + 1, high)):
+                next_regions.append(
+                    (region[:axis] + (half,) + region[axis + 1:], survivors)
+                )
+        regions = next_regions
+
+    return PruningResult(k, loadouts, contenders, reasons)
+
+
+def get_results(targets, options, k=1, backend=None, cache=None):
+    """
+    Generate the results of sweep.get_results for each target and the
+    loadouts that could be in the top k for it, as found by prune. See
+    PruningResult.get_results.
+    """
+    return prune(targets, options, k).get_results(backend, cache)
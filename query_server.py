@@ -0,0 +1,476 @@
+"""
+This module provides a local query server over the results of a sweep,
+as written to a result store by analysis.py, so that tools can ask for
+the best loadouts without parsing best.txt. It is started with:
+
+    python query_server.py [--results PATH] [--port PORT]
+
+and listens on localhost. Each request is a JSON object on its own
+line, and each response is a JSON object on its own line, with either a
+"results" or an "error" key. Requests longer than the limit of the
+connection's stream (64 KiB by default) are skipped, with an error
+response. The requests are:
+
+    {"query": "top", "wounds": 3, "toughness": 7, "save": 3, "k": 5}
+        the k (by default, one) most efficient loadouts against the
+        target, as a list of {"name", "efficiency"} objects.
+    {"query": "wins", "loadout": "*lascannon*"}
+        the targets each loadout whose name matches the shell style
+        pattern is the most efficient against, as a list of {"name",
+        "targets"} objects, where targets are [wounds, toughness, save]
+        lists.
+    {"query": "compare", "loadouts": [NAME, ...], "wounds": 3}
+        the efficiency of each of the named loadouts against every
+        target, or only those with the wounds, toughness and save given,
+        as a list of {"wounds", "toughness", "save", "efficiencies"}
+        objects.
+    {"query": "loadouts"}
+        the names of every loadout.
+    {"query": "status"}
+        the number of results and loadouts, and when they were loaded.
+
+The results are indexed in memory when they are loaded, with every
+target's loadouts ranked in advance, so queries are only lookups. The
+store is checked for a newly finished sweep in the background, which is
+indexed in another thread and swapped in once it is ready, so queries
+are never held up by a reload.
+"""
+import argparse
+import asyncio
+from fnmatch import fnmatch
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from result_store import MANIFEST_FILE_NAME, ResultStore
+
+
+DEFAULT_RESULTS_PATH = 'results'
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_RELOAD_INTERVAL = 1.0
+
+
+class QueryError(Exception): pass
+class IncompleteResultsError(Exception): pass
+class RequestTooLongError(Exception): pass
+
+
+async def _read_line(reader):
+    """
+    Read a line from reader, as per StreamReader.readline, but if it is
+    longer than the limit of reader, skip the whole line, including any
+    of it that has not arrived yet, and raise a RequestTooLongError.
+    """
+    try:
+        return await reader.readuntil(b'\n')
+    except asyncio.IncompleteReadError as error:
+        return error.partial
+    except asyncio.LimitOverrunError as error:
+        consumed = error.consumed
+    while True:
+        await reader.readexactly(consumed)
+        try:
+            await reader.readuntil(b'\n')
+            break
+        except asyncio.IncompleteReadError:
+            break
+        except asyncio.LimitOverrunError as error:
+            consumed = error.consumed
+    raise RequestTooLongError('the request is too long')
+
+
+def _get_manifest_signature(path):
+    """
+    Get something that changes whenever the manifest of the store at
+    path is rewritten.
+    """
+    manifest_stat = os.stat(os.path.join(path, MANIFEST_FILE_NAME))
+    return manifest_stat.st_mtime_ns, manifest_stat.st_size
+
+
+class ResultIndex:
+    """
+    The ResultIndex class holds the results of a complete sweep in
+    memory, as a matrix of the efficiency of every loadout (column)
+    against every target (row), along with every row's loadouts ranked
+    from best to worst. Of equal loadouts, the one that comes first in
+    the sweep is ranked higher, as per TopResultsReducer.
+    """
+
+    def __init__(self, store):
+        """
+        Index the results in store, a ResultStore, which must be
+        complete.
+        """
+        if not store.complete:
+            raise IncompleteResultsError('the sweep has not finished yet')
+        columns = store.load()
+        self.loadout_names = store.get_loadout_names()
+        self.loadout_indices = {
+            name: index for index, name in enumerate(self.loadout_names)
+        }
+        self.rows = store.rows
+
+        targets, target_rows = np.unique(
+            np.stack(
+                [columns['wounds'], columns['toughness'], columns['save']],
+                axis=1
+            ),
+            axis=0,
+            return_inverse=True
+        )
+        self.targets = [tuple(target) for target in targets.tolist()]
+        self.target_rows = {
+            target: row for row, target in enumerate(self.targets)
+        }
+        # Loadouts with no result against a target are ranked last.
+        self.efficiencies = np.full(
+            (len(self.targets), len(self.loadout_names)),
+            np.nan
+        )
+        self.efficiencies[
+            np.reshape(target_rows, -1),
+            columns['loadout']
+        ] = columns['efficiency']
+        self.rankings = np.argsort(-self.efficiencies, axis=1, kind='stable')
+
+        self.wins = {}
+        for row, loadout in enumerate(self.rankings[:, 0].tolist()):
+            if not np.isnan(self.efficiencies[row, loadout]):
+                self.wins.setdefault(loadout, []).append(self.targets[row])
+
+    def _get_row(self, wounds, toughness, save):
+        try:
+            return self.target_rows[wounds, toughness, save]
+        except KeyError:
+            raise QueryError(
+                f'there are no results for W: {wounds}, T: {toughness}, '
+                f'Sv: {save}'
+            )
+
+    def _get_loadout(self, name):
+        try:
+            return self.loadout_indices[name]
+        except KeyError:
+            raise QueryError(f'there is no loadout called {name!r}')
+
+    def get_top(self, wounds, toughness, save, k=1):
+        """
+        Get a list of the (name, efficiency) pairs of the k most
+        efficient loadouts against the target, best first.
+        """
+        row = self._get_row(wounds, toughness, save)
+        return [
+            (
+                self.loadout_names[loadout],
+                float(self.efficiencies[row, loadout])
+            )
+            for loadout in self.rankings[row, :k].tolist()
+            if not np.isnan(self.efficiencies[row, loadout])
+        ]
+
+    def get_wins(self, pattern):
+        """
+        Get a list of the (name, targets) pairs of every loadout whose
+        name matches the shell style pattern, where targets is a list of
+        the (wounds, toughness, save) of each target it is the most
+        efficient against.
+        """
+        return [
+            (name, self.wins.get(loadout, []))
+            for loadout, name in enumerate(self.loadout_names)
+            if fnmatch(name, pattern)
+        ]
+
+    def compare(self, names, wounds=None, toughness=None, save=None):
+        """
+        Get a list of the (target, efficiencies) pairs of every target
+        matching the wounds, toughness and save given, where
+        efficiencies are those of the loadouts called names, in order.
+        """
+        loadouts = [self._get_loadout(name) for name in names]
+        comparisons = []
+        for row, target in enumerate(self.targets):
+            if any(
+                    [
+                        value is not None and value != target_value
+                        for value, target_value in zip(
+                            (wounds, toughness, save),
+                            target
+                        )
+                    ]
+            ):
+                continue
+            # Missing results are None, as JSON has no NaN.
+            comparisons.append(
+                (
+                    target,
+                    [
+                        None if np.isnan(efficiency) else efficiency
+                        for efficiency in self.efficiencies[
+                            row,
+                            loadouts
+                        ].tolist()
+                    ]
+                )
+            )
+        return comparisons
+
+
+def _get_integer(request, key, default=None):
+    value = request.get(key, default)
+    if value is not None and (
+            isinstance(value, bool) or not isinstance(value, int)
+    ):
+        raise QueryError(f'{key} must be an integer')
+    return value
+
+
+def _get_target(request):
+    target = tuple(
+        _get_integer(request, key)
+        for key in ('wounds', 'toughness', 'save')
+    )
+    if None in target:
+        raise QueryError('wounds, toughness and save must all be given')
+    return target
+
+
+class QueryServer:
+    """
+    The QueryServer class answers queries over the results in the store
+    at path, reloading them whenever a new sweep finishes there.
+    """
+
+    def __init__(self, path, reload_interval=DEFAULT_RELOAD_INTERVAL):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.index = None
+        self.loaded_at = None
+        self._signature = None
+
+    def _load(self):
+        """
+        Index the store, and get a tuple of the index and the signature
+        of the manifest it was read from, or None if the sweep has not
+        finished, or the store changed while it was being read.
+        """
+        signature = _get_manifest_signature(self.path)
+        try:
+            index = ResultIndex(ResultStore(self.path))
+        except IncompleteResultsError:
+            return None
+        if _get_manifest_signature(self.path) != signature:
+            return None
+        return index, signature
+
+    def load(self):
+        """
+        Load the results now, raising an IncompleteResultsError if they
+        cannot be.
+        """
+        loaded = self._load()
+        if loaded is None:
+            raise IncompleteResultsError(
+                f'{self.path} does not hold the results of a finished sweep'
+            )
+        self._swap(*loaded)
+
+    def _swap(self, index, signature):
+        # Queries only look at self.index once, so they see either the
+        # old index or the new one.
+        self.index = index
+        self._signature = signature
+        self.loaded_at = time.time()
+
+    async def reload_periodically(self):
+        """
+        Check for new results every reload_interval seconds, and index
+        them in another thread, until cancelled.
+        """
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                if _get_manifest_signature(self.path) == self._signature:
+                    continue
+                loaded = await asyncio.to_thread(self._load)
+            except Exception as error:
+                # The store may be part way through being rewritten, which
+                # can fail in many ways, such as an EOFError from a half
+                # written chunk. None of them should stop the reloads, so
+                # the old index is kept, and the next check tries again.
+                sys.stderr.write(
+                    f'could not reload {self.path}: '
+                    f'{type(error).__name__}: {error}\n'
+                )
+                continue
+            if loaded is not None:
+                self._swap(*loaded)
+
+    def answer(self, request):
+        """
+        Get the response to request, a dictionary parsed from a JSON
+        query.
+        """
+        index = self.index
+        try:
+            if not isinstance(request, dict):
+                raise QueryError('queries must be JSON objects')
+            query = request.get('query')
+            if query == 'top':
+                k = _get_integer(request, 'k', 1)
+                if k < 1:
+                    raise QueryError('k must be at least one')
+                results = [
+                    {'name': name, 'efficiency': efficiency}
+                    for name, efficiency in index.get_top(
+                        *_get_target(request),
+                        k
+                    )
+                ]
+            elif query == 'wins':
+                pattern = request.get('loadout')
+                if not isinstance(pattern, str):
+                    raise QueryError('loadout must be a string')
+                results = [
+                    {
+                        'name': name,
+                        'targets': [list(target) for target in targets]
+                    }
+                    for name, targets in index.get_wins(pattern)
+                ]
+            elif query == 'compare':
+                names = request.get('loadouts')
+                if not isinstance(names, list) or not all(
+                        [isinstance(name, str) for name in names]
+                ):
+                    raise QueryError('loadouts must be a list of names')
+                results = [
+                    {
+                        'wounds': wounds,
+                        'toughness': toughness,
+                        'save': save,
+                        'efficiencies': efficiencies
+                    }
+                    for (wounds, toughness, save), efficiencies
+                    in index.compare(
+                        names,
+                        _get_integer(request, 'wounds'),
+                        _get_integer(request, 'toughness'),
+                        _get_integer(request, 'save')
+                    )
+                ]
+            elif query == 'loadouts':
+                results = index.loadout_names
+            elif query == 'status':
+                results = {
+                    'path': self.path,
+                    'rows': index.rows,
+                    'loadouts': len(index.loadout_names),
+                    'targets': len(index.targets),
+                    'loaded_at': self.loaded_at
+                }
+            else:
+                raise QueryError(f'unknown query {query!r}')
+        except QueryError as error:
+            return {'error': str(error)}
+        return {'results': results}
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answer each line sent on a connection, until it is closed.
+        """
+        try:
+            while True:
+                try:
+                    line = await _read_line(reader)
+                except RequestTooLongError as error:
+                    response = {'error': str(error)}
+                else:
+                    if not line:
+                        break
+                    try:
+                        response = self.answer(json.loads(line))
+                    except ValueError as error:
+                        response = {'error': f'invalid JSON: {error}'}
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        """
+        Load the results and serve queries on host and port until
+        cancelled.
+        """
+        self.load()
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        reloading = asyncio.create_task(self.reload_periodically())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            reloading.cancel()
+
+
+async def send_query(request, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    """
+    Send request, a dictionary, to a query server, and get its response.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        writer.write(json.dumps(request).encode() + b'\n')
+        await writer.drain()
+        return json.loads(await reader.readline())
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        description='Serve queries over the results of a sweep.'
+    )
+    parser.add_argument(
+        '--results',
+        default=DEFAULT_RESULTS_PATH,
+        help=f'the result store to serve (default: {DEFAULT_RESULTS_PATH})'
+    )
+    parser.add_argument(
+        '--host',
+        default=DEFAULT_HOST,
+        help=f'the address to listen on (default: {DEFAULT_HOST})'
+    )
+    parser.add_argument(
+        '--port',
+        type=int,
+        default=DEFAULT_PORT,
+        help=f'the port to listen on (default: {DEFAULT_PORT})'
+    )
+    parser.add_argument(
+        '--reload-interval',
+        type=float,
+        default=DEFAULT_RELOAD_INTERVAL,
+        help='how many seconds to wait between checks for new results '
+        f'(default: {DEFAULT_RELOAD_INTERVAL})'
+    )
+    arguments = parser.parse_args(arguments)
+
+    server = QueryServer(arguments.results, arguments.reload_interval)
+    try:
+        asyncio.run(server.serve(arguments.host, arguments.port))
+    except (OSError, IncompleteResultsError) as error:
+        parser.error(str(error))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,29 @@
+"""
+This module provides parsing of ranges of stat values, as given on the
+command line of cli.py and win_index.py.
+"""
+
+
+class InvalidRangeError(ValueError): pass
+
+
+def parse_range(text):
+    """
+    Parse a range of stat values, written as a comma separated list of
+    values and inclusive ranges, such as "4", "1-6" or "1,3,5-7", into a
+    sorted list of integers.
+    """
+    values = set()
+    try:
+        for part in text.split(','):
+            start, _, stop = part.partition('-')
+            start = int(start)
+            stop = int(stop) if stop else start
+            if stop < start:
+                raise ValueError
+            values.update(range(start, stop + 1))
+    except ValueError:
+        raise InvalidRangeError(
+            f'{text!r} is not a list of values or ranges, such as "1,3-6"'
+        )
+    return sorted(values)
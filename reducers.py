@@ -0,0 +1,129 @@
+"""
+This module provides reducers, which consume the results of a sweep one
+at a time, and keep only what is needed to report on them.
+"""
+import heapq
+from itertools import count
+
+
+class TopResultsReducer:
+    """
+    The TopResultsReducer class keeps the k best results for each
+    target profile (a tuple of wounds, toughness and save) in a bounded
+    heap. Equal results are ranked in the order they were added.
+    """
+
+    class NoResultsForTargetError(Exception): pass
+
+    def __init__(self, k=1):
+        """
+        Create a reducer that keeps the best k results for each target
+        profile.
+        """
+        self.k = k
+        self._heaps = {}
+        self._sequence_numbers = count()
+
+    def add(self, wounds, toughness, save, name, result):
+        """
+        Add the result of the loadout called name against the target
+        with the given wounds, toughness and save.
+        """
+        heap = self._heaps.setdefault((wounds, toughness, save), [])
+        # The sequence number is negated so that, of two equal results,
+        # the one added first compares as the larger.
+        entry = (result, -next(self._sequence_numbers), name)
+        if len(heap) < self.k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+    def add_all(self, results):
+        """
+        Add each (wounds, toughness, save, name, result) tuple in the
+        iterable results.
+        """
+        for wounds, toughness, save, name, result in results:
+            self.add(wounds, toughness, save, name, result)
+
+    def get_targets(self):
+        """
+        Get a list of the target profiles that have results, ordered by
+        wounds, then toughness, then save from worst to best.
+        """
+        return sorted(
+            self._heaps.keys(),
+            key=lambda target: (target[0], target[1], -target[2])
+        )
+
+    def get_top(self, wounds, toughness, save):
+        """
+        Get a list of the (name, result) pairs of the best results
+        against the given target, from best to worst.
+        """
+        try:
+            heap = self._heaps[(wounds, toughness, save)]
+        except KeyError:
+            raise TopResultsReducer.NoResultsForTargetError(
+                'no results have been added for that target'
+            )
+        return [(name, result) for result, _, name in sorted(heap)[::-1]]
+
+    def get_best(self, wounds, toughness, save):
+        """
+        Get the (name, result) pair of the best result against the
+        given target.
+        """
+        return self.get_top(wounds, toughness, save)[0]
+
+    def get_runner_up_margin(self, wounds, toughness, save):
+        """
+        Get how much better the best result against the given target is
+        than the second best, or None if k is one or there is only one
+        result.
+        """
+        top = self.get_top(wounds, toughness, save)
+        if len(top) < 2:
+            return None
+        return top[0][1] - top[1][1]
+
+    def format_best(self):
+        """
+        Get a report of the best result against each target, one per
+        line.
+        """
+        return ''.join(
+            [
+                f'W: {wounds}, T: {toughness}, Sv: {save} - {name} {result}\n'
+                for wounds, toughness, save in self.get_targets()
+                for name, result in [self.get_best(wounds, toughness, save)]
+            ]
+        )
+
+    def format_top(self):
+        """
+        Get a report of the best k results against each target, one
+        per line, from best to worst for each target.
+        """
+        return ''.join(
+            [
+                f'W: {wounds}, T: {toughness}, Sv: {save} - {name} {result}\n'
+                for wounds, toughness, save in self.get_targets()
+                for name, result in self.get_top(wounds, toughness, save)
+            ]
+        )
+
+    def format_runner_up_margins(self):
+        """
+        Get a report of the best result against each target, and how
+        far ahead of the second best it is, one per line.
+        """
+        lines = []
+        for wounds, toughness, save in self.get_targets():
+            name, _ = self.get_best(wounds, toughness, save)
+            margin = self.get_runner_up_margin(wounds, toughness, save)
+            lines.append(
+                f'W: {wounds}, T: {toughness}, Sv: {save} - {name} '
+                f'ahead by {margin}\n'
+            )
+        return ''.join(lines)
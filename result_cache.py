@@ -0,0 +1,272 @@
+"""
+This module provides a persistent, content addressed cache of sweep
+results. Results are keyed by a stable hash of everything they depend
+on (the stat lines, abilities, wargear and points of the model and its
+weapons, the target, and the numeric backend), so editing one weapon
+only invalidates the results that use it.
+"""
+from fractions import Fraction
+import hashlib
+import json
+import sqlite3
+import time
+
+import amounts
+from __init__ import Ability, Item, StatLine
+
+
+# This is part of every key, and should be incremented whenever a change
+# to the calculations would change the results of existing inputs.
+CACHE_VERSION = 1
+
+
+class UnfingerprintableValueError(Exception): pass
+
+
+def _get_canonical_form(value):
+    """
+    Get a JSON serialisable form of value, which is the same for equal
+    inputs across processes and runs.
+    """
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, int):
+        return value
+    if isinstance(value, Fraction):
+        return {'fraction': [value.numerator, value.denominator]}
+    if isinstance(value, float):
+        # The hex form is exact, unlike the default JSON one.
+        return {'float': value.hex()}
+    if isinstance(value, amounts.DiceAmount):
+        # Whole bounds may be kept as ints or Fractions, depending on how
+        # the amount was built, so they are all made Fractions here.
+        return {
+            'dice_amount': [
+                [
+                    [
+                        _get_canonical_form(Fraction(start)),
+                        _get_canonical_form(Fraction(stop)),
+                        count
+                    ]
+                    for (start, stop), count in value.dice
+                ],
+                _get_canonical_form(Fraction(value.constant))
+            ]
+        }
+    if isinstance(value, amounts.GeneralAmount):
+        return {
+            'general_amount': [
+                _get_canonical_form(amount)
+                for amount in value._contained_amounts
+            ]
+        }
+    if isinstance(value, amounts.SingleAmount):
+        return {
+            'single_amount': [
+                _get_canonical_form(value.start),
+                _get_canonical_form(value.stop)
+            ]
+        }
+    if isinstance(value, StatLine):
+        # This is the same as the form of the dictionary it replaced, so
+        # existing keys are still valid.
+        return _get_canonical_form(value.copy())
+    if isinstance(value, Ability):
+        return {
+            'ability': {
+                'affects_model': value.affects_model,
+                'stat_line_changes': _get_canonical_form(
+                    value.stat_line_changes
+                ),
+                'modification_type': value.modification_type,
+                'reroll_hits_at_or_below': value.reroll_hits_at_or_below,
+                'reroll_wounds_at_or_below': value.reroll_wounds_at_or_below
+            }
+        }
+    if isinstance(value, Item):
+        # The name is left out, as it does not change any results.
+        return {
+            type(value).__name__: {
+                'stat_line': _get_canonical_form(value.stat_line),
+                'points': _get_canonical_form(value.points),
+                'abilities': _get_canonical_form(value.abilities),
+                'wargear': _get_canonical_form(value.wargear)
+            }
+        }
+    if isinstance(value, (list, tuple)):
+        return [_get_canonical_form(item) for item in value]
+    if isinstance(value, dict):
+        return {
+            'dict': sorted(
+                [
+                    [key, _get_canonical_form(item)]
+                    for key, item in value.items()
+                ]
+            )
+        }
+    raise UnfingerprintableValueError(
+        f'cannot fingerprint a value of type {type(value).__name__}'
+    )
+
+
+def get_fingerprint(*values):
+    """
+    Get a stable hexadecimal hash of values, which may be models,
+    weapons, abilities, amounts, numbers, strings, or lists, tuples
+    and dictionaries of them.
+    """
+    canonical_form = json.dumps(
+        [CACHE_VERSION, _get_canonical_form(list(values))],
+        sort_keys=True,
+        separators=(',', ':')
+    )
+    return hashlib.sha256(canonical_form.encode()).hexdigest()
+
+
+def combine_fingerprints(*fingerprints):
+    """
+    Get a fingerprint of several fingerprints (or other strings) taken
+    together, which is much cheaper than fingerprinting the values they
+    came from again.
+    """
+    return hashlib.sha256('|'.join(fingerprints).encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    The ResultCache class is an on disk store of results by key, backed
+    by SQLite, which keeps at most max_entries results by evicting the
+    least recently used ones. Several processes may use the same cache
+    file at once, each with their own ResultCache object.
+    """
+
+    def __init__(self, path, max_entries=1000000, timeout=60):
+        """
+        Create a cache stored in the file at path, which is created if
+        it does not exist. timeout is how long, in seconds, to wait for
+        other processes to finish writing.
+        """
+        self.path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        # When each result got since the last write was last used, by key.
+        self._last_used = {}
+
+    def __getstate__(self):
+        # Connections cannot be sent to other processes, so they open
+        # their own, and record their own uses.
+        state = self.__dict__.copy()
+        state['_connection'] = None
+        state['_last_used'] = {}
+        return state
+
+    def _get_connection(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(
+                self.path,
+                timeout=self.timeout
+            )
+            # Write ahead logging lets readers carry on while another
+            # process writes.
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            with self._connection:
+                self._connection.execute(
+                    'CREATE TABLE IF NOT EXISTS results ('
+                    'key TEXT PRIMARY KEY, '
+                    'value REAL NOT NULL, '
+                    'last_used INTEGER NOT NULL)'
+                )
+                self._connection.execute(
+                    'CREATE INDEX IF NOT EXISTS results_last_used '
+                    'ON results (last_used)'
+                )
+        return self._connection
+
+    def get_many(self, keys):
+        """
+        Get a dictionary from each of keys that is in the cache to its
+        result. They are marked as recently used by the next set_many or
+        close, rather than with a write for every read.
+        """
+        connection = self._get_connection()
+        keys = list(keys)
+        results = {}
+        # SQLite limits the number of parameters in a single query.
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ','.join(['?'] * len(chunk))
+            results.update(
+                connection.execute(
+                    f'SELECT key, value FROM results '
+                    f'WHERE key IN ({placeholders})',
+                    chunk
+                ).fetchall()
+            )
+        now = time.time_ns()
+        for key in results:
+            self._last_used[key] = now
+        self.hits += len(results)
+        self.misses += len(keys) - len(results)
+        return results
+
+    def get(self, key):
+        """
+        Get the result for key, or None if it is not in the cache.
+        """
+        return self.get_many([key]).get(key)
+
+    def set_many(self, results):
+        """
+        Store the results in the dictionary results by key, then evict
+        the least recently used results if there are too many.
+        """
+        connection = self._get_connection()
+        now = time.time_ns()
+        with connection:
+            self._write_last_used(connection)
+            connection.executemany(
+                'INSERT OR REPLACE INTO results (key, value, last_used) '
+                'VALUES (?, ?, ?)',
+                [(key, float(value), now) for key, value in results.items()]
+            )
+            (entries,) = connection.execute(
+                'SELECT COUNT(*) FROM results'
+            ).fetchone()
+            if entries > self.max_entries:
+                connection.execute(
+                    'DELETE FROM results WHERE key IN ('
+                    'SELECT key FROM results ORDER BY last_used LIMIT ?)',
+                    (entries - self.max_entries,)
+                )
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def _write_last_used(self, connection):
+        connection.executemany(
+            'UPDATE results SET last_used = ? WHERE key = ?',
+            [(last_used, key) for key, last_used in self._last_used.items()]
+        )
+        self._last_used.clear()
+
+    def close(self):
+        """
+        Mark the results got since the last write as recently used, and
+        close the connection to the cache.
+        """
+        if self._last_used:
+            connection = self._get_connection()
+            with connection:
+                self._write_last_used(connection)
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception_information):
+        self.close()
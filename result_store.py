@@ -0,0 +1,323 @@
+"""
+This module provides a columnar store of sweep results, which are
+streamed to disk in chunks as they are produced, and can be loaded back
+as NumPy arrays (or exported as CSV) without parsing any text.
+
+A store is a directory containing a manifest.json, and one .npy file
+per column per chunk, named after the run that wrote it, so that a new
+sweep into the same directory never writes over the chunks of the last
+one while they may still be read. Chunks the manifest does not list are
+removed whenever it is rewritten. The columns are wounds, toughness
+and save (the target), loadout (an index into the loadouts listed in
+the manifest, each of which has a name, a model and a list of weapons)
+and efficiency.
+The manifest is rewritten after every chunk, so a store is readable up
+to its last full chunk even if the sweep writing it is interrupted, and
+it records whether the writer was closed, so readers can tell a finished
+sweep from one still in progress.
+"""
+import csv
+import json
+import os
+import uuid
+
+import numpy as np
+
+from sweep import get_loadout_name
+
+
+STORE_VERSION = 1
+MANIFEST_FILE_NAME = 'manifest.json'
+COLUMN_TYPES = {
+    'wounds': np.int64,
+    'toughness': np.int64,
+    'save': np.int64,
+    'loadout': np.int32,
+    'efficiency': np.float64
+}
+
+
+class UnknownLoadoutError(Exception): pass
+class UnsupportedStoreVersionError(Exception): pass
+
+
+class ResultWriter:
+    """
+    The ResultWriter class appends sweep results to a store, keeping at
+    most chunk_size of them in memory at once. A store that is already
+    in the directory can still be read, unchanged, until the writer is
+    closed, when it is replaced by the new one.
+    """
+
+    def __init__(self, path, options, chunk_size=100000):
+        """
+        Create a writer of a new store in the directory at path (which
+        is created if it does not exist), for results of the loadouts
+        in options, a list of (model, weapon_combinations) pairs.
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self._loadouts = []
+        self._loadout_indices = {}
+        for model, weapon_combinations in options:
+            for weapon_combination in weapon_combinations:
+                name = get_loadout_name(model, weapon_combination)
+                self._loadout_indices.setdefault(name, len(self._loadouts))
+                self._loadouts.append(
+                    {
+                        'name': name,
+                        'model': model.name,
+                        'weapons': [
+                            weapon.name for weapon in weapon_combination
+                        ]
+                    }
+                )
+        # Chunks are named after the run, so they are all new files.
+        self._run = uuid.uuid4().hex
+        self._chunks = []
+        self._rows = 0
+        self._complete = False
+        self._buffers = {
+            column: np.empty(chunk_size, dtype=column_type)
+            for column, column_type in COLUMN_TYPES.items()
+        }
+        self._buffered_rows = 0
+        os.makedirs(path, exist_ok=True)
+        # If there is no store to keep yet, the manifest is written after
+        # every chunk, so that the results of a sweep that fails part way
+        # can still be read.
+        self._replacing_store = os.path.exists(
+            os.path.join(path, MANIFEST_FILE_NAME)
+        )
+
+    def add(self, wounds, toughness, save, name, result):
+        """
+        Add the result of the loadout called name against the target
+        with the given wounds, toughness and save.
+        """
+        try:
+            loadout = self._loadout_indices[name]
+        except KeyError:
+            raise UnknownLoadoutError(f'{name!r} is not one of the options')
+        row = self._buffered_rows
+        self._buffers['wounds'][row] = wounds
+        self._buffers['toughness'][row] = toughness
+        self._buffers['save'][row] = save
+        self._buffers['loadout'][row] = loadout
+        self._buffers['efficiency'][row] = result
+        self._buffered_rows += 1
+        if self._buffered_rows == self.chunk_size:
+            self.flush()
+
+    def add_all(self, results):
+        """
+        Add each (wounds, toughness, save, name, result) tuple in the
+        iterable results.
+        """
+        for wounds, toughness, save, name, result in results:
+            self.add(wounds, toughness, save, name, result)
+
+    def flush(self):
+        """
+        Write the buffered results to disk as a new chunk.
+        """
+        if self._buffered_rows == 0:
+            return
+        chunk_number = len(self._chunks)
+        files = {}
+        for column, buffer in self._buffers.items():
+            file_name = f'{column}_{self._run}_{chunk_number:05}.npy'
+            np.save(
+                os.path.join(self.path, file_name),
+                buffer[:self._buffered_rows]
+            )
+            files[column] = file_name
+        self._chunks.append({'rows': self._buffered_rows, 'files': files})
+        self._rows += self._buffered_rows
+        self._buffered_rows = 0
+        if not self._replacing_store:
+            self._write_manifest()
+
+    def _write_manifest(self):
+        manifest = {
+            'version': STORE_VERSION,
+            'columns': {
+                column: np.dtype(column_type).str
+                for column, column_type in COLUMN_TYPES.items()
+            },
+            'loadouts': self._loadouts,
+            'rows': self._rows,
+            'chunks': self._chunks,
+            'complete': self._complete
+        }
+        # The manifest is written to a temporary file and moved into place,
+        # so readers never see it half written.
+        manifest_path = os.path.join(self.path, MANIFEST_FILE_NAME)
+        temporary_path = f'{manifest_path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=4)
+            manifest_file.write('\n')
+        os.replace(temporary_path, manifest_path)
+
+    def _remove_unlisted_chunks(self):
+        """
+        Remove the chunk files of earlier runs, and any left half written
+        by interrupted ones.
+        """
+        listed_file_names = {
+            file_name
+            for chunk in self._chunks
+            for file_name in chunk['files'].values()
+        }
+        for file_name in os.listdir(self.path):
+            if (
+                    file_name.endswith('.npy')
+                    and file_name.split('_')[0] in COLUMN_TYPES
+                    and file_name not in listed_file_names
+            ):
+                try:
+                    os.remove(os.path.join(self.path, file_name))
+                except FileNotFoundError:
+                    pass
+
+    def _remove_chunks(self):
+        for chunk in self._chunks:
+            for file_name in chunk['files'].values():
+                os.remove(os.path.join(self.path, file_name))
+        self._chunks = []
+        self._rows = 0
+
+    def close(self):
+        """
+        Write any buffered results, and mark the store as complete,
+        replacing any earlier store in the directory.
+        """
+        self.flush()
+        self._complete = True
+        self._write_manifest()
+        # The chunks of the earlier store are only removed once the new
+        # manifest has replaced its own.
+        self._remove_unlisted_chunks()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, exception, traceback):
+        # A sweep that failed part way leaves an incomplete store, unless
+        # that would replace a complete one, which is kept instead.
+        if exception_type is None:
+            self.close()
+        elif self._replacing_store:
+            self._remove_chunks()
+        else:
+            self.flush()
+
+
+class ResultStore:
+    """
+    The ResultStore class reads a store written by a ResultWriter.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST_FILE_NAME)) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest['version'] != STORE_VERSION:
+            raise UnsupportedStoreVersionError(
+                f'cannot read a version {manifest["version"]} store'
+            )
+        self.loadouts = manifest['loadouts']
+        self.rows = manifest['rows']
+        # Stores written before this was recorded were always complete.
+        self.complete = manifest.get('complete', True)
+        self._chunks = manifest['chunks']
+
+    def iterate_chunks(self, columns=None):
+        """
+        Generate a dictionary from each of columns (by default, all of
+        them) to an array of its values, for each chunk in the order
+        they were written. The arrays are memory mapped, so only the
+        parts that are used are read.
+        """
+        if columns is None:
+            columns = list(COLUMN_TYPES.keys())
+        for chunk in self._chunks:
+            yield {
+                column: np.load(
+                    os.path.join(self.path, chunk['files'][column]),
+                    mmap_mode='r'
+                )
+                for column in columns
+            }
+
+    def load(self, columns=None):
+        """
+        Get a dictionary from each of columns (by default, all of them)
+        to an array of all of its values.
+        """
+        if columns is None:
+            columns = list(COLUMN_TYPES.keys())
+        chunks = list(self.iterate_chunks(columns))
+        return {
+            column: np.concatenate(
+                [chunk[column] for chunk in chunks]
+                or [np.empty(0, dtype=COLUMN_TYPES[column])]
+            )
+            for column in columns
+        }
+
+    def get_loadout_names(self):
+        return [loadout['name'] for loadout in self.loadouts]
+
+    def iterate_results(self):
+        """
+        Generate the (wounds, toughness, save, name, efficiency) tuples
+        in the store, in the order they were added, so that they can be
+        given to anything that takes the results of a sweep.
+        """
+        names = self.get_loadout_names()
+        for chunk in self.iterate_chunks():
+            yield from zip(
+                chunk['wounds'].tolist(),
+                chunk['toughness'].tolist(),
+                chunk['save'].tolist(),
+                [names[loadout] for loadout in chunk['loadout'].tolist()],
+                chunk['efficiency'].tolist()
+            )
+
+    def export_csv(self, path):
+        """
+        Write the results in the store to a CSV file at path, with the
+        weapons of each loadout separated by semicolons, one chunk at a
+        time.
+        """
+        with open(path, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(
+                [
+                    'wounds',
+                    'toughness',
+                    'save',
+                    'model',
+                    'weapons',
+                    'efficiency'
+                ]
+            )
+            for chunk in self.iterate_chunks():
+                for wounds, toughness, save, loadout, efficiency in zip(
+                        chunk['wounds'].tolist(),
+                        chunk['toughness'].tolist(),
+                        chunk['save'].tolist(),
+                        chunk['loadout'].tolist(),
+                        chunk['efficiency'].tolist()
+                ):
+                    writer.writerow(
+                        [
+                            wounds,
+                            toughness,
+                            save,
+                            self.loadouts[loadout]['model'],
+                            ';'.join(self.loadouts[loadout]['weapons']),
+                            repr(efficiency)
+                        ]
+                    )
@@ -0,0 +1,544 @@
+"""
+This module loads weapons and units (models with their weapon
+combinations) from declarative JSON roster files. Rosters are
+validated and compiled into the package's classes once, and the
+compiled units are cached in a binary file next to the roster, so that
+later loads only unpickle the units they ask for and the weapons those
+use. Units that share a weapon in the roster share it once loaded.
+
+A roster file is a JSON object with these keys:
+
+    stat_lines: an optional object of named model stat lines, which
+        units can refer to by name instead of giving their own.
+    weapons: an object from weapon keys to weapon definitions, each of
+        which has a stat_line (with D, AP and is_melee), and optionally
+        points, abilities, and a name (which defaults to the key).
+    units: an object from unit keys to unit definitions, each of which
+        has a stat_line (or the name of one), and either
+        weapon_combinations (a list of lists of weapon keys) or
+        weapon_choices (a list of lists of weapon keys to pick one from
+        each of), and optionally points, abilities, wargear (a list of
+        weapon keys), and a name (which defaults to the key).
+
+Abilities are objects with any of the keyword arguments of Ability.
+Damage, attacks and other amounts may be dice, such as "D6", "2D3" or
+"D3+3", and points and other numbers may be arithmetic expressions,
+such as "13 + ((1/4)*13*2)", to keep where they came from.
+"""
+import ast
+import hashlib
+import io
+import json
+import operator
+import os
+import pickle
+import re
+
+import amounts
+from __init__ import Ability, Model, Weapon, D3, D6
+from sweep import get_weapon_combinations
+
+
+# This is part of the key of every compiled roster, and should be
+# incremented whenever a change to the loader would compile the same file
+# differently.
+LOADER_VERSION = 8
+
+MODEL_STAT_NAMES = [
+    Model.BALLISTIC_SKILL_STAT_NAME,
+    Model.WEAPON_SKILL_STAT_NAME,
+    Model.STRENGTH_STAT_NAME,
+    Model.TOUGHNESS_STAT_NAME,
+    Model.WOUNDS_STAT_NAME,
+    Model.ATTACKS_STAT_NAME,
+    Model.ARMOUR_SAVE_STAT_NAME,
+]
+REQUIRED_MODEL_STAT_NAMES = [
+    Model.BALLISTIC_SKILL_STAT_NAME,
+    Model.WEAPON_SKILL_STAT_NAME,
+    Model.STRENGTH_STAT_NAME,
+    Model.ATTACKS_STAT_NAME,
+    Model.ARMOUR_SAVE_STAT_NAME,
+]
+WEAPON_STAT_NAMES = [
+    Weapon.DAMAGE_STAT_NAME,
+    Weapon.ARMOUR_PIERCING_STAT_NAME,
+    Weapon.IS_MELEE_STAT_NAME,
+]
+
+_DICE_PATTERN = re.compile(r'^\s*(\d*)\s*D\s*(\d+)\s*(?:([+-])\s*(\d+))?\s*$')
+_BINARY_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+}
+_UNARY_OPERATORS = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+
+
+class InvalidRosterError(Exception): pass
+class UnknownUnitError(Exception): pass
+
+
+class Roster:
+    """
+    The Roster class holds the units loaded from a roster file, as a
+    dictionary from unit keys to (model, weapon_combinations) pairs,
+    and the weapons they use, by their names. Where several weapons
+    share a name, the first one used is kept.
+    """
+    def __init__(self, units):
+        self.units = units
+        self.weapons = {}
+        for model, weapon_combinations in units.values():
+            for weapon_combination in weapon_combinations:
+                for weapon in weapon_combination:
+                    self.weapons.setdefault(weapon.name, weapon)
+
+    def get_options(self):
+        """
+        Get the units as a list of (model, weapon_combinations) pairs,
+        in the order they appear in the roster file, as used by the
+        sweep module.
+        """
+        return list(self.units.values())
+
+
+def _evaluate_expression(node, path):
+    if isinstance(node, ast.Expression):
+        return _evaluate_expression(node.body, path)
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+        return _BINARY_OPERATORS[type(node.op)](
+            _evaluate_expression(node.left, path),
+            _evaluate_expression(node.right, path)
+        )
+    if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+        return _UNARY_OPERATORS[type(node.op)](
+            _evaluate_expression(node.operand, path)
+        )
+    raise InvalidRosterError(
+        f'{path} may only contain numbers, +, -, * and /'
+    )
+
+
+def parse_number(value, path):
+    """
+    Get the number value represents, which may be a number or a string
+    of an arithmetic expression. path is where value is in the roster,
+    for error messages.
+    """
+    if isinstance(value, bool):
+        raise InvalidRosterError(f'{path} must be a number, not a boolean')
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        try:
+            expression = ast.parse(value, mode='eval')
+        except SyntaxError:
+            raise InvalidRosterError(f'{path} is not a valid expression')
+        return _evaluate_expression(expression, path)
+    raise InvalidRosterError(f'{path} must be a number or an expression')
+
+
+def parse_amount(value, path):
+    """
+    Get the amount value represents, which may be a number, an
+    arithmetic expression, or dice such as "D6", "2D3" or "D3+3".
+    """
+    if isinstance(value, str):
+        match = _DICE_PATTERN.match(value)
+        if match:
+            count, sides, sign, constant = match.groups()
+            sides = int(sides)
+            if sides < 1:
+                raise InvalidRosterError(f'{path} has dice with no sides')
+            offset = int(constant or 0) * (-1 if sign == '-' else 1)
+            count = int(count) if count else 1
+            if count == 1:
+                # Adding a constant to a single die just moves its range.
+                die = {3: D3, 6: D6}.get(sides) if offset == 0 else None
+                if die is None:
+                    die = amounts.SingleAmount(1 + offset, sides + offset)
+                return die
+            return amounts.DiceAmount({(1, sides): count}, offset)
+    return parse_number(value, path)
+
+
+def _check_keys(definition, path, allowed_keys, required_keys=()):
+    if not isinstance(definition, dict):
+        raise InvalidRosterError(f'{path} must be an object')
+    for key in definition:
+        if key not in allowed_keys:
+            raise InvalidRosterError(f'{path} has unknown key "{key}"')
+    for key in required_keys:
+        if key not in definition:
+            raise InvalidRosterError(f'{path} is missing "{key}"')
+
+
+def _compile_ability(definition, path):
+    _check_keys(
+        definition,
+        path,
+        [
+            'affects_model',
+            'stat_line_changes',
+            'modification_type',
+            'reroll_hits_at_or_below',
+            'reroll_wounds_at_or_below',
+        ]
+    )
+    affects_model = definition.get('affects_model', True)
+    if not isinstance(affects_model, bool):
+        raise InvalidRosterError(f'{path}.affects_model must be a boolean')
+
+    modification_type = definition.get(
+        'modification_type',
+        Ability.ADD_MODIFICATION_NAME
+    )
+    if modification_type not in [
+            modification['name'] for modification in Ability.MODIFICATIONS
+    ]:
+        raise InvalidRosterError(
+            f'{path}.modification_type must be one of "multiply", "add" or '
+            f'"set"'
+        )
+
+    stat_line_changes = definition.get('stat_line_changes', {})
+    allowed_stat_names = (
+        MODEL_STAT_NAMES + [Model.TO_WOUND_ROLL_MODIFIER_STAT_NAME]
+        if affects_model else WEAPON_STAT_NAMES
+    )
+    _check_keys(
+        stat_line_changes,
+        f'{path}.stat_line_changes',
+        allowed_stat_names
+    )
+
+    return Ability(
+        affects_model=affects_model,
+        stat_line_changes={
+            stat_name: parse_amount(
+                change,
+                f'{path}.stat_line_changes.{stat_name}'
+            )
+            for stat_name, change in stat_line_changes.items()
+        },
+        modification_type=modification_type,
+        reroll_hits_at_or_below=parse_number(
+            definition.get('reroll_hits_at_or_below', 0),
+            f'{path}.reroll_hits_at_or_below'
+        ),
+        reroll_wounds_at_or_below=parse_number(
+            definition.get('reroll_wounds_at_or_below', 0),
+            f'{path}.reroll_wounds_at_or_below'
+        )
+    )
+
+
+def _compile_abilities(definitions, path):
+    if not isinstance(definitions, list):
+        raise InvalidRosterError(f'{path} must be a list')
+    return [
+        _compile_ability(definition, f'{path}[{index}]')
+        for index, definition in enumerate(definitions)
+    ]
+
+
+def _compile_weapon(key, definition):
+    path = f'weapons.{key}'
+    _check_keys(
+        definition,
+        path,
+        ['name', 'stat_line', 'points', 'abilities'],
+        ['stat_line']
+    )
+    _check_keys(
+        definition['stat_line'],
+        f'{path}.stat_line',
+        WEAPON_STAT_NAMES,
+        WEAPON_STAT_NAMES
+    )
+    is_melee = definition['stat_line'][Weapon.IS_MELEE_STAT_NAME]
+    if not isinstance(is_melee, bool):
+        raise InvalidRosterError(
+            f'{path}.stat_line.is_melee must be a boolean'
+        )
+
+    return Weapon(
+        {
+            Weapon.DAMAGE_STAT_NAME: parse_amount(
+                definition['stat_line'][Weapon.DAMAGE_STAT_NAME],
+                f'{path}.stat_line.D'
+            ),
+            Weapon.ARMOUR_PIERCING_STAT_NAME: parse_number(
+                definition['stat_line'][Weapon.ARMOUR_PIERCING_STAT_NAME],
+                f'{path}.stat_line.AP'
+            ),
+            Weapon.IS_MELEE_STAT_NAME: is_melee,
+        },
+        points=parse_number(definition.get('points', 0), f'{path}.points'),
+        abilities=_compile_abilities(
+            definition.get('abilities', []),
+            f'{path}.abilities'
+        ),
+        name=definition.get('name', key)
+    )
+
+
+def _get_weapons(keys, weapons, path):
+    if not isinstance(keys, list):
+        raise InvalidRosterError(f'{path} must be a list')
+    try:
+        return [weapons[key] for key in keys]
+    except (KeyError, TypeError):
+        raise InvalidRosterError(f'{path} refers to an unknown weapon')
+
+
+def _compile_unit(key, definition, stat_lines, weapons):
+    path = f'units.{key}'
+    _check_keys(
+        definition,
+        path,
+        [
+            'name',
+            'stat_line',
+            'points',
+            'abilities',
+            'wargear',
+            'weapon_combinations',
+            'weapon_choices',
+        ],
+        ['stat_line']
+    )
+
+    stat_line = definition['stat_line']
+    if isinstance(stat_line, str):
+        try:
+            stat_line = stat_lines[stat_line]
+        except KeyError:
+            raise InvalidRosterError(
+                f'{path}.stat_line refers to an unknown stat line'
+            )
+    _check_keys(
+        stat_line,
+        f'{path}.stat_line',
+        MODEL_STAT_NAMES,
+        REQUIRED_MODEL_STAT_NAMES
+    )
+
+    if ('weapon_combinations' in definition) == (
+            'weapon_choices' in definition
+    ):
+        raise InvalidRosterError(
+            f'{path} must have exactly one of "weapon_combinations" and '
+            f'"weapon_choices"'
+        )
+    if 'weapon_combinations' in definition:
+        if not isinstance(definition['weapon_combinations'], list):
+            raise InvalidRosterError(
+                f'{path}.weapon_combinations must be a list'
+            )
+        weapon_combinations = [
+            _get_weapons(
+                keys,
+                weapons,
+                f'{path}.weapon_combinations[{index}]'
+            )
+            for index, keys in enumerate(definition['weapon_combinations'])
+        ]
+    else:
+        if not isinstance(definition['weapon_choices'], list):
+            raise InvalidRosterError(f'{path}.weapon_choices must be a list')
+        weapon_combinations = list(
+            get_weapon_combinations(
+                *[
+                    _get_weapons(keys, weapons, f'{path}.weapon_choices')
+                    for keys in definition['weapon_choices']
+                ]
+            )
+        )
+
+    model = Model(
+        {
+            stat_name: parse_amount(value, f'{path}.stat_line.{stat_name}')
+            for stat_name, value in stat_line.items()
+        },
+        points=parse_number(definition.get('points', 0), f'{path}.points'),
+        wargear=_get_weapons(
+            definition.get('wargear', []),
+            weapons,
+            f'{path}.wargear'
+        ),
+        abilities=_compile_abilities(
+            definition.get('abilities', []),
+            f'{path}.abilities'
+        ),
+        name=definition.get('name', key)
+    )
+    return model, weapon_combinations
+
+
+def _compile_document(document):
+    """
+    Validate the parsed JSON document of a roster, and get a tuple of
+    dictionaries from its weapon keys to their weapons, and from its
+    unit keys to (model, weapon_combinations) pairs.
+    """
+    _check_keys(
+        document,
+        'roster',
+        ['stat_lines', 'weapons', 'units'],
+        ['weapons', 'units']
+    )
+    stat_lines = document.get('stat_lines', {})
+    for key in ('stat_lines', 'weapons', 'units'):
+        if not isinstance(document.get(key, {}), dict):
+            raise InvalidRosterError(f'{key} must be an object')
+
+    weapons = {
+        key: _compile_weapon(key, definition)
+        for key, definition in document['weapons'].items()
+    }
+    units = {
+        key: _compile_unit(key, definition, stat_lines, weapons)
+        for key, definition in document['units'].items()
+    }
+    return weapons, units
+
+
+def compile_roster(document):
+    """
+    Validate the parsed JSON document of a roster, and get a dictionary
+    from its unit keys to (model, weapon_combinations) pairs.
+    """
+    _, units = _compile_document(document)
+    return units
+
+
+class _UnitPickler(pickle.Pickler):
+    """
+    A pickler of units that stores the roster's weapons by their keys,
+    so that units sharing a weapon still share it once unpickled.
+    """
+    def __init__(self, file, weapon_keys):
+        super().__init__(file, pickle.HIGHEST_PROTOCOL)
+        self.weapon_keys = weapon_keys
+
+    def persistent_id(self, obj):
+        if isinstance(obj, Weapon):
+            return self.weapon_keys.get(id(obj))
+        return None
+
+
+class _UnitUnpickler(pickle.Unpickler):
+    """
+    An unpickler of units pickled by _UnitPickler, which gets their
+    weapons by key from load_weapon.
+    """
+    def __init__(self, file, load_weapon):
+        super().__init__(file)
+        self.load_weapon = load_weapon
+
+    def persistent_load(self, key):
+        return self.load_weapon(key)
+
+
+def _dump_unit(unit, weapon_keys):
+    unit_file = io.BytesIO()
+    _UnitPickler(unit_file, weapon_keys).dump(unit)
+    return unit_file.getvalue()
+
+
+def _get_compiled_path(path):
+    directory, file_name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, '__pycache__', f'{file_name}.roster')
+
+
+def _load_compiled_roster(path):
+    """
+    Get a dictionary of the compiled roster at path if it is up to
+    date, and otherwise compile the roster and save it. Its weapons are
+    the pickled weapons by key, and its units the (model,
+    weapon_combinations) pairs by key, pickled by _UnitPickler.
+    """
+    with open(path, 'rb') as source_file:
+        source = source_file.read()
+    source_hash = hashlib.sha256(
+        source + f'\0{LOADER_VERSION}'.encode()
+    ).hexdigest()
+
+    compiled_path = _get_compiled_path(path)
+    try:
+        with open(compiled_path, 'rb') as compiled_file:
+            compiled = pickle.load(compiled_file)
+        if compiled['source_hash'] == source_hash:
+            return compiled
+    except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+        pass
+
+    try:
+        document = json.loads(source)
+    except ValueError as error:
+        raise InvalidRosterError(f'roster is not valid JSON: {error}')
+    # Each unit is pickled on its own, so that loading one does not
+    # require unpickling the rest, and each weapon is pickled once, and
+    # referred to by key from the units that use it.
+    weapons, units = _compile_document(document)
+    weapon_keys = {id(weapon): key for key, weapon in weapons.items()}
+    compiled = {
+        'source_hash': source_hash,
+        'weapons': {
+            key: pickle.dumps(weapon, pickle.HIGHEST_PROTOCOL)
+            for key, weapon in weapons.items()
+        },
+        'units': {
+            key: _dump_unit(unit, weapon_keys)
+            for key, unit in units.items()
+        }
+    }
+
+    # The compiled roster is written to a temporary file and moved into
+    # place, so other processes never see it half written. Failing to
+    # save it only makes the next load slower.
+    temporary_path = f'{compiled_path}.{os.getpid()}.tmp'
+    try:
+        os.makedirs(os.path.dirname(compiled_path), exist_ok=True)
+        with open(temporary_path, 'wb') as compiled_file:
+            pickle.dump(compiled, compiled_file, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, compiled_path)
+    except OSError:
+        pass
+    return compiled
+
+
+def load_roster(path, unit_keys=None):
+    """
+    Load the roster file at path, and get a Roster of the units with
+    the keys in unit_keys, or of every unit if unit_keys is None.
+    """
+    compiled = _load_compiled_roster(path)
+    compiled_units = compiled['units']
+    if unit_keys is None:
+        unit_keys = list(compiled_units.keys())
+
+    # Weapons are unpickled once each, when a unit first needs them.
+    weapons = {}
+
+    def load_weapon(key):
+        if key not in weapons:
+            weapons[key] = pickle.loads(compiled['weapons'][key])
+        return weapons[key]
+
+    units = {}
+    for key in unit_keys:
+        try:
+            unit_pickle = compiled_units[key]
+        except KeyError:
+            raise UnknownUnitError(f'the roster has no unit "{key}"')
+        units[key] = _UnitUnpickler(
+            io.BytesIO(unit_pickle),
+            load_weapon
+        ).load()
+    return Roster(units)
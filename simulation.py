@@ -0,0 +1,216 @@
+"""
+This module provides a Monte Carlo simulator, which rolls the hit,
+wound, save and damage dice for a model's weapons in large NumPy
+batches, to check the closed form calculations and to estimate things
+they do not cover.
+"""
+import time
+
+import numpy as np
+
+import amounts
+from __init__ import Model, Weapon
+
+
+class SimulationResult:
+    """
+    The SimulationResult class holds the estimates from a simulation of
+    a model's weapon combination against a target, along with how many
+    trials and dice rolls it took.
+    """
+    def __init__(
+            self,
+            damages,
+            target_wounds,
+            points_cost,
+            rolls,
+            seconds,
+            z_score
+        ):
+        """
+        Create a simulation result from damages, an array of the total
+        damage done in each trial.
+        """
+        self.trials = len(damages)
+        self.mean_damage = float(np.mean(damages))
+        self.damage_variance = float(np.var(damages, ddof=1)) \
+            if self.trials > 1 else 0.0
+        self.standard_error = (self.damage_variance / self.trials) ** 0.5
+        self.confidence_interval = (
+            self.mean_damage - z_score * self.standard_error,
+            self.mean_damage + z_score * self.standard_error
+        )
+        self.kill_probability = float(np.mean(damages >= target_wounds))
+        self.efficiency = self.mean_damage / points_cost \
+            if points_cost else None
+        self.rolls = rolls
+        self.seconds = seconds
+        self.rolls_per_second = rolls / seconds if seconds else float('inf')
+
+
+def _sample(rng, amount, size):
+    """
+    Get an array of size samples of amount, which may be a number.
+    """
+    distribution = amounts.get_distribution(amount)
+    values = np.array([float(value) for value in distribution.keys()])
+    probabilities = np.array(
+        [float(probability) for probability in distribution.values()]
+    )
+    if len(values) == 1:
+        return np.full(size, values[0])
+    return rng.choice(values, size=size, p=probabilities)
+
+
+def _is_random(amount):
+    return len(amounts.get_distribution(amount)) > 1
+
+
+def _roll_at_least(rng, active, value_to_be_at_least, rerolling_from):
+    """
+    Roll a D6 for each True entry in the boolean array active, and
+    reroll those at or below rerolling_from (which is never a success,
+    as for get_probability_at_least). Return a tuple of an array of
+    which active rolls got at least value_to_be_at_least, and the
+    number of dice rolled.
+    """
+    rerolling_from = min(rerolling_from, value_to_be_at_least - 1)
+    rolls = rng.integers(1, 7, size=active.shape)
+    rerolled = active & (rolls <= rerolling_from)
+    rolls = np.where(rerolled, rng.integers(1, 7, size=active.shape), rolls)
+    successes = active & (rolls >= value_to_be_at_least)
+    dice_rolled = np.count_nonzero(active) + np.count_nonzero(rerolled)
+    return successes, int(dice_rolled)
+
+
+def _simulate_weapon(rng, model, target, weapon, trials):
+    """
+    Get a tuple of an array of the damage done by model with weapon to
+    target in each of trials trials, and the number of dice rolled.
+    """
+    modified_self_stat_line, modified_weapon_stat_line = \
+        model.get_modified_stat_lines(weapon)
+    modified_hit_stat, reroll_hits_at_or_below = model.get_hit_roll(
+        weapon,
+        modified_self_stat_line
+    )
+    modified_wound_at_or_below, reroll_wounds_at_or_below = \
+        model.get_wound_roll(target, weapon, modified_self_stat_line)
+    save_roll = Model.get_save_roll(target, weapon)
+    target_wounds = target.stat_line[Model.WOUNDS_STAT_NAME]
+
+    attacks = _sample(
+        rng,
+        modified_self_stat_line[Model.ATTACKS_STAT_NAME],
+        trials
+    ).astype(int)
+    max_attacks = int(attacks.max()) if trials else 0
+    # Each row is a trial, with a column for every attack it could have,
+    # of which only the first attacks columns are actually made.
+    active = np.arange(max_attacks) < attacks[:, np.newaxis]
+    attack_rolls = trials if _is_random(
+        modified_self_stat_line[Model.ATTACKS_STAT_NAME]
+    ) else 0
+
+    hits, hit_rolls = _roll_at_least(
+        rng,
+        active,
+        modified_hit_stat,
+        reroll_hits_at_or_below
+    )
+    wounds, wound_rolls = _roll_at_least(
+        rng,
+        hits,
+        modified_wound_at_or_below,
+        reroll_wounds_at_or_below
+    )
+    saves, save_rolls = _roll_at_least(rng, wounds, save_roll, 0)
+    unsaved = wounds & ~saves
+
+    damage = np.minimum(
+        _sample(
+            rng,
+            modified_weapon_stat_line[Weapon.DAMAGE_STAT_NAME],
+            unsaved.shape
+        ),
+        target_wounds
+    )
+    damage_rolls = int(np.count_nonzero(unsaved)) if _is_random(
+        modified_weapon_stat_line[Weapon.DAMAGE_STAT_NAME]
+    ) else 0
+
+    return (
+        np.where(unsaved, damage, 0).sum(axis=1),
+        attack_rolls + hit_rolls + wound_rolls + save_rolls + damage_rolls
+    )
+
+
+def simulate(
+        model,
+        target,
+        weapon_combination,
+        seed=None,
+        batch_size=100000,
+        max_trials=1000000,
+        confidence_interval_half_width=None,
+        z_score=1.96
+    ):
+    """
+    Simulate model attacking target with every weapon in
+    weapon_combination, in batches of batch_size trials, and return a
+    SimulationResult. The simulation is reproducible for a given seed.
+    If confidence_interval_half_width is given, the simulation stops
+    as soon as the confidence interval of the mean damage (at z_score
+    standard errors) is at most that wide either side of the mean, and
+    otherwise after max_trials trials. As in
+    Model.get_damage_distribution, the damage of each unsaved wound is
+    capped at the wounds of the target, and the mean damage should
+    match the mean of that distribution, rather than the average
+    damage output, for random damage against targets with few wounds.
+    """
+    rng = np.random.default_rng(seed)
+    target_wounds = target.stat_line[Model.WOUNDS_STAT_NAME]
+    start_time = time.perf_counter()
+
+    batches = []
+    trials = 0
+    rolls = 0
+    # Running totals, so that checking whether to stop does not need every
+    # batch to be looked at again.
+    damage_sum = 0.0
+    damage_squares_sum = 0.0
+    while trials < max_trials:
+        batch_trials = min(batch_size, max_trials - trials)
+        batch_damages = np.zeros(batch_trials)
+        for weapon in weapon_combination:
+            weapon_damages, weapon_rolls = _simulate_weapon(
+                rng,
+                model,
+                target,
+                weapon,
+                batch_trials
+            )
+            batch_damages += weapon_damages
+            rolls += weapon_rolls
+        batches.append(batch_damages)
+        trials += batch_trials
+        damage_sum += float(batch_damages.sum())
+        damage_squares_sum += float((batch_damages ** 2).sum())
+
+        if confidence_interval_half_width is not None and trials > 1:
+            variance = max(
+                (damage_squares_sum - damage_sum ** 2 / trials) / (trials - 1),
+                0
+            )
+            standard_error = (variance / trials) ** 0.5
+            if z_score * standard_error <= confidence_interval_half_width:
+                break
+
+    return SimulationResult(
+        np.concatenate(batches),
+        target_wounds,
+        model.get_points_cost(weapon_combination),
+        rolls,
+        time.perf_counter() - start_time,
+        z_score
+    )
@@ -0,0 +1,200 @@
+"""
+This module provides functions for evaluating every loadout in a list
+of options against every target in a grid, either in this process or
+split across a pool of worker processes.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import product
+import os
+
+import amounts
+from result_cache import combine_fingerprints, get_fingerprint
+
+
+def get_loadout_name(model, weapon_combination):
+    """
+    Get the name used in reports for model with weapon_combination.
+    """
+    weapon_names = [weapon.name for weapon in weapon_combination]
+    return f'{model.name} with {", ".join(weapon_names)}'
+
+
+def get_weapon_combinations(*weapon_choices):
+    """
+    Lazily generate every weapon combination (as a list) made by
+    picking one weapon from each of the iterables in weapon_choices, in
+    the order of itertools.product. Combinations containing the same
+    weapons as one already generated, in any order, are skipped.
+    """
+    seen_combinations = set()
+    for weapon_combination in product(*weapon_choices):
+        key = tuple(sorted([id(weapon) for weapon in weapon_combination]))
+        if key not in seen_combinations:
+            seen_combinations.add(key)
+            yield list(weapon_combination)
+
+
+def get_average_damage_efficiency(
+        model,
+        target,
+        weapon_combination,
+        backend=None
+    ):
+    """
+    Get the average damage efficiency of model with weapon_combination
+    against target, as per Model.get_average_damage_efficiency. This is
+    the evaluation get_results uses by default.
+    """
+    return model.get_average_damage_efficiency(
+        target,
+        weapon_combination,
+        backend
+    )
+
+
+def _get_qualified_name(function):
+    return f'{function.__module__}.{function.__qualname__}'
+
+
+def _get_evaluation_fingerprint(evaluate):
+    """
+    Get a fingerprint of evaluate, a module level function or a
+    functools.partial of one, from its name and arguments.
+    """
+    if isinstance(evaluate, partial):
+        return get_fingerprint(
+            _get_qualified_name(evaluate.func),
+            list(evaluate.args),
+            evaluate.keywords
+        )
+    return get_fingerprint(_get_qualified_name(evaluate))
+
+
+def get_results(
+        targets,
+        options,
+        backend=None,
+        cache=None,
+        evaluate=get_average_damage_efficiency
+    ):
+    """
+    Generate a (wounds, toughness, save, name, efficiency) tuple for
+    every target and loadout. targets is a dictionary from (wounds,
+    toughness, save) tuples to target models, and options is a list of
+    (model, weapon_combinations) pairs. Targets are evaluated in sorted
+    order, and loadouts in the order they appear in options. backend
+    is the numeric backend to use, as per the amounts module. If cache
+    is a result_cache.ResultCache, results whose inputs are unchanged
+    are read from it, and only the others are evaluated. evaluate gives
+    the efficiency of each loadout, as evaluate(model, target,
+    weapon_combination, backend=backend). It must be a module level
+    function, or a functools.partial of one, so that it can be sent to
+    workers, and results cached by other evaluations are kept apart.
+    """
+    backend = amounts.resolve_backend(backend)
+    if cache is None or evaluate is get_average_damage_efficiency:
+        # The default evaluation is left out of keys, so that results
+        # cached before evaluations could be chosen are still found.
+        evaluation_fingerprints = ()
+    else:
+        evaluation_fingerprints = (_get_evaluation_fingerprint(evaluate),)
+    loadouts = [
+        (
+            model,
+            weapon_combination,
+            get_loadout_name(model, weapon_combination),
+            get_fingerprint(model, weapon_combination) if cache else None
+        )
+        for model, weapon_combinations in options
+        for weapon_combination in weapon_combinations
+    ]
+
+    for wounds, toughness, save in sorted(targets.keys()):
+        target = targets[(wounds, toughness, save)]
+        if cache is None:
+            keys = [None] * len(loadouts)
+            cached_results = {}
+        else:
+            target_fingerprint = get_fingerprint(target)
+            keys = [
+                combine_fingerprints(
+                    loadout_fingerprint,
+                    target_fingerprint,
+                    backend,
+                    *evaluation_fingerprints
+                )
+                for _, _, _, loadout_fingerprint in loadouts
+            ]
+            cached_results = cache.get_many(keys)
+
+        new_results = {}
+        for key, (model, weapon_combination, name, _) in zip(keys, loadouts):
+            try:
+                result = cached_results[key]
+            except KeyError:
+                result = float(
+                    evaluate(
+                        model,
+                        target,
+                        weapon_combination,
+                        backend=backend
+                    )
+                )
+                new_results[key] = result
+            yield wounds, toughness, save, name, result
+
+        if cache is not None and new_results:
+            cache.set_many(new_results)
+
+
+def _get_chunk_results(targets, options, backend, cache, evaluate):
+    results = list(get_results(targets, options, backend, cache, evaluate))
+    return results, amounts.get_max_divergence()
+
+
+def get_results_in_parallel(
+        targets,
+        options,
+        workers=None,
+        chunk_size=None,
+        backend=None,
+        cache=None,
+        evaluate=get_average_damage_efficiency
+    ):
+    """
+    Generate the same results, in the same order, as get_results, but
+    evaluate them in a pool of workers processes (by default, one per
+    CPU). The sorted targets are split into chunks of chunk_size
+    targets (by default, enough for four chunks per worker), and the
+    results of the chunks are merged back in order, so the output does
+    not depend on the number of workers. The backend is resolved here,
+    so workers use the default backend of this process, and divergences
+    found by the check backend in the workers are recorded here too.
+    If cache is given, each worker opens its own connection to it.
+    evaluate is as for get_results.
+    """
+    backend = amounts.resolve_backend(backend)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    sorted_keys = sorted(targets.keys())
+    if chunk_size is None:
+        chunk_size = max(1, -(-len(sorted_keys) // (workers * 4)))
+
+    chunks = [
+        {key: targets[key] for key in sorted_keys[start:start + chunk_size]}
+        for start in range(0, len(sorted_keys), chunk_size)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Executor.map returns the results in the order of the chunks,
+        # regardless of which finishes first.
+        for chunk_results, max_divergence in executor.map(
+                _get_chunk_results,
+                chunks,
+                [options] * len(chunks),
+                [backend] * len(chunks),
+                [cache] * len(chunks),
+                [evaluate] * len(chunks)
+        ):
+            amounts.record_divergence(max_divergence)
+            yield from chunk_results
@@ -1,2 +1,1319 @@
-# TODO:
-# Write actual tests.
+"""
+The tests of the analysis package. Run them from this directory with:
+
+    python -m unittest tests
+"""
+import asyncio
+import contextlib
+import copy
+from fractions import Fraction
+from functools import partial
+import gc
+import io
+import json
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+
+import amounts
+import cli
+import crossover
+from __init__ import Ability, D3, D6, Model, UnknownStatError, Weapon
+import instrumentation
+import kills
+import matchups
+import optimiser
+import pruning
+from query_server import QueryServer
+import ranges
+from reducers import TopResultsReducer
+import result_cache
+from result_cache import ResultCache
+from result_store import MANIFEST_FILE_NAME, ResultStore, ResultWriter
+import risk
+import roster
+import simulation
+from roster import load_roster
+import sweep
+import vectorised
+import win_index
+
+
+ROSTER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'rosters',
+    'space_marines.json'
+)
+
+
+def get_targets(wounds, toughnesses, saves):
+    return {
+        (wound, toughness, save): Model(
+            {'W': wound, 'T': toughness, 'Sv': save}
+        )
+        for wound in wounds
+        for toughness in toughnesses
+        for save in saves
+    }
+
+
+def write_store(path, options, targets):
+    with ResultWriter(path, options) as writer:
+        writer.add_all(
+            sweep.get_results(targets, options, amounts.FLOAT_BACKEND)
+        )
+
+
+class DiceAmountTest(unittest.TestCase):
+
+    def test_moments_match_distribution(self):
+        amount = D6 * 3 + D3 + 2
+        distribution = amount.get_distribution()
+        average = sum(
+            [
+                value * probability
+                for value, probability in distribution.items()
+            ]
+        )
+        variance = sum(
+            [
+                (value - average) ** 2 * probability
+                for value, probability in distribution.items()
+            ]
+        )
+        self.assertEqual(amount.get_average_value(), average)
+        self.assertEqual(amount.get_variance(), variance)
+        self.assertEqual((amount.start, amount.stop), (6, 23))
+        self.assertEqual(
+            (amount.get_minimum(), amount.get_maximum()),
+            (min(distribution), max(distribution))
+        )
+
+    def test_vectorised_probabilities_match_scalar(self):
+        general_amount = amounts.GeneralAmount()
+        general_amount.add_amount(D6)
+        general_amount.add_amount(D3)
+        values = np.arange(0, 16)
+        for amount in [D6 * 2 + 1, D6 * 1, general_amount]:
+            for rerolling_from in [0, 3, 5]:
+                np.testing.assert_allclose(
+                    vectorised.get_probabilities_at_least(
+                        amount,
+                        values,
+                        rerolling_from
+                    ),
+                    [
+                        float(
+                            amount.get_probability_at_least(
+                                int(value),
+                                rerolling_from
+                            )
+                        )
+                        for value in values
+                    ]
+                )
+
+
+class VectorisedTest(unittest.TestCase):
+
+    def setUp(self):
+        self.options = load_roster(ROSTER_PATH).get_options()
+        wounds = [1, 2, 3, 6]
+        toughnesses = [3, 4, 5, 8]
+        saves = [2, 3, 4, 6, 7]
+        self.grid = np.ix_(wounds, toughnesses, saves)
+        # Each target, with its index in the results for the whole grid.
+        self.targets = [
+            (
+                (i, j, k),
+                Model({'W': wound, 'T': toughness, 'Sv': save})
+            )
+            for i, wound in enumerate(wounds)
+            for j, toughness in enumerate(toughnesses)
+            for k, save in enumerate(saves)
+        ]
+
+    def test_efficiencies_match_scalar(self):
+        for model, weapon_combinations in self.options:
+            for weapon_combination in weapon_combinations:
+                efficiencies = vectorised.get_average_damage_efficiencies(
+                    model,
+                    weapon_combination,
+                    *self.grid
+                )
+                for index, target in self.targets:
+                    self.assertAlmostEqual(
+                        efficiencies[index],
+                        model.get_average_damage_efficiency(
+                            target,
+                            weapon_combination,
+                            amounts.FLOAT_BACKEND
+                        ),
+                        delta=1e-12
+                    )
+
+    def test_damage_distributions_match_scalar(self):
+        # The roster has weapons with D3 and D6 damage, and abilities that
+        # reroll hits and wounds.
+        for model, weapon_combinations in self.options:
+            weapons = {
+                weapon.name: weapon
+                for weapon_combination in weapon_combinations
+                for weapon in weapon_combination
+            }
+            for weapon in weapons.values():
+                distributions = vectorised.get_damage_distributions(
+                    model,
+                    weapon,
+                    *self.grid
+                )
+                for index, target in self.targets:
+                    expected_distribution = np.zeros(distributions.shape[-1])
+                    for damage, probability in model.get_damage_distribution(
+                            target,
+                            weapon
+                    ).items():
+                        expected_distribution[int(damage)] = probability
+                    np.testing.assert_allclose(
+                        distributions[index],
+                        expected_distribution,
+                        rtol=0,
+                        atol=1e-12
+                    )
+
+class CacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.model = Model(
+            {'BS': 3, 'WS': 3, 'S': 4, 'T': 4, 'W': 2, 'A': 2, 'Sv': 3}
+        )
+        self.weapon = Weapon({'D': 1, 'AP': -1, 'is_melee': False})
+        self.target = Model({'W': 3, 'T': 4, 'Sv': 3})
+
+    def get_output(self):
+        return self.model.get_average_damage_output(self.target, self.weapon)
+
+    def assert_output_changes(self, change):
+        output = self.get_output()
+        change()
+        self.assertNotEqual(self.get_output(), output)
+
+    def test_in_place_changes_invalidate(self):
+        self.assert_output_changes(
+            lambda: self.model.stat_line.__setitem__('BS', 2)
+        )
+        self.assert_output_changes(
+            lambda: self.weapon.stat_line.__setitem__('D', 2)
+        )
+        self.assert_output_changes(
+            lambda: self.target.stat_line.__setitem__('Sv', 6)
+        )
+        wargear = Weapon({}, abilities=[Ability(stat_line_changes={'A': 1})])
+        self.assert_output_changes(
+            lambda: setattr(self.model, 'wargear', [wargear])
+        )
+        self.assert_output_changes(
+            lambda: setattr(
+                wargear.abilities[0],
+                'stat_line_changes',
+                {'A': 2}
+            )
+        )
+
+    def test_unrelated_items_do_not_invalidate(self):
+        self.get_output()
+        caches = self.model._caches
+        Model({'W': 1, 'T': 4, 'Sv': 3})
+        Weapon({'D': 2}).stat_line['D'] = 3
+        self.get_output()
+        self.assertIs(self.model._caches, caches)
+        self.assertEqual(len(caches['average_damage_outputs']), 1)
+
+    def test_targets_are_not_kept_alive(self):
+        self.get_output()
+        cache = self.model._caches['average_damage_outputs']
+        del self.target
+        gc.collect()
+        self.assertEqual(len(cache), 0)
+
+
+class StatLineTest(unittest.TestCase):
+
+    def test_stat_lines_act_like_dictionaries(self):
+        stats = {Model.STRENGTH_STAT_NAME: 4, Model.WOUNDS_STAT_NAME: 2}
+        stat_line = Model(stats).stat_line
+        self.assertFalse(hasattr(stat_line, '__dict__'))
+        self.assertEqual(stat_line, stats)
+        self.assertEqual(stat_line.copy(), stats)
+        self.assertEqual(dict(stat_line), stats)
+        self.assertEqual(pickle.loads(pickle.dumps(stat_line)), stat_line)
+        self.assertEqual(
+            result_cache._get_canonical_form(stat_line),
+            result_cache._get_canonical_form(stats)
+        )
+        index = stat_line.get_index(Model.STRENGTH_STAT_NAME)
+        self.assertEqual(stat_line[index], 4)
+        self.assertNotIn(Model.TOUGHNESS_STAT_NAME, stat_line)
+        with self.assertRaises(UnknownStatError):
+            stat_line[Model.TOUGHNESS_STAT_NAME]
+        with self.assertRaises(UnknownStatError):
+            stat_line['unknown'] = 1
+        del stat_line[Model.WOUNDS_STAT_NAME]
+        self.assertEqual(stat_line, {Model.STRENGTH_STAT_NAME: 4})
+
+
+class ResultCacheTest(unittest.TestCase):
+
+    def test_uses_are_written_with_sets(self):
+        with tempfile.TemporaryDirectory() as path:
+            cache = ResultCache(os.path.join(path, 'cache.db'), max_entries=2)
+
+            def get_last_used():
+                return dict(
+                    cache._get_connection().execute(
+                        'SELECT key, last_used FROM results'
+                    ).fetchall()
+                )
+
+            cache.set('a', 1)
+            cache.set('b', 2)
+            last_used = get_last_used()
+            self.assertEqual(cache.get('a'), 1)
+            self.assertEqual(get_last_used(), last_used)
+            # a was used after b was set, so b is evicted instead.
+            cache.set('c', 3)
+            self.assertEqual(cache.get_many(['a', 'b', 'c']), {'a': 1, 'c': 3})
+            last_used = get_last_used()
+            cache.close()
+            self.assertGreater(get_last_used()['c'], last_used['c'])
+            cache.close()
+
+class CliTest(unittest.TestCase):
+
+    def assert_rejected(self, arguments):
+        with contextlib.redirect_stderr(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                cli.main(arguments + ['-w', '1', '-t', '4', '-s', '3'])
+
+    def test_unsupported_combinations_are_rejected(self):
+        self.assert_rejected(['--prune', '--unit-size', '5'])
+        self.assert_rejected(['--prune', '--risk-aversion', '1'])
+        self.assert_rejected(['--prune', '--workers', '2'])
+        self.assert_rejected(['--tolerance', '1'])
+        self.assert_rejected(['--backend', 'check', '--cache', 'cache'])
+
+    def test_check_backend_reports_divergence(self):
+        arguments = [
+            '--unit',
+            'space_marine_veteran',
+            '--backend',
+            'check',
+            '-w',
+            '1',
+            '-t',
+            '4',
+            '-s',
+            '3'
+        ]
+        for tolerance, status in [('1', 0), ('0', 1)]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                with contextlib.redirect_stderr(io.StringIO()) as errors:
+                    self.assertEqual(
+                        cli.main(arguments + ['--tolerance', tolerance]),
+                        status
+                    )
+            self.assertIn(
+                'largest difference between exact and float results',
+                errors.getvalue()
+            )
+
+
+class KillsTest(unittest.TestCase):
+
+    TRIALS = 200000
+
+    def sample(self, rng, amount, size):
+        distribution = amounts.get_distribution(amount)
+        return rng.choice(
+            [int(value) for value in distribution.keys()],
+            size=size,
+            p=[float(probability) for probability in distribution.values()]
+        )
+
+    def simulate_kills(self, model, target, weapon_combination, unit_size):
+        """
+        Get an array of the number of models slain in each of TRIALS
+        simulated attacks on a unit of unit_size models like target.
+        """
+        rng = np.random.default_rng(0)
+        target_wounds = target.stat_line[Model.WOUNDS_STAT_NAME]
+        slain = np.zeros(self.TRIALS, dtype=int)
+        taken = np.zeros(self.TRIALS, dtype=int)
+        for weapon in weapon_combination:
+            modified_self_stat_line, modified_weapon_stat_line = \
+                model.get_modified_stat_lines(weapon)
+            hit_chance, wound_chance, fraction_unsaved = \
+                model.get_roll_chances(
+                    target,
+                    weapon,
+                    modified_self_stat_line,
+                    amounts.FLOAT_BACKEND
+                )
+            attacks = self.sample(
+                rng,
+                modified_self_stat_line[Model.ATTACKS_STAT_NAME],
+                self.TRIALS
+            )
+            for attack in range(attacks.max()):
+                damaging = (
+                    (attack < attacks)
+                    & (slain < unit_size)
+                    & (
+                        rng.random(self.TRIALS)
+                        < hit_chance * wound_chance * fraction_unsaved
+                    )
+                )
+                taken += damaging * self.sample(
+                    rng,
+                    modified_weapon_stat_line[Weapon.DAMAGE_STAT_NAME],
+                    self.TRIALS
+                )
+                # Damage beyond what slays a model is lost.
+                slays = taken >= target_wounds
+                slain += slays
+                taken[slays] = 0
+        return slain
+
+    def test_kill_distribution_matches_simulation(self):
+        units = load_roster(
+            ROSTER_PATH,
+            ['heavy_weapon_devastator', 'dreadnaught']
+        ).units
+        heavy_target = Model({'W': 3, 'T': 5, 'Sv': 3})
+        # Many attacks of random damage slay several models, and often
+        # do more damage than the model they slay has left.
+        melee_unit = (
+            Model({'BS': 3, 'WS': 2, 'S': 5, 'A': D3 + 4}),
+            [[Weapon({'D': D3, 'AP': -2, 'is_melee': True})]]
+        )
+        cases = [
+            (units['heavy_weapon_devastator'], 1, heavy_target, 3),
+            (units['dreadnaught'], 0, heavy_target, 4),
+            (melee_unit, 0, Model({'W': 2, 'T': 4, 'Sv': 4}), 4),
+        ]
+        for (model, weapon_combinations), index, target, unit_size in cases:
+            weapon_combination = weapon_combinations[index]
+            distribution = kills.get_kill_distribution(
+                model,
+                target,
+                weapon_combination,
+                unit_size,
+                amounts.FLOAT_BACKEND
+            )
+            simulated_kills = self.simulate_kills(
+                model,
+                target,
+                weapon_combination,
+                unit_size
+            )
+            for slain, probability in distribution.items():
+                frequency = np.mean(simulated_kills == slain)
+                standard_error = np.sqrt(
+                    probability * (1 - probability) / self.TRIALS
+                )
+                self.assertLessEqual(
+                    abs(frequency - probability),
+                    5 * standard_error + 1e-9
+                )
+
+    def test_fractional_damage_is_rejected(self):
+        model = Model({'WS': 3, 'S': 4, 'A': 2})
+        weapon = Weapon({'D': 1.5, 'AP': 0, 'is_melee': True})
+        target = Model({'W': 2, 'T': 4, 'Sv': 3})
+        with self.assertRaises(vectorised.NonIntegerAmountError):
+            kills.get_kill_distribution(model, target, [weapon])
+
+
+class SimulationTest(unittest.TestCase):
+
+    def setUp(self):
+        units = load_roster(
+            ROSTER_PATH,
+            ['heavy_weapon_devastator_with_captain', 'space_marine_veteran']
+        ).units
+        # These reroll hits or wounds, and have random attacks or damage.
+        self.cases = [
+            (
+                units['heavy_weapon_devastator_with_captain'][0],
+                weapon_combination,
+                target
+            )
+            for weapon_combination in units[
+                'heavy_weapon_devastator_with_captain'
+            ][1][:3]
+            for target in [
+                Model({'W': 1, 'T': 4, 'Sv': 3}),
+                Model({'W': 3, 'T': 7, 'Sv': 2})
+            ]
+        ] + [
+            (
+                units['space_marine_veteran'][0],
+                weapon_combination,
+                Model({'W': 2, 'T': 4, 'Sv': 3})
+            )
+            for weapon_combination in units['space_marine_veteran'][1]
+        ]
+
+    def get_mean_damage(self, model, weapon_combination, target):
+        return sum(
+            [
+                sum(
+                    [
+                        damage * probability
+                        for damage, probability in
+                        model.get_damage_distribution(target, weapon).items()
+                    ]
+                )
+                for weapon in weapon_combination
+            ]
+        )
+
+    def test_mean_matches_damage_distribution(self):
+        for model, weapon_combination, target in self.cases:
+            result = simulation.simulate(
+                model,
+                target,
+                weapon_combination,
+                seed=0,
+                max_trials=200000,
+                z_score=4
+            )
+            low, high = result.confidence_interval
+            self.assertLessEqual(
+                low,
+                self.get_mean_damage(model, weapon_combination, target)
+            )
+            self.assertGreaterEqual(
+                high,
+                self.get_mean_damage(model, weapon_combination, target)
+            )
+
+    def test_stops_once_precise_enough(self):
+        model, weapon_combination, target = self.cases[0]
+        simulate = partial(
+            simulation.simulate,
+            model,
+            target,
+            weapon_combination,
+            seed=1,
+            batch_size=1000
+        )
+        result = simulate(confidence_interval_half_width=0.01)
+        self.assertLess(result.trials, 1000000)
+        low, high = result.confidence_interval
+        self.assertLessEqual((high - low) / 2, 0.01)
+        # The same trials, but for one batch fewer, are not precise enough.
+        result = simulate(max_trials=result.trials - 1000)
+        low, high = result.confidence_interval
+        self.assertGreater((high - low) / 2, 0.01)
+
+    def test_seed_reproduces_result(self):
+        model, weapon_combination, target = self.cases[0]
+        results = [
+            simulation.simulate(
+                model,
+                target,
+                weapon_combination,
+                seed=seed,
+                max_trials=10000
+            )
+            for seed in [2, 2, 3]
+        ]
+        summaries = [
+            (
+                result.trials,
+                result.mean_damage,
+                result.damage_variance,
+                result.kill_probability,
+                result.rolls
+            )
+            for result in results
+        ]
+        self.assertEqual(summaries[0], summaries[1])
+        self.assertNotEqual(summaries[0], summaries[2])
+
+class SweepTest(unittest.TestCase):
+
+    def test_parallel_matches_serial(self):
+        options = load_roster(
+            ROSTER_PATH,
+            ['space_marine_veteran', 'heavy_weapon_devastator']
+        ).get_options()
+        targets = get_targets([1, 2, 3], [4, 7], [3, 5])
+        for evaluate in [
+                sweep.get_average_damage_efficiency,
+                partial(kills.get_average_kill_efficiency, unit_size=3)
+        ]:
+            self.assertEqual(
+                list(
+                    sweep.get_results_in_parallel(
+                        targets,
+                        options,
+                        workers=2,
+                        chunk_size=5,
+                        backend=amounts.FLOAT_BACKEND,
+                        evaluate=evaluate
+                    )
+                ),
+                list(
+                    sweep.get_results(
+                        targets,
+                        options,
+                        amounts.FLOAT_BACKEND,
+                        evaluate=evaluate
+                    )
+                )
+            )
+
+    def test_cached_evaluations_are_kept_apart(self):
+        options = load_roster(
+            ROSTER_PATH,
+            ['space_marine_veteran']
+        ).get_options()
+        targets = get_targets([1, 2], [4], [3])
+        with tempfile.TemporaryDirectory() as path:
+            with ResultCache(os.path.join(path, 'cache.sqlite3')) as cache:
+                for _ in range(2):
+                    self.assertEqual(
+                        list(
+                            sweep.get_results(
+                                targets,
+                                options,
+                                amounts.FLOAT_BACKEND,
+                                cache
+                            )
+                        ),
+                        list(
+                            sweep.get_results(
+                                targets,
+                                options,
+                                amounts.FLOAT_BACKEND
+                            )
+                        )
+                    )
+                    self.assertEqual(
+                        list(
+                            risk.get_results(
+                                targets,
+                                options,
+                                2,
+                                amounts.FLOAT_BACKEND,
+                                cache
+                            )
+                        ),
+                        list(
+                            risk.get_results(
+                                targets,
+                                options,
+                                2,
+                                amounts.FLOAT_BACKEND
+                            )
+                        )
+                    )
+
+
+class MatchupsTest(unittest.TestCase):
+
+    def test_matches_scalar(self):
+        first_options = load_roster(
+            ROSTER_PATH,
+            ['space_marine_veteran', 'inceptor']
+        ).get_options()
+        second_options = load_roster(
+            ROSTER_PATH,
+            ['heavy_weapon_devastator_with_captain', 'dreadnaught']
+        ).get_options()
+        for attacking_options, defending_options in [
+                (first_options, second_options),
+                (second_options, first_options)
+        ]:
+            matrix = matchups.get_matchups(
+                attacking_options,
+                defending_options
+            )
+            attackers = matchups.get_loadouts(attacking_options)
+            defenders = [model for model, _ in defending_options]
+            self.assertEqual(
+                matrix.efficiencies.shape,
+                (len(attackers), len(defenders))
+            )
+            for i, (model, weapon_combination) in enumerate(attackers):
+                for j, defender in enumerate(defenders):
+                    self.assertAlmostEqual(
+                        matrix.damages[i, j],
+                        sum(
+                            [
+                                model.get_average_damage_output(
+                                    defender,
+                                    weapon,
+                                    amounts.FLOAT_BACKEND
+                                )
+                                for weapon in weapon_combination
+                            ]
+                        ),
+                        delta=1e-12
+                    )
+                    self.assertAlmostEqual(
+                        matrix.efficiencies[i, j],
+                        model.get_average_damage_efficiency(
+                            defender,
+                            weapon_combination,
+                            amounts.FLOAT_BACKEND
+                        ),
+                        delta=1e-12
+                    )
+
+class OptimiserTest(unittest.TestCase):
+
+    def get_best_value(self, loadout_values, points_budget, max_counts):
+        """
+        Get the best total value of any army within points_budget, by
+        trying every one.
+        """
+        if not loadout_values:
+            return 0
+        (model, weapon_combination, points_cost, value), *rest = (
+            loadout_values
+        )
+        max_count = max_counts.get(
+            sweep.get_loadout_name(model, weapon_combination),
+            int(points_budget // points_cost)
+        )
+        return max(
+            [
+                count * value + self.get_best_value(
+                    rest,
+                    points_budget - count * points_cost,
+                    max_counts
+                )
+                for count in range(max_count + 1)
+                if count * points_cost <= points_budget
+            ]
+        )
+
+    def test_matches_brute_force(self):
+        options = load_roster(
+            ROSTER_PATH,
+            ['space_marine_veteran', 'heavy_weapon_devastator', 'inceptor']
+        ).get_options()
+        weighted_targets = [
+            (Model({'W': 1, 'T': 4, 'Sv': 3}), 2),
+            (Model({'W': 3, 'T': 7, 'Sv': 3}), 1)
+        ]
+        loadout_values = optimiser.get_loadout_values(
+            options,
+            weighted_targets,
+            amounts.FLOAT_BACKEND
+        )
+        max_counts = {'inceptor with assault_bolter': 1}
+        for points_budget in [17, 60, 100]:
+            # Every points cost is a multiple of the resolution, so the
+            # optimiser does not need to round any up.
+            army, total_points, total_value = optimiser.optimise_army(
+                options,
+                points_budget,
+                weighted_targets,
+                max_counts,
+                points_resolution=0.5
+            )
+            self.assertLessEqual(total_points, points_budget)
+            counts = {
+                sweep.get_loadout_name(model, weapon_combination): count
+                for model, weapon_combination, count in army
+            }
+            self.assertLessEqual(
+                counts.get('inceptor with assault_bolter', 0),
+                1
+            )
+            self.assertAlmostEqual(
+                total_value,
+                self.get_best_value(loadout_values, points_budget, max_counts)
+            )
+
+    def test_default_resolution_needs_no_rounding(self):
+        self.assertEqual(
+            optimiser.get_points_resolution([17, 8.5, 25.5]),
+            Fraction(17, 2)
+        )
+        self.assertEqual(
+            optimiser.get_points_resolution([17.3, 13, 0]),
+            Fraction(1, 10)
+        )
+        options = load_roster(
+            ROSTER_PATH,
+            ['heavy_weapon_devastator_with_captain', 'inceptor']
+        ).get_options()
+        weighted_targets = [(Model({'W': 2, 'T': 5, 'Sv': 3}), 1)]
+        loadout_values = optimiser.get_loadout_values(
+            options,
+            weighted_targets,
+            amounts.FLOAT_BACKEND
+        )
+        # The captain's points are split between squads, so costs are not
+        # whole numbers, and rounding them up would miss the best army.
+        for points_budget in [103, 140, 157]:
+            army, total_points, total_value = optimiser.optimise_army(
+                options,
+                points_budget,
+                weighted_targets
+            )
+            self.assertLessEqual(total_points, points_budget)
+            self.assertAlmostEqual(
+                total_value,
+                self.get_best_value(loadout_values, points_budget, {})
+            )
+
+
+class PruningTest(unittest.TestCase):
+
+    def get_top(self, results, k):
+        reducer = TopResultsReducer(k)
+        reducer.add_all(results)
+        return {
+            target: reducer.get_top(*target)
+            for target in reducer.get_targets()
+        }
+
+    def test_matches_full_sweep(self):
+        options = load_roster(ROSTER_PATH).get_options()
+        targets = get_targets(range(1, 7), range(1, 11), range(2, 7))
+        for k in [1, 3]:
+            pruning_result = pruning.prune(targets, options, k)
+            self.assertTrue(pruning_result.get_pruned_indices())
+            self.assertEqual(
+                self.get_top(
+                    pruning_result.get_results(amounts.FLOAT_BACKEND),
+                    k
+                ),
+                self.get_top(
+                    sweep.get_results(targets, options, amounts.FLOAT_BACKEND),
+                    k
+                )
+            )
+
+
+class CrossoverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loadouts = [
+            (model, weapon_combination)
+            for model, weapon_combinations in load_roster(
+                ROSTER_PATH
+            ).get_options()
+            for weapon_combination in weapon_combinations
+        ]
+        self.targets = [
+            Model({'W': 1, 'T': 4, 'Sv': 3}),
+            Model({'W': 3, 'T': 7, 'Sv': 2})
+        ]
+
+    def get_with_stat(self, item, stat_name, value):
+        modified_item = copy.copy(item)
+        stat_line = item.stat_line.copy()
+        stat_line[stat_name] = value
+        modified_item.stat_line = stat_line
+        return modified_item
+
+    def get_outcomes(
+            self,
+            loadout,
+            other_efficiency,
+            target,
+            stat_name,
+            values,
+            weapon_index
+        ):
+        """
+        Get whether loadout is at least as efficient as other_efficiency
+        with each of values of its stat, by copying it with each one.
+        """
+        outcomes = []
+        for value in values:
+            model, weapon_combination = loadout
+            if weapon_index is None:
+                model = self.get_with_stat(model, stat_name, value)
+            else:
+                weapon_combination = list(weapon_combination)
+                weapon_combination[weapon_index] = self.get_with_stat(
+                    weapon_combination[weapon_index],
+                    stat_name,
+                    value
+                )
+            outcomes.append(
+                model.get_average_damage_efficiency(
+                    target,
+                    weapon_combination,
+                    amounts.EXACT_BACKEND
+                ) >= other_efficiency
+            )
+        return outcomes
+
+    def test_stat_thresholds_match_brute_force(self):
+        model_stats = [
+            ('BS', [2, 3, 4, 5, 6]),
+            ('WS', [2, 3, 4, 5, 6]),
+            ('S', range(1, 11)),
+            ('A', [1, 2, 3, 4])
+        ]
+        weapon_stats = [('AP', [0, -1, -2, -3, -4]), ('D', [1, 2, 3, 4])]
+        for loadout, other_loadout in zip(self.loadouts, self.loadouts[1:]):
+            for target in self.targets:
+                other_model, other_weapon_combination = other_loadout
+                other_efficiency = other_model.get_average_damage_efficiency(
+                    target,
+                    other_weapon_combination,
+                    amounts.EXACT_BACKEND
+                )
+                for weapon_index, stats in [
+                        (None, model_stats),
+                        (0, weapon_stats)
+                ]:
+                    for stat_name, values in stats:
+                        values = list(values)
+                        outcomes = self.get_outcomes(
+                            loadout,
+                            other_efficiency,
+                            target,
+                            stat_name,
+                            values,
+                            weapon_index
+                        )
+                        changes = [
+                            index
+                            for index in range(1, len(values))
+                            if outcomes[index] != outcomes[index - 1]
+                        ]
+                        self.assertLessEqual(len(changes), 1)
+                        if changes:
+                            expected = values[changes[0]], outcomes[changes[0]]
+                        else:
+                            expected = None
+                        self.assertEqual(
+                            crossover.get_stat_threshold(
+                                *loadout,
+                                *other_loadout,
+                                target,
+                                stat_name,
+                                values,
+                                weapon_index,
+                                amounts.EXACT_BACKEND
+                            ),
+                            expected
+                        )
+
+    def test_stat_thresholds_that_do_not_exist(self):
+        devastators = [
+            loadout
+            for loadout in self.loadouts
+            if loadout[0].name == 'heavy_weapon_devastator'
+        ]
+        # Damage beyond the single wound of the target is wasted.
+        self.assertIsNone(
+            crossover.get_stat_threshold(
+                *devastators[0],
+                *devastators[1],
+                self.targets[0],
+                'D',
+                [1, 2, 3, 4],
+                0
+            )
+        )
+        # The loadout is worse than itself at BS 6, and better at BS 2.
+        with self.assertRaises(crossover.NonMonotonicStatError):
+            crossover.get_stat_threshold(
+                *devastators[0],
+                *devastators[0],
+                self.targets[1],
+                'BS',
+                [6, 2, 6]
+            )
+
+    def test_points_break_evens_match_brute_force(self):
+        for loadout, other_loadout in zip(self.loadouts, self.loadouts[1:]):
+            for target in self.targets:
+                break_even = crossover.get_points_break_even(
+                    *loadout,
+                    *other_loadout,
+                    target,
+                    amounts.EXACT_BACKEND
+                )
+                other_model, other_weapon_combination = other_loadout
+                other_efficiency = other_model.get_average_damage_efficiency(
+                    target,
+                    other_weapon_combination,
+                    amounts.EXACT_BACKEND
+                )
+                model, weapon_combination = loadout
+                other_points = (
+                    model.get_points_cost(weapon_combination) - model.points
+                )
+                for points_cost, comparison in [
+                        (break_even - 1, self.assertGreater),
+                        (break_even, self.assertAlmostEqual),
+                        (break_even + 1, self.assertLess)
+                ]:
+                    if points_cost <= 0:
+                        continue
+                    modified_model = copy.copy(model)
+                    modified_model.points = points_cost - other_points
+                    comparison(
+                        modified_model.get_average_damage_efficiency(
+                            target,
+                            weapon_combination,
+                            amounts.EXACT_BACKEND
+                        ),
+                        other_efficiency
+                    )
+
+class RangesTest(unittest.TestCase):
+
+    def test_parse_range(self):
+        self.assertEqual(ranges.parse_range('1,3,5-7'), [1, 3, 5, 6, 7])
+        for text in ['', '3-1', 'x']:
+            with self.assertRaises(ranges.InvalidRangeError):
+                ranges.parse_range(text)
+
+
+class RosterTest(unittest.TestCase):
+
+    def test_parse_amount_adds_constant_once(self):
+        amount = roster.parse_amount('2D3+3', 'weapon')
+        self.assertEqual((amount.start, amount.stop), (5, 9))
+        self.assertEqual(amount.get_average_value(), 7)
+        amount = roster.parse_amount('D3+3', 'weapon')
+        self.assertEqual((amount.start, amount.stop), (4, 6))
+
+    def test_units_share_weapons(self):
+        document = {
+            'weapons': {
+                'bolter': {'stat_line': {'D': 1, 'AP': 0, 'is_melee': False}}
+            },
+            'units': {
+                key: {
+                    'stat_line': {'BS': 3, 'WS': 3, 'S': 4, 'A': 1, 'Sv': 3},
+                    'weapon_combinations': [['bolter']],
+                    'wargear': ['bolter']
+                }
+                for key in ('first', 'second')
+            }
+        }
+        with tempfile.TemporaryDirectory() as path:
+            roster_path = os.path.join(path, 'roster.json')
+            with open(roster_path, 'w') as roster_file:
+                json.dump(document, roster_file)
+            # The first load compiles the roster, and the second reads it.
+            for _ in range(2):
+                loaded = load_roster(roster_path)
+                weapons = [
+                    weapon
+                    for model, weapon_combinations in loaded.get_options()
+                    for weapon in weapon_combinations[0] + model.wargear
+                ]
+                for weapon in weapons:
+                    self.assertIs(weapon, loaded.weapons['bolter'])
+
+
+class InstrumentationTest(unittest.TestCase):
+
+    def test_probability_hit_rate_is_a_rate(self):
+        amounts._get_probability_at_least_table.cache_clear()
+        with instrumentation.instrumented():
+            D6.get_probability_at_least(3, 0, amounts.FLOAT_BACKEND)
+            D6.get_probability_at_least(3, 0, amounts.FLOAT_BACKEND)
+            # Not in the table, so a miss.
+            D6.get_probability_at_least(3, 10, amounts.FLOAT_BACKEND)
+        report = instrumentation.get_report()['functions'][
+            'SingleAmount.get_probability_at_least'
+        ]
+        self.assertEqual(report['calls'], 3)
+        self.assertEqual(report['misses'], 1)
+        self.assertGreaterEqual(report['hit_rate'], 0)
+        self.assertLessEqual(report['hit_rate'], 1)
+
+    def test_off_values_are_off(self):
+        for value in [None, '', '0', 'false', 'No', ' FALSE ']:
+            self.assertIsNone(instrumentation.get_destination(value))
+        self.assertEqual(instrumentation.get_destination('1'), '1')
+        self.assertEqual(
+            instrumentation.get_destination('report.json'),
+            'report.json'
+        )
+
+    def test_lru_caches_are_reported(self):
+        with instrumentation.instrumented():
+            (D6 * 2 + D3).get_distribution()
+        caches = instrumentation.get_report()['caches']
+        self.assertIn('amounts._get_dice_distribution', caches)
+        self.assertIn('kills._attack_with_weapon', caches)
+
+
+class ResultStoreTest(unittest.TestCase):
+
+    def test_new_run_replaces_old_chunks(self):
+        options = load_roster(
+            ROSTER_PATH,
+            ['space_marine_veteran']
+        ).get_options()
+        with tempfile.TemporaryDirectory() as path:
+            with ResultWriter(path, options, chunk_size=4) as writer:
+                writer.add_all(
+                    sweep.get_results(
+                        get_targets([1, 2, 3], [4], [3]),
+                        options,
+                        amounts.FLOAT_BACKEND
+                    )
+                )
+            first_file_names = set(os.listdir(path))
+            targets = get_targets([1], [4], [3])
+            write_store(path, options, targets)
+
+            store = ResultStore(path)
+            self.assertTrue(store.complete)
+            self.assertEqual(
+                list(store.iterate_results()),
+                list(
+                    sweep.get_results(targets, options, amounts.FLOAT_BACKEND)
+                )
+            )
+            file_names = set(os.listdir(path))
+            listed_file_names = {
+                file_name
+                for chunk in store._chunks
+                for file_name in chunk['files'].values()
+            }
+            self.assertEqual(
+                file_names,
+                listed_file_names | {MANIFEST_FILE_NAME}
+            )
+            self.assertFalse(
+                (file_names - {MANIFEST_FILE_NAME}) & first_file_names
+            )
+
+    def test_old_store_is_kept_until_close(self):
+        options = load_roster(
+            ROSTER_PATH,
+            ['space_marine_veteran']
+        ).get_options()
+        old_targets = get_targets([1, 2], [4], [3])
+        new_targets = get_targets([3], [5], [2])
+        old_results = list(
+            sweep.get_results(old_targets, options, amounts.FLOAT_BACKEND)
+        )
+        with tempfile.TemporaryDirectory() as path:
+            write_store(path, options, old_targets)
+            old_file_names = set(os.listdir(path))
+
+            with self.assertRaises(RuntimeError):
+                with ResultWriter(path, options, chunk_size=2) as writer:
+                    writer.add_all(
+                        sweep.get_results(
+                            new_targets,
+                            options,
+                            amounts.FLOAT_BACKEND
+                        )
+                    )
+                    raise RuntimeError('the sweep failed')
+            self.assertEqual(set(os.listdir(path)), old_file_names)
+
+            writer = ResultWriter(path, options, chunk_size=2)
+            writer.add_all(
+                sweep.get_results(new_targets, options, amounts.FLOAT_BACKEND)
+            )
+            store = ResultStore(path)
+            self.assertTrue(store.complete)
+            self.assertEqual(list(store.iterate_results()), old_results)
+            writer.close()
+            self.assertEqual(
+                list(ResultStore(path).iterate_results()),
+                list(
+                    sweep.get_results(
+                        new_targets,
+                        options,
+                        amounts.FLOAT_BACKEND
+                    )
+                )
+            )
+            self.assertFalse(
+                (set(os.listdir(path)) - {MANIFEST_FILE_NAME})
+                & old_file_names
+            )
+
+
+class QueryServerTest(unittest.TestCase):
+
+    def test_reloads_continue_after_errors(self):
+        options = load_roster(
+            ROSTER_PATH,
+            ['space_marine_veteran']
+        ).get_options()
+        with tempfile.TemporaryDirectory() as path:
+            write_store(path, options, get_targets([1], [4], [3]))
+            server = QueryServer(path, reload_interval=0.01)
+            server.load()
+            first_index = server.index
+            load = server._load
+            calls = []
+
+            def fail_once():
+                calls.append(None)
+                if len(calls) == 1:
+                    raise EOFError('a chunk is still being written')
+                return load()
+
+            server._load = fail_once
+
+            async def reload():
+                reloading = asyncio.create_task(
+                    server.reload_periodically()
+                )
+                write_store(path, options, get_targets([1, 2], [4], [3]))
+                for _ in range(200):
+                    await asyncio.sleep(0.01)
+                    if server.index is not first_index:
+                        break
+                reloading.cancel()
+
+            with contextlib.redirect_stderr(io.StringIO()) as errors:
+                asyncio.run(reload())
+            self.assertIn('EOFError', errors.getvalue())
+            self.assertGreater(len(calls), 1)
+            self.assertEqual(len(server.index.targets), 2)
+
+    def test_serves_after_overlong_requests(self):
+        options = load_roster(
+            ROSTER_PATH,
+            ['space_marine_veteran']
+        ).get_options()
+        with tempfile.TemporaryDirectory() as path:
+            write_store(path, options, get_targets([1], [4], [3]))
+            server = QueryServer(path)
+            server.load()
+
+            async def query():
+                tcp_server = await asyncio.start_server(
+                    server.handle_connection,
+                    '127.0.0.1',
+                    0
+                )
+                port = tcp_server.sockets[0].getsockname()[1]
+                reader, writer = await asyncio.open_connection(
+                    '127.0.0.1',
+                    port
+                )
+                # The overlong request arrives in parts, so the end of it
+                # is not there yet when the limit is reached.
+                request = json.dumps({'query': 'loadouts', 'x': 'x' * 100000})
+                writer.write(request[:70000].encode())
+                await writer.drain()
+                await asyncio.sleep(0.05)
+                writer.write(request[70000:].encode() + b'\n')
+                writer.write(json.dumps({'query': 'loadouts'}).encode())
+                writer.write(b'\n')
+                await writer.drain()
+                responses = [
+                    json.loads(await reader.readline()),
+                    json.loads(await reader.readline())
+                ]
+                writer.close()
+                await writer.wait_closed()
+                tcp_server.close()
+                await tcp_server.wait_closed()
+                return responses
+
+            too_long, loadouts = asyncio.run(query())
+            self.assertIn('error', too_long)
+            self.assertEqual(
+                loadouts['results'],
+                server.answer({'query': 'loadouts'})['results']
+            )
+
+
+class WinIndexTest(unittest.TestCase):
+
+    def test_matches_brute_force(self):
+        options = load_roster(ROSTER_PATH).get_options()
+        reducer = TopResultsReducer(3)
+        reducer.add_all(
+            sweep.get_results(
+                get_targets(range(1, 5), range(3, 9), range(2, 7)),
+                options,
+                amounts.FLOAT_BACKEND
+            )
+        )
+        index = win_index.WinIndex.from_reducer(reducer)
+        targets = reducer.get_targets()
+
+        def get_wins(name, k):
+            return {
+                target
+                for target in targets
+                if name in [
+                    top_name for top_name, _ in reducer.get_top(*target)[:k]
+                ]
+            }
+
+        def get_targets_in(bitset):
+            targets_in = index.get_targets(bitset)
+            self.assertEqual(len(targets_in), win_index.count(bitset))
+            self.assertEqual(targets_in, sorted(targets_in, key=targets.index))
+            return set(targets_in)
+
+        region = {
+            target
+            for target in targets
+            if target[0] in [1, 2] and 5 <= target[1] <= 7
+        }
+        self.assertEqual(
+            get_targets_in(
+                index.get_region(wounds=[1, 2], toughness=range(5, 8))
+            ),
+            region
+        )
+        names = index.get_loadout_names()
+        self.assertGreater(len(names), 2)
+        for k in [1, 3]:
+            for name, other_name in zip(names, names[1:]):
+                wins = index.get_wins(name, k)
+                other_wins = index.get_wins(other_name, k)
+                self.assertEqual(get_targets_in(wins), get_wins(name, k))
+                self.assertEqual(
+                    get_targets_in(wins | other_wins),
+                    get_wins(name, k) | get_wins(other_name, k)
+                )
+                self.assertEqual(
+                    get_targets_in(wins & other_wins),
+                    get_wins(name, k) & get_wins(other_name, k)
+                )
+                self.assertEqual(
+                    get_targets_in(wins & ~other_wins),
+                    get_wins(name, k) - get_wins(other_name, k)
+                )
+                self.assertEqual(
+                    get_targets_in(
+                        wins & index.get_region(
+                            wounds=[1, 2],
+                            toughness=range(5, 8)
+                        )
+                    ),
+                    get_wins(name, k) & region
+                )
+            self.assertEqual(
+                index.get_win_counts(k),
+                {name: len(get_wins(name, k)) for name in names}
+            )
+
+if __name__ == '__main__':
+    unittest.main()
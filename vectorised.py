@@ -0,0 +1,280 @@
+"""
+This module provides vectorised versions of the damage calculations of
+the Model class, which evaluate a model and weapon combination against
+whole arrays of target wounds, toughness and save values at once,
+using NumPy.
+"""
+import numpy as np
+
+import amounts
+from __init__ import Model, Weapon, D6
+
+
+def get_probabilities_at_least(amount, values, rerolling_from=0):
+    """
+    Get an array of the probabilities that a roll of amount will be at
+    least each of values, allowing for rerolls at or below
+    rerolling_from, as per SingleAmount.get_probability_at_least.
+    rerolling_from may also be an array, in which case it is
+    broadcast against values.
+    """
+    values = np.asarray(values, dtype=float)
+    if not type(amount) is amounts.SingleAmount:
+        return _get_dice_probabilities_at_least(amount, values, rerolling_from)
+    start = float(amount.start)
+    stop = float(amount.stop)
+    if np.any(values < start):
+        raise amounts.SingleAmount.PointNotInAmountRange(
+            'all values to be at least must be at least the start value'
+        )
+    if np.any(np.asarray(rerolling_from) + 1 < start):
+        raise amounts.SingleAmount.PointNotInAmountRange(
+            'rerolling_from + 1 must be at least the start of the amount'
+        )
+    rerolling_from = np.minimum(rerolling_from, values - 1)
+
+    amount_spread = stop - start + 1
+    fraction_above = np.maximum((stop - values + 1) / amount_spread, 0)
+    fraction_to_reroll = (rerolling_from + 1 - start) / amount_spread
+    return fraction_above * (1 + fraction_to_reroll)
+
+
+def _get_dice_probabilities_at_least(amount, values, rerolling_from):
+    """
+    Get get_probabilities_at_least of a sum of dice, or any other amount
+    that is not a single die, from its tail probabilities, as per
+    DiceAmount.get_probability_at_least.
+    """
+    dice_amount = amounts.DiceAmount.from_amount(amount)
+    sorted_values, tail_probabilities = amounts._get_dice_tail_probabilities(
+        dice_amount.dice,
+        dice_amount.constant
+    )
+    sorted_values = np.array(sorted_values, dtype=float)
+    # Values above the maximum are never reached.
+    tail_probabilities = np.append(
+        np.array(tail_probabilities, dtype=float),
+        0.0
+    )
+
+    def get_probabilities(values):
+        return tail_probabilities[
+            np.searchsorted(sorted_values, values, side='left')
+        ]
+
+    rerolling_from = np.minimum(rerolling_from, values - 1)
+    return get_probabilities(values) * (
+        2 - get_probabilities(rerolling_from + 1)
+    )
+
+
+def get_to_wound_rolls(strength, toughnesses):
+    """
+    Get an array of the rolls needed to wound against each of
+    toughnesses with the given strength, as per Model.get_to_wound_roll.
+    """
+    toughnesses = np.asarray(toughnesses)
+    return np.select(
+        [
+            toughnesses == 0,
+            strength >= 2 * toughnesses,
+            2 * strength <= toughnesses,
+            strength > toughnesses,
+            strength < toughnesses,
+        ],
+        [2, 2, 6, 3, 5],
+        default=4
+    )
+
+
+class NonIntegerAmountError(Exception): pass
+
+
+def _get_roll_chances(
+        model,
+        weapon,
+        modified_self_stat_line,
+        toughnesses,
+        saves
+    ):
+    """
+    Get a tuple of the hit chance, and arrays of the wound chances and
+    fractions unsaved, as per Model.get_roll_chances.
+    """
+    hit_chance = model.get_hit_chance(
+        weapon,
+        modified_self_stat_line,
+        amounts.FLOAT_BACKEND
+    )
+    _, max_reroll_wounds = model.get_max_rerolls(weapon)
+
+    unmodified_wounds_at_or_below = get_to_wound_rolls(
+        float(modified_self_stat_line[Model.STRENGTH_STAT_NAME]),
+        toughnesses
+    )
+    modified_wounds_at_or_below = (
+        unmodified_wounds_at_or_below - modified_self_stat_line[
+            Model.TO_WOUND_ROLL_MODIFIER_STAT_NAME
+        ]
+    )
+    wound_chances = get_probabilities_at_least(
+        D6,
+        modified_wounds_at_or_below,
+        np.minimum(max_reroll_wounds, unmodified_wounds_at_or_below - 1)
+    )
+
+    save_rolls = saves - weapon.stat_line[Weapon.ARMOUR_PIERCING_STAT_NAME]
+    fractions_unsaved = 1 - get_probabilities_at_least(D6, save_rolls)
+
+    return hit_chance, wound_chances, fractions_unsaved
+
+
+def _broadcast_targets(wounds, toughnesses, saves):
+    return np.broadcast_arrays(
+        np.asarray(wounds, dtype=float),
+        np.asarray(toughnesses, dtype=float),
+        np.asarray(saves, dtype=float)
+    )
+
+
+def get_average_damage_outputs(model, weapon, wounds, toughnesses, saves):
+    """
+    Get an array of the average damage output of model with weapon
+    against targets with the given wounds, toughnesses and saves. These
+    may be arrays or scalars, and are broadcast against each other. The
+    targets are assumed to have no abilities of their own.
+    """
+    wounds, toughnesses, saves = _broadcast_targets(wounds, toughnesses, saves)
+
+    # Everything that does not depend on the target is worked out once,
+    # using the same methods as the scalar calculation.
+    modified_self_stat_line, modified_weapon_stat_line = \
+        model.get_modified_stat_lines(weapon)
+    hit_chance, wound_chances, fractions_unsaved = _get_roll_chances(
+        model,
+        weapon,
+        modified_self_stat_line,
+        toughnesses,
+        saves
+    )
+    attacks = float(abs(modified_self_stat_line[Model.ATTACKS_STAT_NAME]))
+    damage = float(abs(modified_weapon_stat_line[Weapon.DAMAGE_STAT_NAME]))
+
+    damages = np.minimum(damage, wounds)
+    return attacks * hit_chance * wound_chances * damages * fractions_unsaved
+
+
+def _get_distribution_items(amount):
+    """
+    Get a list of the (integer value, float probability) pairs of the
+    distribution of amount, which must only take non-negative integer
+    values.
+    """
+    items = []
+    for value, probability in amounts.get_distribution(amount).items():
+        if value < 0 or value != int(value):
+            raise NonIntegerAmountError(
+                'distributions can only be found for non-negative integers'
+            )
+        items.append((int(value), float(probability)))
+    return items
+
+
+def get_damage_distributions(model, weapon, wounds, toughnesses, saves):
+    """
+    Get an array of the probability mass functions of the unsaved
+    damage done by model with weapon against targets with the given
+    wounds, toughnesses and saves, as per
+    Model.get_damage_distribution. The last axis of the result is the
+    damage value, and the others are the broadcast shape of the
+    targets. The repeated convolutions for each possible number of
+    attacks are done for every target at once, as powers of the
+    Fourier transform of the single attack distributions.
+    """
+    wounds, toughnesses, saves = _broadcast_targets(wounds, toughnesses, saves)
+
+    modified_self_stat_line, modified_weapon_stat_line = \
+        model.get_modified_stat_lines(weapon)
+    hit_chance, wound_chances, fractions_unsaved = _get_roll_chances(
+        model,
+        weapon,
+        modified_self_stat_line,
+        toughnesses,
+        saves
+    )
+    damaging_chances = hit_chance * wound_chances * fractions_unsaved
+
+    damage_items = _get_distribution_items(
+        modified_weapon_stat_line[Weapon.DAMAGE_STAT_NAME]
+    )
+    attacks_items = _get_distribution_items(
+        modified_self_stat_line[Model.ATTACKS_STAT_NAME]
+    )
+    max_damage = max([damage for damage, _ in damage_items])
+    max_attacks = max([attacks for attacks, _ in attacks_items])
+
+    # The distribution of a single attack, with the damage of each unsaved
+    # wound capped at the wounds of the target.
+    damage_values = np.arange(max_damage + 1)
+    attack_distributions = np.zeros(wounds.shape + (max_damage + 1,))
+    attack_distributions[..., 0] = 1 - damaging_chances
+    for damage, probability in damage_items:
+        capped_damages = np.minimum(damage, wounds).astype(int)
+        attack_distributions += (
+            (damaging_chances * probability)[..., np.newaxis]
+            * (damage_values == capped_damages[..., np.newaxis])
+        )
+
+    length = max_attacks * max_damage + 1
+    transformed_attack_distributions = np.fft.rfft(
+        attack_distributions,
+        n=length,
+        axis=-1
+    )
+    transformed_damage_distributions = sum(
+        [
+            probability * transformed_attack_distributions ** attacks
+            for attacks, probability in attacks_items
+        ]
+    )
+    damage_distributions = np.fft.irfft(
+        transformed_damage_distributions,
+        n=length,
+        axis=-1
+    )
+    # The transforms leave tiny negative rounding errors where the
+    # probability should be zero.
+    return np.maximum(damage_distributions, 0)
+
+
+def get_average_damage_efficiencies(
+        model,
+        weapon_combination,
+        wounds,
+        toughnesses,
+        saves
+    ):
+    """
+    Get an array of the average damage efficiency of model with
+    weapon_combination against targets with the given wounds,
+    toughnesses and saves, as per Model.get_average_damage_efficiency.
+    """
+    points_cost = model.get_points_cost(weapon_combination)
+    if points_cost == 0:
+        raise Model.InvalidModelForEfficiencyError(
+            'zero points cost cannot have an efficiency'
+        )
+
+    average_outputs = sum(
+        [
+            get_average_damage_outputs(
+                model,
+                weapon,
+                wounds,
+                toughnesses,
+                saves
+            )
+            for weapon in weapon_combination
+        ]
+    )
+    return average_outputs / points_cost
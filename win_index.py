@@ -0,0 +1,258 @@
+"""
+This module provides an inverted index from each loadout to the targets
+it ranks first, or in the top k, against, built once from the results
+of a sweep, so that questions such as how many targets a loadout wins,
+or which high toughness targets it wins, need not rescan the results.
+
+The targets are numbered in the order of TopResultsReducer.get_targets,
+and each set of targets is stored as a bitset, a Python integer whose
+bit n is set if target n is in the set. So the targets two loadouts
+both win are the & of their bitsets, the targets either wins are the |,
+and the targets one wins but not the other are a & ~b. Regions of the
+grid are bitsets too, made from a bitset per value of each stat.
+
+analysis.py writes the index of its sweep next to its results, which
+can then be queried with, for example:
+
+    python win_index.py --loadout '*multimelta*' --toughness 8-10
+"""
+import argparse
+from fnmatch import fnmatch
+import json
+import os
+import sys
+
+from ranges import parse_range
+
+
+WIN_INDEX_FILE_NAME = 'wins.json'
+
+
+class InvalidRankError(Exception): pass
+
+
+def count(bitset):
+    """
+    Get the number of targets in bitset.
+    """
+    return bin(bitset).count('1')
+
+
+class WinIndex:
+    """
+    The WinIndex class holds, for each loadout that is in the top k
+    against any target, a bitset of the targets it ranks at each place
+    from first to kth against.
+    """
+
+    def __init__(self, targets, rank_bitsets, k=1):
+        """
+        Create an index over targets, a list of (wounds, toughness,
+        save) tuples, from rank_bitsets, a dictionary from loadout names
+        to a list of the bitsets of the targets they rank at each place
+        from first to kth against.
+        """
+        self.k = k
+        self.targets = list(targets)
+        self.rank_bitsets = rank_bitsets
+        # A bitset of the targets with each value of each stat.
+        self._axis_bitsets = [{}, {}, {}]
+        for position, target in enumerate(self.targets):
+            for axis_bitsets, value in zip(self._axis_bitsets, target):
+                axis_bitsets[value] = axis_bitsets.get(value, 0) | (
+                    1 << position
+                )
+
+    @staticmethod
+    def from_reducer(reducer):
+        """
+        Build the index of the results kept by reducer, a
+        TopResultsReducer.
+        """
+        targets = reducer.get_targets()
+        rank_bitsets = {}
+        for position, target in enumerate(targets):
+            for rank, (name, _) in enumerate(reducer.get_top(*target)):
+                bitsets = rank_bitsets.setdefault(name, [0] * reducer.k)
+                bitsets[rank] |= 1 << position
+        return WinIndex(targets, rank_bitsets, reducer.k)
+
+    def get_loadout_names(self, pattern='*'):
+        """
+        Get a list of the names of the loadouts in the top k against
+        any target, and which match the shell style pattern, in the
+        order they were first ranked.
+        """
+        return [name for name in self.rank_bitsets if fnmatch(name, pattern)]
+
+    def get_wins(self, name, k=1):
+        """
+        Get the bitset of the targets the loadout called name is in the
+        top k against, which is empty if it is never in the top k.
+        """
+        if not 1 <= k <= self.k:
+            raise InvalidRankError(
+                f'k must be between one and {self.k}, the k of the index'
+            )
+        bitset = 0
+        for rank_bitset in self.rank_bitsets.get(name, [])[:k]:
+            bitset |= rank_bitset
+        return bitset
+
+    def get_region(self, wounds=None, toughness=None, save=None):
+        """
+        Get the bitset of the targets whose wounds, toughness and save
+        are each among the values given, as iterables, or any value, if
+        they are None.
+        """
+        bitset = (1 << len(self.targets)) - 1
+        for axis_bitsets, values in zip(
+                self._axis_bitsets,
+                (wounds, toughness, save)
+        ):
+            if values is None:
+                continue
+            values_bitset = 0
+            for value in values:
+                values_bitset |= axis_bitsets.get(value, 0)
+            bitset &= values_bitset
+        return bitset
+
+    def get_targets(self, bitset):
+        """
+        Get a list of the (wounds, toughness, save) of the targets in
+        bitset, in order.
+        """
+        targets = []
+        position = 0
+        while bitset:
+            if bitset & 1:
+                targets.append(self.targets[position])
+            bitset >>= 1
+            position += 1
+        return targets
+
+    def get_win_counts(self, k=1):
+        """
+        Get a dictionary from the name of each loadout in the top k
+        against any target to how many targets it is in the top k
+        against.
+        """
+        return {
+            name: count(self.get_wins(name, k))
+            for name in self.rank_bitsets
+        }
+
+    def format_win_counts(self, k=1):
+        """
+        Get a report of how many targets each loadout is in the top k
+        against, one per line, in the order they were first ranked.
+        """
+        return ''.join(
+            [
+                f'{name}: {win_count}\n'
+                for name, win_count in self.get_win_counts(k).items()
+                if win_count
+            ]
+        )
+
+    def save(self, path):
+        """
+        Write the index to a JSON file at path, with the bitsets as
+        hexadecimal strings.
+        """
+        index = {
+            'k': self.k,
+            'targets': self.targets,
+            'rank_bitsets': {
+                name: [f'{bitset:x}' for bitset in bitsets]
+                for name, bitsets in self.rank_bitsets.items()
+            }
+        }
+        temporary_path = f'{path}.{os.getpid()}.tmp'
+        with open(temporary_path, 'w') as index_file:
+            json.dump(index, index_file)
+            index_file.write('\n')
+        os.replace(temporary_path, path)
+
+    @staticmethod
+    def load(path):
+        """
+        Read an index written by save.
+        """
+        with open(path) as index_file:
+            index = json.load(index_file)
+        return WinIndex(
+            [tuple(target) for target in index['targets']],
+            {
+                name: [int(bitset, 16) for bitset in bitsets]
+                for name, bitsets in index['rank_bitsets'].items()
+            },
+            index['k']
+        )
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(
+        description='Find the targets loadouts win, from a win index.'
+    )
+    parser.add_argument(
+        '--index',
+        default=os.path.join('results', WIN_INDEX_FILE_NAME),
+        help='the win index to read'
+    )
+    parser.add_argument(
+        '--loadout',
+        default='*',
+        metavar='PATTERN',
+        help='only report loadouts whose name matches this shell style '
+        'pattern'
+    )
+    parser.add_argument('-w', '--wounds', type=parse_range)
+    parser.add_argument('-t', '--toughness', type=parse_range)
+    parser.add_argument('-s', '--save', type=parse_range)
+    parser.add_argument(
+        '--top',
+        type=int,
+        default=1,
+        help='count targets a loadout is in the top this many for '
+        '(default: 1)'
+    )
+    parser.add_argument(
+        '--targets',
+        action='store_true',
+        help='list the targets each loadout wins, as well as how many'
+    )
+    arguments = parser.parse_args(arguments)
+
+    try:
+        index = WinIndex.load(arguments.index)
+    except (OSError, ValueError, KeyError) as error:
+        parser.error(str(error))
+    if not 1 <= arguments.top <= index.k:
+        parser.error(f'--top must be between 1 and {index.k}')
+
+    region = index.get_region(
+        arguments.wounds,
+        arguments.toughness,
+        arguments.save
+    )
+    lines = []
+    for name in index.get_loadout_names(arguments.loadout):
+        wins = index.get_wins(name, arguments.top) & region
+        if not wins:
+            continue
+        lines.append(f'{name}: {count(wins)}\n')
+        if arguments.targets:
+            lines.extend(
+                [
+                    f'    W: {wounds}, T: {toughness}, Sv: {save}\n'
+                    for wounds, toughness, save in index.get_targets(wins)
+                ]
+            )
+    sys.stdout.write(''.join(lines))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())